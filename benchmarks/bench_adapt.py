@@ -0,0 +1,73 @@
+""" adaptive (trial-wise learning) and multi-accumulator simulations
+"""
+from __future__ import division
+import numpy as np
+import pandas as pd
+from radd.adapt import multirace, analyzer
+from .common import adaptive_data, headless_model, igt_cards
+
+
+class AdaptiveSimulator(object):
+    params = [5, 20]
+    param_names = ['nsubjects']
+    timeout = 300
+
+    def setup(self, nsubjects):
+        np.random.seed(0)
+        m = headless_model(adaptive_data(nsubjects=nsubjects), learn=True)
+        self.simRL = m.simRL
+        self.inits = m.inits
+        self.x = self.simRL.preproc_params(m.inits, asarray=True)
+        self.simRL.simulate_model(self.inits, analyze=False)
+
+    def time_simulate_model(self, nsubjects):
+        self.simRL.simulate_model(self.inits, analyze=False)
+
+    def time_cost_fx_rl(self, nsubjects):
+        self.simRL.cost_fx_rl(self.x)
+
+
+class MultiRace(object):
+    params = [25, 100]
+    param_names = ['ntrials']
+
+    def setup(self, ntrials):
+        np.random.seed(0)
+        self.cards = igt_cards(ntrials=ntrials)
+
+    def time_run_trials(self, ntrials):
+        p = {'vd': .09, 'vi': .05, 'a': .006, 'tr': .3, 'xb': .001}
+        multirace.run_trials(p=p, cards=self.cards, nblocks=2, si=.01)
+
+    def time_run_full_sims(self, ntrials):
+        p = {'vd': .09, 'vi': .05, 'a': .006, 'tr': .3, 'xb': .001}
+        multirace.run_full_sims(p, self.cards, alphas_go=[.1, .3], betas=[1, 5], nagents=10, nblocks=2, si=.01)
+
+    def track_qval_error(self, ntrials):
+        """ max |qval| difference between run_full_sims and
+        analyzer.analyze_learning_dynamics on the same engine output (0.)
+        """
+        from radd.compiled import igt
+        p = {'vd': .09, 'vi': .05, 'a': .006, 'tr': .3, 'xb': .001}
+        np.random.seed(0)
+        trial_df, _ = multirace.run_full_sims(p, self.cards, alphas_go=[.3], betas=[5], nagents=1, nblocks=1, si=.01)
+
+        # replay the agent with the seed drawn by run_full_sims
+        np.random.seed(0)
+        seeds = np.random.randint(0, 2**31-1, size=1).astype(np.int64)
+        names = np.sort(self.cards.columns.values)
+        deck = np.ascontiguousarray(self.cards[names].values.astype(float))
+        pvec = multirace.vectorize_params(dict(p), nresp=names.size)
+        vd, vi, a, tr, xb = [np.asarray(pvec[k], dtype=float)[None, :] for k in ['vd', 'vi', 'a', 'tr', 'xb']]
+        dt, si = .001, .01
+        ntime = int(np.ceil((.9 - tr.min()) / dt))
+        out = igt.igt_agents(deck, vd, vi, a, tr, xb, np.array([.3]), np.array([.3]), np.array([5.]), .001, si*np.sqrt(dt), si, dt, ntime, 35, seeds)
+        choices, rts, Q, vdHist, viHist = [x[0] for x in [out[0], out[1], out[2], out[4], out[5]]]
+        fd = {'choices': list(choices),
+              'rts': {k: list(rts[choices==i]) for i, k in enumerate(names)},
+              'qdict': {k: list(Q[:, i]) for i, k in enumerate(names)},
+              'vd_all': pd.DataFrame(vdHist, columns=names),
+              'vi_all': pd.DataFrame(viHist, columns=names)}
+        fd = analyzer.analyze_learning_dynamics(fd, targets=list(names))
+        return np.abs(trial_df.qval.values - np.asarray(fd['qval'])).max()
+    track_qval_error.unit = 'Q-value'
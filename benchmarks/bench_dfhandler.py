@@ -0,0 +1,65 @@
+""" DataHandler observed/weights dataframe construction
+"""
+from __future__ import division
+import os
+import tempfile
+from radd.dfhandler import DataHandler
+from radd.tools import ingest
+from .common import elife_data, synthetic_data, headless_model
+
+
+class MakeDataframes(object):
+    params = ['elife', 'synthetic']
+    param_names = ['dataset']
+    timeout = 300
+
+    def setup(self, dataset):
+        if dataset=='elife':
+            data = elife_data()
+            self.m = headless_model(data, depends_on={'v': 'Cond'})
+        else:
+            data = synthetic_data(nsubjects=40, ntrials=1000)
+            self.m = headless_model(data)
+
+    def time_make_dataframes(self, dataset):
+        DataHandler(self.m).make_dataframes()
+
+    def time_update_quantiles(self, dataset):
+        self.m.handler.update_quantiles(self.m.quantiles)
+
+
+class QuantileWeights(object):
+    params = ['mj', 'asymptotic']
+    param_names = ['method']
+
+    def setup(self, method):
+        self.m = headless_model(synthetic_data(nsubjects=40, ntrials=1000))
+
+    def time_calc_empirical_weights(self, method):
+        self.m.handler.wts_method = method
+        self.m.handler.calc_empirical_weights()
+
+
+class LoadTrials(object):
+    params = [10000, 100000]
+    param_names = ['chunksize']
+
+    def setup(self, chunksize):
+        self.path = os.path.join(tempfile.mkdtemp(), 'trials.csv')
+        synthetic_data(nsubjects=40, ntrials=5000).to_csv(self.path, index=False)
+
+    def time_load_trials(self, chunksize):
+        summary = ingest.load_trials(self.path, groups=['idx', 'flat'], chunksize=chunksize)
+        summary.make_observed()
+
+
+class BootstrapArrays(object):
+    params = [100, 500]
+    param_names = ['nboot']
+    timeout = 300
+
+    def setup(self, nboot):
+        self.m = headless_model(elife_data(), fit_on='bootstrap', depends_on={'v': 'Cond'})
+
+    def time_make_boot_arrays(self, nboot):
+        self.m.handler.make_boot_arrays(nboot, seed=0)
@@ -0,0 +1,24 @@
+""" end-to-end fits with capped iterations
+"""
+from __future__ import division
+import numpy as np
+from .common import elife_data, headless_model
+
+
+class OptimizeFlat(object):
+    timeout = 600
+    number = 1
+    repeat = 3
+
+    def setup(self):
+        np.random.seed(0)
+        self.m = headless_model(elife_data(cond='bsl'))
+        self.m.set_basinparams(nsamples=50, ninits=1, nsuccess=5, niter=5, maxiter=5, popsize=5)
+        self.m.set_fitparams(maxfev=100, maxiter=100, ntrials=2000)
+
+    def time_optimize(self):
+        self.m.optimize(progress=False, get_results=True, powell=False)
+
+    def track_chi(self):
+        finfo, popt, yhat = self.m.optimize(progress=False, get_results=True, powell=False)
+        return finfo['chi']
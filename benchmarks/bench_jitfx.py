@@ -0,0 +1,29 @@
+""" compiled simulation kernels (radd.compiled.jitfx)
+"""
+from __future__ import division
+import numpy as np
+from radd.compiled import jitfx
+from .common import elife_data, headless_model
+
+
+class SimManyDPM(object):
+    params = ([500, 2000, 10000], [.001, .003], [1, 4])
+    param_names = ['ntrials', 'dt', 'nlevels']
+
+    def setup(self, ntrials, dt, nlevels):
+        np.random.seed(0)
+        m = headless_model(elife_data(cond='bsl'))
+        m.set_fitparams(ntrials=ntrials, dt=dt)
+        sim = m.sim
+        p = sim.params_to_array(m.inits, preprocess=True)
+        xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx = p
+        tile = lambda x: np.repeat(np.asarray(x), nlevels, axis=0)
+        self.args = [np.tile(sim.rProb, (nlevels, 1, 1)), np.tile(sim.rProbSS, (nlevels, 1, 1, 1))]
+        self.io = [np.tile(v, (nlevels,) + (1,)*(v.ndim-1)) for v in sim.vectors]
+        self.theta = [tile(xtb), tile(drift), tile(ssdrift), tile(bound), tile(gbase), tile(gOnset), tile(ssOnset), tile(dx), tile(sim.si), dt]
+        # compile (or load from cache) outside of the timed region
+        self.time_sim_many_dpm(ntrials, dt, nlevels)
+
+    def time_sim_many_dpm(self, ntrials, dt, nlevels):
+        dvg, goRT, ssRT = [v.copy() for v in self.io]
+        jitfx.sim_many_dpm(self.args[0], self.args[1], dvg, goRT, ssRT, *self.theta)
@@ -0,0 +1,57 @@
+""" models.Simulator hot paths (parameter handling and analysis)
+"""
+from __future__ import division
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from radd.tools import trials, synthetic
+from .common import elife_data, headless_model
+
+
+class SimulatorFlat(object):
+    params = [1000, 5000]
+    param_names = ['ntrials']
+
+    def setup(self, ntrials):
+        np.random.seed(0)
+        self.m = headless_model(elife_data(cond='bsl'))
+        self.m.set_fitparams(ntrials=ntrials)
+        self.sim = self.m.sim
+        self.x = self.sim.pdict_to_array(self.m.inits)
+        self.goRT, self.ssRT = self.sim.simulate_model(self.m.inits, analyze=False, get_rts=True)
+
+    def time_params_to_array(self, ntrials):
+        self.sim.params_to_array(self.x)
+
+    def time_preproc_params(self, ntrials):
+        self.sim.params_to_array(self.x, preprocess=True)
+
+    def time_analyze(self, ntrials):
+        self.sim.analyze(self.goRT.copy(), self.ssRT.copy())
+
+    def time_simulate_model(self, ntrials):
+        self.sim.simulate_model(self.x)
+
+    def time_cost_fx(self, ntrials):
+        self.sim.cost_fx(self.x)
+
+    def time_simulate_traces(self, ntrials):
+        self.sim._simulate_traces(self.x, ntraces=10, stride=5)
+
+    def time_sim_trials(self, ntrials):
+        trials.sim_trials(self.goRT, self.ssRT, tb=self.sim.tb, ssd=self.sim.ssd, clmap=self.sim.clmap).to_frame()
+
+
+class WriteSyntheticTrials(object):
+    params = [1, 2]
+    param_names = ['nproc']
+    timeout = 300
+
+    def setup(self, nproc):
+        self.m = headless_model(elife_data(cond='bsl'))
+        self.params = pd.DataFrame({'a': np.linspace(.4, .5, 40), 'v': np.linspace(1., 1.2, 40)})
+        self.path = os.path.join(tempfile.mkdtemp(), 'synthetic.csv')
+
+    def time_write_trials(self, nproc):
+        synthetic.write_trials(self.m, self.params, self.path, ntrials=5000, batchsize=5, nproc=nproc, seed=0)
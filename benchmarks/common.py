@@ -0,0 +1,65 @@
+""" shared data builders for the asv benchmark suite
+
+run with `asv run` (results are written to benchmarks/results so they can
+be committed and compared across commits with `asv compare` / `asv publish`)
+"""
+from __future__ import division
+import numpy as np
+import pandas as pd
+import radd
+from radd import build
+
+
+def elife_data(cond=None):
+    data = radd.load_example_data('elife')
+    if cond is not None:
+        data = data[data.Cond==cond]
+    return data.reset_index(drop=True)
+
+
+def adaptive_data(nsubjects=None):
+    """ elife baseline data with the trial/cond/sstrial/probe columns
+    expected by models_rl.Simulator
+    """
+    data = elife_data(cond='bsl')
+    if nsubjects is not None:
+        data = data[data.idx.isin(data.idx.unique()[:nsubjects])]
+    data['trial'] = data.groupby('idx').cumcount() + 1
+    data['cond'] = data.Cond
+    data['sstrial'] = (data.ttype=='stop').astype(int)
+    data['probe'] = data.sstrial
+    return data.reset_index(drop=True)
+
+
+def synthetic_data(nsubjects=20, ntrials=1000, seed=0):
+    """ simulated stop-signal data (flat xdpm at default inits),
+    one simulated session per subject
+    """
+    np.random.seed(seed)
+    m = headless_model(elife_data(cond='bsl'))
+    m.set_fitparams(ntrials=ntrials)
+    dfList = []
+    for idx in range(nsubjects):
+        m.sim.make_io_vectors()
+        df = m.sim.simulate_model(m.inits, analyze=False).to_frame()
+        df.insert(0, 'idx', idx+1)
+        dfList.append(df)
+    data = pd.concat(dfList).reset_index(drop=True)
+    data['ttype'] = data.ttype.astype(str)
+    return data.drop(['flat', 'ssrt'], axis=1)
+
+
+def headless_model(data, **kwargs):
+    kwargs.setdefault('kind', 'xdpm')
+    return build.Model(data=data, headless=True, **kwargs)
+
+
+def igt_cards(ntrials=50, seed=0):
+    """ Iowa gambling task decks: A/B net loss, C/D net gain
+    """
+    rng = np.random.RandomState(seed)
+    draw = lambda p, win, loss: np.where(rng.random_sample(ntrials) < p, win, loss)
+    return pd.DataFrame({'A': draw(.5, 100, -150),
+                         'B': draw(.9, 100, -1150),
+                         'C': draw(.5, 50, 0),
+                         'D': draw(.9, 50, -200)})
@@ -7,9 +7,8 @@ import numpy as np
 import pandas as pd
 from numpy import array
 from scipy.stats.mstats import mquantiles as mq
-from lmfit import fit_report
-from radd.tools import messages, utils, analyze
-from radd import theta, vis
+from radd.tools import messages, utils, analyze, trials
+from radd import theta
 from itertools import product
 
 
@@ -22,8 +21,9 @@ class RADDCore(object):
     summary measures and weight matrix for weighting residuals during optimization.
     """
 
-    def __init__(self, data=None, kind='xdpm', inits=None, fit_on='average', depends_on={'all':'flat'}, ssd_method=None, weighted=True, verbose=False, custompath=None, nested_models=None, learn=False, bwfactors=None, ssdelay=False, gbase=False, quantiles=np.arange(.1, 1.,.1), presample=False, ksfit=False):
+    def __init__(self, data=None, kind='xdpm', inits=None, fit_on='average', depends_on={'all':'flat'}, ssd_method=None, weighted=True, verbose=False, custompath=None, nested_models=None, learn=False, bwfactors=None, ssdelay=False, gbase=False, quantiles=np.arange(.1, 1.,.1), presample=False, ksfit=False, headless=False, compact=False):
         self.kind = kind
+        self.headless = headless
         self.fit_on = fit_on
         self.ssd_method = ssd_method
         self.weighted = weighted
@@ -32,7 +32,9 @@ class RADDCore(object):
         self.ssdelay = ssdelay
         self.gbase = gbase
         self.custompath = custompath
-        self.data = data.copy()
+        # compact dtypes (categorical idx/conds, int8 ttype/response/acc, float32 rt)
+        self.compact = compact
+        self.data = trials.compact_trials(data) if compact else data.copy()
         # self.data = analyze.remove_outliers(data, 3.5)
         self.tb = analyze.estimate_timeboundary(self.data)
         self.idx = list(self.data.idx.unique())
@@ -105,7 +107,12 @@ class RADDCore(object):
         self.handler = DataHandler(self)
         # make dataframes
         self.handler.make_dataframes()
+        self.__set_dataframes__()
 
+
+    def __set_dataframes__(self):
+        """ copy dataframes & fit arrays from self.handler
+        """
         # Group dataframe (nsubjects*nconds*nlevels x ndatapoints)
         self.observedDF = self.handler.observedDF.copy()
         self.observedErr = self.handler.observedErr.copy()
@@ -233,7 +240,7 @@ class RADDCore(object):
                                 'sample_method':'random',
                                 'popsize': 15,
                                 'recombination': .65,
-                                'progress': True,
+                                'progress': not self.headless,
                                 'strategy': 'best1bin',
                                 'disp': False}
         else:
@@ -243,12 +250,15 @@ class RADDCore(object):
             if self.basinparams['method']=='basin':
                 self.basinparams['local_method']='TNC'
                 self.basinparams['tol'] = 1e-20
+            if self.headless:
+                # never create notebook widgets on headless workers
+                self.basinparams['progress'] = False
 
         if hasattr(self, 'opt'):
             old_method = self.opt.basinparams['method']
             self.opt.update(basinparams=self.basinparams)
             self.sim = self.opt.sim
-            if old_method != self.basinparams['method']:
+            if old_method != self.basinparams['method'] and self.opt.progress:
                 self.opt.make_progress_bars()
 
 
@@ -308,6 +318,8 @@ class RADDCore(object):
             self.fitparams['wts'] = self.flat_wts[i]
         if self.fit_on=='subjects':
             self.fitparams['idx']=str(self.idx[i])
+        elif self.fit_on=='bootstrap' and i > 0:
+            self.fitparams['idx'] = 'boot{}'.format(i)
         else:
             self.fitparams['idx'] = 'avg'
 
@@ -339,14 +351,13 @@ class RADDCore(object):
 
 
     def set_conditions(self, depends_on=None, bwfactors=None):
-        data = self.data.copy()
+        data = self.data
         self.depends_on = depends_on
         self.conds = np.unique(np.hstack(listvalues(self.depends_on))).tolist()
         self.nconds = len(self.conds)
         if 'flat' in self.conds:
             self.is_flat = True
-            data['flat'] = 'flat'
-            self.data = data.copy()
+            data['flat'] = pd.Categorical(['flat']*len(data)) if self.compact else 'flat'
         else:
             self.is_flat = False
         clevels = [np.sort(data[c].unique()) for c in self.conds]
@@ -395,7 +406,7 @@ class RADDCore(object):
     def __set_ssd_info__(self):
         """ set ssd_info for upcoming fit and store in fitparams dict
         """
-        if self.fit_on=='average':
+        if self.fit_on in ['average', 'bootstrap']:
             ssdDF = self.ssdDF.copy()
             ssdDF = ssdDF.drop('idx', axis=1)
             ssd = ssdDF.groupby(self.conds).mean().values
@@ -423,7 +434,12 @@ class RADDCore(object):
         """ recalculate observed dataframes w/ passed quantiles array
         """
         self.quantiles = self.fitparams.quantiles
-        self.__make_dataframes__()
+        if hasattr(self, 'handler'):
+            # reuse cached sorted RTs, only quantile cols & wts are recomputed
+            self.handler.update_quantiles(self.quantiles)
+            self.__set_dataframes__()
+        else:
+            self.__make_dataframes__()
         self.fitparams['y'] = self.observed_flat[self.fitparams['ix']]
         self.fitparams['wts'] = self.flat_wts[self.fitparams['ix']]
 
@@ -449,6 +465,8 @@ class RADDCore(object):
         fit_on = 'avg'
         if self.fit_on=='subjects':
             fit_on = 'idx'
+        elif self.fit_on=='bootstrap':
+            fit_on = 'boot'
         model_id.append(fit_on)
         if appendstr is not None:
             model_id.append(appendstr)
@@ -463,14 +481,29 @@ class RADDCore(object):
         self.opt.update(basinparams=self.basinparams, progress=progress)
 
 
+    def set_telemetry(self, sink=None, every=25):
+        """ route optimizer progress to a tools.telemetry sink
+        (e.g. RingBufferSink or JSONLinesSink), emitting every n-th evaluation
+        """
+        self.opt.set_telemetry(sink=sink, every=every)
+
+
+    def set_profiling(self, profile=True):
+        """ accumulate fit pipeline timers and kernel counters, readable
+        after a fit with self.opt.profiler.report()
+        """
+        self.opt.set_profiling(profile)
+
+
     def toggle_pbars(self, progress=False, models=None):
         self.set_basinparams(progress=progress)
-        if not progress:
+        if not progress or self.headless:
             return None
         if self.fit_on=='subjects':
             status = ''.join(['Subj {}', '/{}'.format(self.nidx)])
             self.idxbar = utils.PBinJ(n=self.nidx, color='y', status=status)
         if models is not None:
+            from radd import vis
             pvary = [list(depends_on) for depends_on in models]
             pnames = [vis.parameter_name(p, False) for p in pvary]
             self.mbar = utils.PBinJ(n=len(pnames), color='b', status='{}')
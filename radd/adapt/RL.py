@@ -1,13 +1,12 @@
 #!/usr/local/bin/env python
 from __future__ import division
+import itertools
 import numpy as np
 from numpy import array
 from numpy.random import sample as rs
 from numpy import newaxis as na
 import pandas as pd
 from scipy.stats import sem
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 class Environment(object):
 
@@ -68,13 +67,66 @@ class Agent(Environment):
         self.blocksdf['Q']=0
 
 
-    def iter_params(self):
-        for i in self.blocksdf.index.values:
-            ap, an, b = self.blocksdf.loc[i, ['ap', 'an', 'b']].values
-            self.set_params(ap=ap, an=an, b=b)
-            P, Q = self.simulate_task(return_scores=True)
-            self.blocksdf.loc[i, 'P'] = P
-            self.blocksdf.loc[i, 'Q'] = Q
+    def iter_params(self, seed=None):
+        """ simulate every row of blocksdf (parameter set x niter) as one
+        batch of agents and store their P and Q scores in blocksdf
+        """
+        P, Q = self.simulate_batch(self.blocksdf.ap.values, self.blocksdf.an.values, self.blocksdf.b.values, seed=seed)
+        self.blocksdf['P'] = P
+        self.blocksdf['Q'] = Q
+
+
+    def simulate_batch(self, ap, an, b, trajectories=False, seed=None):
+        """ simulate the task for a batch of agents at once (vectorized across
+        agents, sequential over trials), agent i with learning rates ap[i]
+        (positive rpe), an[i] (negative rpe) and inverse temperature b[i]
+        ::Arguments::
+            ap, an, b (array):
+                agent parameters (broadcast against each other)
+            trajectories (bool):
+                also return choices (nagents x ntrials) and Q-values and choice
+                probabilities (nagents x ntrials+1 x nalt, row 0 = initial)
+            seed (int):
+                seed for a private random stream (default: global numpy state)
+        ::Returns::
+            P, Q (arrays): payoff and sensitivity scores of each agent
+            (see igt_scores) [, choices, qvals, pvals]
+        """
+        ap, an, b = [np.asarray(x, dtype=float).ravel() for x in np.broadcast_arrays(ap, an, b)]
+        nagents = ap.size
+        rand = np.random if seed is None else np.random.RandomState(seed)
+        u = rand.random_sample((self.ntrials, nagents))
+        rewards = self.cards.iloc[self.trials].values.astype(float)
+
+        agents = np.arange(nagents)
+        qvals = np.zeros((nagents, self.nalt))
+        pvals = np.ones((nagents, self.nalt)) / self.nalt
+        choices = np.zeros((nagents, self.ntrials), dtype=np.int64)
+        if trajectories:
+            qtraj = np.zeros((nagents, self.ntrials+1, self.nalt))
+            ptraj = np.zeros((nagents, self.ntrials+1, self.nalt))
+            ptraj[:, 0] = pvals
+
+        for t in range(self.ntrials):
+            # sample choices from current probabilities (inverse cdf)
+            winner = np.minimum((pvals.cumsum(axis=1) <= u[t][:, na]).sum(axis=1), self.nalt-1)
+            q = qvals[agents, winner]
+            rpe = rewards[t, winner] - q
+            qvals[agents, winner] = q + np.where(rpe>0, ap, an) * rpe
+            bq = b[:, na] * qvals
+            expq = np.exp(bq - bq.max(axis=1)[:, na])
+            pvals = expq / expq.sum(axis=1)[:, na]
+            choices[:, t] = winner
+            if trajectories:
+                qtraj[:, t+1] = qvals
+                ptraj[:, t+1] = pvals
+
+        A, B, C, D = [(choices==i).sum(axis=1) for i in range(4)]
+        P = (C+D) - (A+B)
+        Q = (B+D) - (A+C)
+        if trajectories:
+            return P, Q, choices, qtraj, ptraj
+        return P, Q
 
 
     def simulate_task(self, return_scores=False):
@@ -124,6 +176,8 @@ class Agent(Environment):
         return [P, Q]
 
     def plot_summary(self):
+        import seaborn as sns
+        import matplotlib.pyplot as plt
         sns.set(style='darkgrid', context='paper', font_scale=1.4)
         titles=['Order of Choices','Number of Choices per Card', 'Change in Q(card)',
             'Change in P(card)']
@@ -5,7 +5,6 @@ from numpy import array
 from numpy.random import sample as rs
 from numpy import newaxis as na
 import pandas as pd
-from radd import vis
 from copy import deepcopy
 
 
@@ -35,8 +34,8 @@ def analyze_learning_dynamics(fd, broadcast=True, targets=['A', 'B', 'C', 'D']):
     fd['choice']=choice_vec
     rts_copy = deepcopy(fd['rts'])
     fd['rt'] = [rts_copy[choice].pop(0) for i, choice in enumerate(choice_vec)]
-    qcopy = deepcopy(qdict)
-    fd['qval'] = [qcopy[choice].pop(0) for choice in choice_vec]
+    # qdict holds the Q-value of every deck before each trial
+    fd['qval'] = [qdict[choice][i] for i, choice in enumerate(choice_vec)]
 
     fd['vd'] = [vd_all.loc[i, choice] for i, choice in enumerate(choice_vec)]
     fd['vi'] = [vi_all.loc[i, choice] for i, choice in enumerate(choice_vec)]
@@ -79,6 +78,33 @@ def format_dataframes(fd):
     return igtdf, agdf
 
 
+def trialwise_moments(df, col='rt', by='idx', alpha=None, window=None, quantiles=[.1, .5, .9]):
+    """ one-pass running summary of col within each group of df (in row order)
+    ::Arguments::
+        col (str):          column to summarize (nan rows are skipped)
+        by (str/list):      grouping columns (e.g. subject)
+        alpha (float):      exponentially weighted moments with smoothing alpha
+                            (default: cumulative Welford mean/variance)
+        window (int):       also return quantiles of the last window trials
+    ::Returns::
+        DataFrame (index of df) with <col>_mean, <col>_var [, <col>_q<quantile>]
+    """
+    from radd.compiled import streaming
+    q = np.asarray(quantiles, dtype=float)
+    values = df[col].values.astype(float)
+    qcols = ['{}_q{}'.format(col, qi) for qi in quantiles] if window else []
+    out = np.full((len(df), 2 + len(qcols)), np.nan)
+    for rows in df.groupby(by, sort=False).indices.values():
+        x = np.ascontiguousarray(values[rows])
+        if alpha is None:
+            out[rows, :2] = streaming.running_moments(x)
+        else:
+            out[rows, :2] = streaming.ew_moments(x, alpha)
+        if window:
+            out[rows, 2:] = streaming.window_quantiles(x, int(window), q)
+    return pd.DataFrame(out, index=df.index, columns=[col+'_mean', col+'_var'] + qcols)
+
+
 def calcPostErrAdjust(df, ntrials=200):
     if type(df.ttype.values[0]) is str:
         ssErrDF = df[(df.ttype=='stop')&(df.response==1)&(df.rt<.68)]
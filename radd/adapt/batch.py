@@ -0,0 +1,123 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import numpy as np
+import pandas as pd
+from copy import deepcopy
+
+# read-only trials data shared by all units in a worker process
+# (set once per worker by init_worker, inherited on fork)
+_shared = {}
+
+
+def init_worker(data):
+    _shared['data'] = data
+
+
+def fit_adaptive(data, inits=None, units=['idx', 'cond'], kind='xdpm', nproc=1, nblocks=30, nruns=20, simfx_version='v1', ratesOnly=True, hop=False, basinparams={}, fitparams={}, seed=None):
+    """ fit the adaptive (learning) model separately to each unit of data
+    (e.g. every subject x condition) across a pool of nproc worker processes.
+    Each unit builds its own headless Model/models_rl.Simulator over its rows
+    of the shared data, fits the learning rates (rlpopt), polishes them with
+    gradient descent and simulates nruns replicates of its block curves
+    ::Arguments::
+        data (DataFrame):
+            trials data (trial, cond, sstrial, probe columns, see models_rl)
+        inits (dict):
+            starting parameters (e.g. popt of a static fit); defaults to theta defaults
+        units (list):
+            columns defining the fitting units
+        nproc (int):
+            number of worker processes (1 fits units serially in this process)
+        nblocks (int):
+            number of trial blocks in the fitted/predicted curves
+        nruns (int):
+            number of replicates simulated for the block-curve predictions
+        simfx_version (str):
+            learning rule (see radd.compiled.learning.rules)
+        ratesOnly (bool):
+            only fit learning rates (AX, BX, PX), other params fixed at inits
+        hop (bool):
+            use Optimizer.hop_around (sampled inits) instead of a single optimize_global
+        basinparams, fitparams (dict):
+            passed to Model.set_basinparams / set_fitparams for every unit
+        seed (int):
+            seed for the per-unit random streams
+    ::Returns::
+        fitdf (DataFrame): fit statistics, one row per unit
+        poptdf (DataFrame): optimized parameters (rlpopt), one row per unit
+        yhatdf (DataFrame): observed and predicted rt/acc (+ 95% CI) per unit and block
+    """
+    if isinstance(units, str):
+        units = [units]
+    data = data.reset_index(drop=True)
+    groups = data.groupby(units).indices
+    keys = sorted(groups)
+    seeds = np.random.RandomState(seed).randint(0, 2**31-1, size=len(keys))
+    opts = {'inits': inits, 'kind': kind, 'nblocks': nblocks, 'nruns': nruns, 'simfx_version': simfx_version, 'ratesOnly': ratesOnly, 'hop': hop, 'basinparams': basinparams, 'fitparams': fitparams}
+    tasks = [(key, groups[key], seeds[i], opts) for i, key in enumerate(keys)]
+
+    if nproc == 1:
+        init_worker(data)
+        results = [fit_unit(*task) for task in tasks]
+        _shared.clear()
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=nproc, initializer=init_worker, initargs=(data,)) as pool:
+            futures = [pool.submit(fit_unit, *task) for task in tasks]
+            results = [f.result() for f in futures]
+
+    fits, popts, yhats = [], [], []
+    for key, finfo, popt, yhat in results:
+        label = dict(zip(units, key if isinstance(key, tuple) else (key,)))
+        fits.append(dict(label, **finfo.drop('idx', errors='ignore').to_dict()))
+        popts.append(dict(label, **popt))
+        for col, val in list(label.items())[::-1]:
+            yhat.insert(0, col, val)
+        yhats.append(yhat)
+    fitdf = pd.DataFrame(fits)
+    poptdf = pd.DataFrame(popts)
+    yhatdf = pd.concat(yhats).reset_index(drop=True)
+    return fitdf, poptdf, yhatdf
+
+
+def fit_unit(key, rows, seed, opts):
+    """ fit one unit (rows of the shared data) and return
+    key, finfo (Series), rlpopt (dict), block curves (DataFrame)
+    """
+    from radd import build
+    np.random.seed(seed)
+    data = _shared['data'].iloc[rows].reset_index(drop=True)
+
+    m = build.Model(data=data, kind=opts['kind'], inits=opts['inits'], learn=True, headless=True)
+    if opts['basinparams']:
+        m.set_basinparams(**opts['basinparams'])
+    if opts['fitparams']:
+        m.set_fitparams(**opts['fitparams'])
+    opt = m.opt
+    opt.simRL.update(nblocks=opts['nblocks'], simfx_version=opts['simfx_version'])
+
+    p = deepcopy(opt.inits)
+    if opts['hop']:
+        gpopt = opt.hop_around(learn=True, ratesOnly=opts['ratesOnly'])
+    else:
+        gpopt, gfmin = opt.optimize_global(p, learn=True, ratesOnly=opts['ratesOnly'])
+    finfo, rlpopt, yhat = opt.gradient_descent(p=gpopt, learn=True)
+    opt.rlpopt = deepcopy(rlpopt)
+    return key, finfo, rlpopt, block_curves(opt.simRL, rlpopt, nruns=opts['nruns'], seed=seed)
+
+
+def block_curves(simRL, p, nruns=20, seed=None):
+    """ observed and simulated (nruns replicates) go rt and stop accuracy
+    block curves of a models_rl.Simulator, one row per block
+    (blocks without observed trials are nan)
+    """
+    rt, rtErr, acc, accErr = simRL.simulate_model_nruns(p, nruns=nruns, seed=seed, get_var=True)
+    df = pd.DataFrame({'block': np.arange(1, simRL.nblocks+1)})
+    data = simRL.data
+    blocks = df.block.values
+    for name, trials, col in [('rt', data[data.response==1.], 'rt'), ('acc', data[data.ttype==0.], 'acc')]:
+        table = pd.pivot_table(trials, values=col, columns=simRL.blocksCol, index='idx').reindex(columns=blocks)
+        df[name+'_obs'] = table.mean().values
+        df[name+'_obs_err'] = table.sem().values*1.96
+    df['rt'], df['rt_err'], df['acc'], df['acc_err'] = rt, rtErr, acc, accErr
+    return df
@@ -1,4 +1,5 @@
 from __future__ import division
+import warnings
 from future.utils import listvalues
 from copy import deepcopy
 import pandas as pd
@@ -6,9 +7,8 @@ import numpy as np
 from numpy.random import random_sample as randsample
 from scipy.stats.mstats import mquantiles
 from itertools import product
-from radd import build, theta
+from radd import theta
 from radd.tools.analyze import blockify_trials
-from radd.compiled import jitfx
 import itertools
 
 class Simulator(object):
@@ -52,17 +52,17 @@ class Simulator(object):
             if hasattr(self, 'data'):
                 self.data = blockify_trials(self.data, nblocks=self.nblocks)
                 self.rtBlocks, rtErr, self.saccBlocks, saccErr = self.blockify_data(self.data, measures=['rt', 'acc'], get_var=True)
-                self.rt_weights = rtErr.mean() / rtErr
-                self.sacc_weights = saccErr.mean() / saccErr
+                self.rt_weights = self.block_weights(rtErr)
+                self.sacc_weights = self.block_weights(saccErr)
         if 'data' in kw_keys:
             self.get_trials_data(kwargs['data'])
         if 'simfx_version' in kw_keys:
-            if kwargs['simfx_version'] == 'v1':
-                self.simfx_version = kwargs['simfx_version']
-                self.simfx = self.simulate_model
-            elif kwargs['simfx_version'] == 'v2':
-                self.simfx_version = kwargs['simfx_version']
-                self.simfx = self.simulate_model_alt
+            # name of a compiled update rule in radd.compiled.learning.rules
+            # ('v1'/'drift', 'v2'/'bound' or any registered with @learning_rule)
+            from radd.compiled import learning
+            if kwargs['simfx_version'] not in learning.rules:
+                raise ValueError("unknown learning rule {}, choose from {}".format(kwargs['simfx_version'], sorted(learning.rules)))
+            self.simfx_version = kwargs['simfx_version']
         self.nlevels = self.fitparams['nlevels']
         self.y = self.fitparams.y.flatten()
         self.wts = self.fitparams.wts.flatten()
@@ -72,33 +72,55 @@ class Simulator(object):
 
 
     def cost_fx_rl(self, p):
-        # resultsDF = self.simulate_model(p, analyze=False)
-        resultsDF = self.simfx(p, analyze=False)
-        return self.analyze_trials(resultsDF)
+        results = self.simulate_results(p)
+        return self.analyze_trials(results)
 
 
     def cost_fx(self, p, analyze=True):
-        resultsDF = self.simfx(p, analyze=False)
-        return self.analyze_trials(resultsDF)
+        results = self.simulate_results(p)
+        return self.analyze_trials(results)
 
 
     def cost_fx_lmfit(self, lmParams, sse=False):
-        # resultsDF = self.simulate_model_nruns(lmParams.valuesdict(), analyze=False)
-        resultsDF = self.simfx(lmParams.valuesdict(), analyze=False)
-        saccBlocks = resultsDF[resultsDF.ttype==0].groupby(self.blocksCol).mean().acc.values
-        rtBlocks = resultsDF[resultsDF.response==1].groupby(self.blocksCol).mean().rt.values
+        results = self.simulate_results(lmParams.valuesdict())
+        rtBlocks, saccBlocks = self.block_means(results)
         rtErr = self.rt_weights * (rtBlocks*15 - self.rtBlocks*15)
         saccErr = self.sacc_weights * (saccBlocks - self.saccBlocks)
         return np.hstack([rtErr, saccErr])
 
 
-    # def simulate_model_nruns(self, p, analyze=True):
-        #     self.preproc_params(p)
-        #     res = jitfx.sim_dpm_learning_nruns(self.nresults, self.rProb, self.rProbSS, self.xtb, self.idxArray, self.vProb, self.vsProb, self.bound, self.gOnset, self.AX, self.BX, self.PX, self.dx, self.dt, self.tb, self.ntrials, self.nruns)
-        #     if analyze:
-        #         return self.analyze(res)
-        #     self.nresultsDF.loc[:, self.resultsHeader] = res
-        #     return self.nresultsDF
+    def simulate_model_nruns(self, p, nruns=None, seed=None, get_var=False):
+        """ simulate nruns independent replicates of the trial sequence in
+        parallel (compiled) and return block-averaged curves
+        ::Arguments::
+            p (dict):           parameter dictionary
+            nruns (int):        number of replicates (default: self.nruns)
+            seed (int):         seed for the replicate random streams
+            get_var (bool):     also return 95% CI (sem*1.96) across subjects
+        ::Returns::
+            rtBlocks, saccBlocks (arrays of length nblocks), averaged over
+            subjects (replicates pooled) like blockify_data; if get_var,
+            [rtBlocks, rtErr, saccBlocks, saccErr]
+        """
+        if nruns is None:
+            nruns = self.nruns
+        self.preproc_params(p)
+        seeds = np.random.RandomState(seed).randint(0, 2**31-1, size=nruns)
+        from radd.compiled import learning
+        rule = learning.rules[self.simfx_version]
+        rtSum, rtN, saccSum, saccN = learning.sim_dpm_learning_nruns(rule, self.results, self.blockIX, self.nblocks, self.xtb, self.idxOffsets, self.drift, self.ssdrift, self.bound, self.gOnset, self.AX, self.BX, self.PX, self.dx, self.dt, self.tb, self.ntime, seeds.astype(np.int64))
+        # pool replicates, then average subject block means (nan if empty)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rtIdx = rtSum.sum(axis=0) / rtN.sum(axis=0)
+            saccIdx = saccSum.sum(axis=0) / saccN.sum(axis=0)
+        tables = [rtIdx, saccIdx]
+        # blocks without trials (e.g. stop trials) in every subject stay nan
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            if get_var:
+                sem = lambda x: np.nanstd(x, axis=0, ddof=1) / np.sqrt(np.sum(~np.isnan(x), axis=0))
+                return list(itertools.chain.from_iterable([[np.nanmean(x, axis=0), sem(x)*1.96] for x in tables]))
+            return [np.nanmean(x, axis=0) for x in tables]
 
     # def simulate_model(self, p, analyze=True):
     #     self.preproc_params(p)
@@ -112,19 +134,39 @@ class Simulator(object):
         #pd.concat([resultsDF, self.data[['cond', 'sstrial', 'probe', 'trial', self.blocksCol]]], axis=1)
         # return self.resultsDF
 
-    def simulate_model(self, p, analyze=True):
+    def simulate_results(self, p):
+        """ run the learning kernel with the simfx_version update rule and
+        return the results matrix (columns: self.resultsHeader) without a DataFrame
+        """
+        from radd.compiled import learning
         self.preproc_params(p)
         results = np.copy(self.results)
-        jitfx.sim_dpm_learning(results, self.rProb, self.rProbSS, self.xtb, self.idxArray, self.drift, self.ssdrift, self.bound, self.gOnset, self.AX, self.BX, self.PX, self.dx, self.dt, self.tb, self.ntrials)
-        if analyze:
-            return self.analyze(results)
-        self.resultsDF.loc[:, self.resultsHeader] = results
-        return self.resultsDF
+        rule = learning.rules[self.simfx_version]
+        learning.sim_dpm_learning(rule, results, self.rProb, self.rProbSS, self.xtb, self.idxOffsets, self.drift, self.ssdrift, self.bound, self.gOnset, self.AX, self.BX, self.PX, self.dx, self.dt, self.tb)
+        return results
+
+
+    def block_means(self, results):
+        """ block means of go RT (response==1) and stop accuracy (ttype==0)
+        computed with bincount over the integer block index (self.blockIX).
+        Only blocks with observed trials are returned (aligned with
+        self.rtBlocks/saccBlocks); observed blocks without any simulated
+        response get rt=tb (every trial timed out)
+        """
+        if isinstance(results, pd.DataFrame):
+            results = results[self.resultsHeader].values
+        idxIX, ttypeIX, ssdIX, respIX, accIX, rtIX, scoreIX = self.dataColsIX
+        blockMeans = []
+        for mask, col, keep, fill in [(results[:, respIX]==1., rtIX, self.rtKeep, self.tb), (results[:, ttypeIX]==0., accIX, self.saccKeep, np.nan)]:
+            n = np.bincount(self.blockIX, weights=mask, minlength=self.nblocks)
+            total = np.bincount(self.blockIX, weights=mask*results[:, col], minlength=self.nblocks)
+            means = np.where(n > 0, total / np.maximum(n, 1), fill)
+            blockMeans.append(means[keep])
+        return blockMeans
 
-    def simulate_model_alt(self, p, analyze=True):
-        self.preproc_params(p)
-        results = np.copy(self.results)
-        jitfx.sim_dpm_learning_alt(results, self.rProb, self.rProbSS, self.xtb, self.idxArray, self.drift, self.ssdrift, self.bound, self.gOnset, self.AX, self.BX, self.PX, self.dx, self.dt, self.tb, self.ntrials)
+
+    def simulate_model(self, p, analyze=True):
+        results = self.simulate_results(p)
         if analyze:
             return self.analyze(results)
         self.resultsDF.loc[:, self.resultsHeader] = results
@@ -195,6 +237,11 @@ class Simulator(object):
     def make_results_matrix(self):
 
         dataCols = ['idx', 'ttype', 'ssd', 'response', 'acc', 'rt']
+        # sort trials by subject (stable, keeps trial order) so each subject
+        # is a contiguous block of rows in results, sliced by (start, stop)
+        self.data = self.data.sort_values('idx', kind='mergesort').reset_index(drop=True)
+        self.idxArray, start, ntrials = np.unique(self.data.idx.values, return_index=True, return_counts=True)
+        self.idxOffsets = np.ascontiguousarray(np.vstack([start, start + ntrials]).T, dtype=np.int64)
         index = self.data.index.values
         resCols = np.array(dataCols + ['score', 'drift', 'bound'])
         resData = np.zeros((index.size, resCols.size))
@@ -208,6 +255,10 @@ class Simulator(object):
         self.resultsDF = pd.concat([resultsDF, self.data[['cond', 'sstrial', 'probe', 'trial', self.blocksCol]]], axis=1)
 
         self.dataColsIX = [self.resultsHeader.index(col) for col in dataCols + ['score']]
+        self.blockIX = self.data[self.blocksCol].values.astype(np.int64) - 1
+        # blocks with observed go responses / stop trials (see blockify_data)
+        self.rtKeep = np.bincount(self.blockIX, weights=self.data.response.values==1., minlength=self.nblocks) > 0
+        self.saccKeep = np.bincount(self.blockIX, weights=self.data.ttype.values==0., minlength=self.nblocks) > 0
         self.rtMatrix = np.zeros((nidx, self.nblocks))
         self.saccMatrix = np.zeros((nidx, self.nblocks))
         self.nresultsDF = pd.concat([self.resultsDF]*self.nruns)
@@ -247,9 +298,21 @@ class Simulator(object):
         self.data = blockify_trials(data, nblocks=self.nblocks)
         self.rtBlocks, rtErr, self.saccBlocks, saccErr = self.blockify_data(self.data, measures=['rt', 'acc'], get_var=True)
 
-        self.rt_weights = rtErr.mean() / rtErr
-        self.sacc_weights = saccErr.mean() / saccErr
-        self.idxArray = self.data.idx.unique()
+        self.rt_weights = self.block_weights(rtErr)
+        self.sacc_weights = self.block_weights(saccErr)
+
+
+    def block_weights(self, err):
+        """ inverse-error block weights (mean(err) / err). Blocks with an
+        undefined or zero error (single subject, constant accuracy) get
+        weight 1 so fits to individual subjects stay finite
+        """
+        err = np.asarray(err, dtype=float)
+        ok = np.isfinite(err) & (err > 0)
+        wts = np.ones(err.size)
+        if ok.any():
+            wts[ok] = err[ok].mean() / err[ok]
+        return wts
 
 
     def format_params(self):
@@ -314,15 +377,12 @@ class Simulator(object):
 
 
     def sim_rt_sacc_blocks(self, p):
-        df = self.simfx(p, analyze=False)
-        saccBlocks = df[df.ttype==0].groupby(self.blocksCol).mean().acc.values
-        rtBlocks = df[df.response==1].groupby(self.blocksCol).mean().rt.values
+        rtBlocks, saccBlocks = self.block_means(self.simulate_results(p))
         return np.hstack([rtBlocks*12, saccBlocks])
 
 
-    def analyze_trials(self, resultsDF):
-        saccBlocks = resultsDF[resultsDF.ttype==0].groupby(self.blocksCol).mean().acc.values
-        rtBlocks = resultsDF[resultsDF.response==1].groupby(self.blocksCol).mean().rt.values
+    def analyze_trials(self, results):
+        rtBlocks, saccBlocks = self.block_means(results)
         rtErr = np.sum((self.rt_weights * (rtBlocks*12 - self.rtBlocks*12))**2)
         saccErr = np.sum((self.sacc_weights * (saccBlocks - self.saccBlocks))**2)
         return rtErr + saccErr
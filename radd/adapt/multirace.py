@@ -6,8 +6,8 @@ from numpy import array
 from numpy.random import sample as rs
 from numpy import newaxis as na
 import pandas as pd
-from radd.IGT import visr, analyzer
 from copy import deepcopy
+from collections import OrderedDict
 from radd import theta
 from scipy.stats.mstats import mquantiles as mq
 
@@ -21,45 +21,80 @@ ss_RT = lambda ontime, rbool: ontime[:, :, na] + (rbool*np.where(rbool==0., np.n
 # RTQ = lambda zpd, prob: map((lambda x: mq(x[0][x[0] < x[1]], prob)), zpd)
 RTQ = lambda zpd: [mquantiles(rt[rt < deadline], prob) for rt, deadline in zpd]
 
-def run_full_sims(p, env=pd.DataFrame, alphas_go=[], alphas_no=None, betas=[], a_Q=.1, nblocks=2, nagents=30, si=.01, agent_list=[]):
-
-    n_a = len(alphas_go)
-    n_b = len(betas)
-    trials = np.arange(1, (len(env)*nblocks)+1)
-
+def run_full_sims(p, env=pd.DataFrame, alphas_go=[], alphas_no=None, betas=[], nblocks=2, nagents=30, si=.01, aX=.001, dt=.001, tb=.9, maxtries=35):
+    """ simulate nagents IGT agents for every (alpha, beta) combination with
+    the compiled multirace engine (radd.compiled.igt, agents run in parallel)
+    ::Arguments::
+        p (dict):
+            parameter dictionary (vd, vi, a, tr, xb; scalars or one per deck)
+        env (DataFrame):
+            card values (ntrials x decks), repeated nblocks times
+        alphas_go, alphas_no (list):
+            learning rates for rewards above/below the current Q-value (alphas_no
+            defaults to alphas_go, paired by position)
+        betas (list):
+            softmax inverse temperatures
+    ::Returns::
+        trial_df (DataFrame): trialwise choices, rts, Q-values and drift-rates of every agent
+        igt_df (DataFrame): IGT payoff (P) and sensitivity (Q) scores of every agent
+    """
+    from radd.compiled import igt
     if alphas_no is None:
-        alphas_no=deepcopy(alphas_go)
-
-    agroups = np.hstack([np.hstack([np.arange(n_a)]*n_b)]*nagents)
-    bgroups = np.sort(np.hstack([np.sort(np.hstack([np.arange(n_b)]*n_a))]*nagents))
-    agents = np.sort(np.hstack([np.arange(nagents)]*n_a*n_b))
-    group = 0
-    for agroup, bgroup, agent_i in zip(agroups, bgroups, agents):
+        alphas_no = deepcopy(alphas_go)
+    names = np.sort(env.columns.values)
+    deck = np.ascontiguousarray(np.tile(env[names].values.astype(float), (nblocks, 1)))
+    ntrials, nalt = deck.shape
 
-        beta = betas[bgroup]
-        a_go = alphas_go[agroup]
-        a_no = alphas_no[agroup]
+    # agent x beta x alpha
+    agents, bgroups, agroups = [x.ravel() for x in np.meshgrid(np.arange(nagents), np.arange(len(betas)), np.arange(len(alphas_go)), indexing='ij')]
+    ngroups = agents.size
+    a_go = np.asarray(alphas_go, dtype=float)[agroups]
+    a_no = np.asarray(alphas_no, dtype=float)[agroups]
+    beta = np.asarray(betas, dtype=float)[bgroups]
 
-        pcopy=deepcopy(p)
-        #p_rand = theta.random_inits(pcopy.keys())
-        sim_out = run_trials(pcopy, env, nblocks=nblocks, si=si, a_go=a_go, a_no=a_no, beta=beta, a_Q=a_Q)
-        choices, rts, all_traces, qdict, choicep, vd_all, vi_all = sim_out
+    pvec = vectorize_params(deepcopy(p), nresp=nalt)
+    vd, vi, a, tr, xb = [np.tile(np.asarray(pvec[k], dtype=float), (ngroups, 1)) for k in ['vd', 'vi', 'a', 'tr', 'xb']]
+    dx = si * np.sqrt(dt)
+    ntime = int(np.ceil((tb - tr.min()) / dt))
+    seeds = np.random.randint(0, 2**31-1, size=ngroups).astype(np.int64)
 
-        format_dict = {'agent': agent_i+1, 'trial': trials, 'a_go': a_go, 'a_no': a_no,
-        'adiff': a_go-a_no, 'choices':choices, 'rts': rts, 'group': group, 'agroup': agroup+1,
-        'bgroup': bgroup+1, 'qdict': qdict, 'choicep':choicep, 'vd_all':vd_all, 'vi_all':vi_all,
-        'beta': beta}
+    choices, rts, Q, P, vdHist, viHist, nfailed = igt.igt_agents(deck, vd, vi, a, tr, xb, a_go, a_no, beta, aX, dx, si, dt, ntime, maxtries, seeds)
+    for pct in 100. * nfailed[nfailed >= .1 * ntrials] / ntrials:
+        print("trials with no winner {:.2f}%".format(pct))
 
-        format_dict_updated = analyzer.analyze_learning_dynamics(format_dict)
-        igtdf, agdf = analyzer.format_dataframes(format_dict_updated)
-        agent_list.append([agdf, igtdf])
-        group += 1
+    onehot = choices[:, :, na] == np.arange(nalt)
+    rows = np.arange(ngroups)[:, na]
+    cols = np.arange(ntrials)[na, :]
+    # Q-value of the chosen deck before each trial (see analyzer.analyze_learning_dynamics)
+    qval = Q[rows, cols, choices]
+    vdiffAll = vdHist - viHist
+    deckIX = dict(zip(names, range(nalt)))
+    vsum = lambda decks: np.sum([vdiffAll[:, :, deckIX[d]] for d in decks], axis=0)
 
-    trial_df = pd.concat([ag[0] for ag in agent_list]) #.groupby(['group', 'trial']).mean().reset_index()
-    igt_df = pd.concat([ag[1] for ag in agent_list], axis=1).T #.groupby('group').mean().reset_index()
+    rep = lambda x: np.repeat(x, ntrials)
+    trial_df = pd.DataFrame(OrderedDict([
+        ('agent', rep(agents+1)),
+        ('trial', np.tile(np.arange(1, ntrials+1), ngroups)),
+        ('agroup', rep(agroups+1)),
+        ('qval', qval.ravel()),
+        ('vd', vdHist[rows, cols, choices].ravel()),
+        ('vi', viHist[rows, cols, choices].ravel()),
+        ('vdiff', vdiffAll[rows, cols, choices].ravel()),
+        ('v_opt_diff', (vsum('CD') - vsum('AB')).ravel()),
+        ('v_imp_diff', (vsum('BD') - vsum('AC')).ravel()),
+        ('choice', names[choices.ravel()]),
+        ('rt', rts.ravel()),
+        ('a_go', rep(a_go)),
+        ('a_no', rep(a_no)),
+        ('adiff', rep(a_go - a_no)),
+        ('beta', rep(beta))]), index=np.tile(np.arange(ntrials), ngroups))
 
+    counts = onehot.sum(axis=1)
+    A, B, C, D = [counts[:, deckIX[d]] for d in 'ABCD']
+    igt_df = pd.DataFrame(OrderedDict([('agent', agents+1), ('agroup', agroups+1), ('a_go', a_go), ('a_no', a_no), ('beta', beta), ('P', (C+D) - (A+B)), ('Q', (B+D) - (A+C))]))
     return [trial_df, igt_df]
 
+
 def vectorize_params(p, pcmap={'vd': ['vd_a', 'vd_b', 'vd_c', 'vd_d'], 'vi': ['vi_a', 'vi_b', 'vi_c', 'vi_d']}, nresp=4, sstrial=False):
     constants = ['a', 'tr', 'vd', 'vi', 'xb']
     if sstrial:
@@ -85,70 +120,89 @@ def rew_func(rprob):
         return 0
 
 
-def run_trials(p=None, cards=None, nblocks=2, si=.1, a_go=.2, a_no=.2, beta=5, aX=.001, dt=.001, plot=False, tb=1.1):
+def run_trials(p=None, cards=None, nblocks=2, si=.1, a_go=.2, a_no=.2, beta=5, aX=.001, dt=.001, plot=False, tb=.9):
     """simulate series of trials with learning
     Arguments:
         p (dict): parameter dictionary
         cards (DataFrame): pandas DF (ntrials x nalt) with choice outcome vaulues
+        plot (bool): record execution traces and plot them (visr.plot_traces_rts)
     Returns:
         choices (list): choice made on each trial
         rts (dict): rt for each trial (winner rt)
-        all_traces (list): execution process traces truncated to length of winner
+        all_traces (list): execution process traces truncated to length of winner (only if plot)
         qdict (dict): sequence of Q-value updates for each alt
     """
+    from radd.compiled import igt
     if p is None:
         p={'vd':.09, 'vi':.05}; p['a']=.006; p['tr']=.3; p['xb']=.001
-    trials = cards.copy()
-    trials = trials.append([trials]*(nblocks-1)).reset_index()
-    trials.rename(columns={'index':'t'}, inplace=True)
-    ntrials=len(trials)
     choices, all_traces = [], []
     names = np.sort(cards.columns.values)
+    ntrials = len(cards) * nblocks
+    # decks are queues: the drawn card moves to the end of its deck
+    decks = np.zeros((2*ntrials, len(names)))
+    decks[:ntrials] = np.tile(cards[names].values, (nblocks, 1))
+    ndrawn = np.zeros(len(names), dtype=int)
     rts={k:[] for k in names}
     qdict={k:[0] for k in names}
     choice_prob={k:[.25] for k in names}
 
-    vdhist = pd.DataFrame(data=np.zeros((ntrials, len(names))), columns=names, index=np.arange(ntrials))
-    vihist = vdhist.copy()
+    p = vectorize_params(p, nresp=len(names))
+    for pkey in ['a', 'tr', 'vd', 'vi', 'xb']:
+        p[pkey] = np.asarray(p[pkey], dtype=float)
+    dx = si * np.sqrt(dt)
+    ntime = int(np.ceil((tb-p['tr']).max()/dt))
+    # traces are only recorded for plotting
+    traces = np.zeros((len(names), ntime if plot else 0))
+
+    vdhist = np.zeros((ntrials, len(names)))
+    vihist = np.zeros((ntrials, len(names)))
     needsfixed = 0
     prevWinner=np.nan
     for i in range(ntrials):
-        vals = trials.iloc[i, 1:].values
+        vals = decks[i + ndrawn, np.arange(len(names))]
         iquit=0
-        winner=np.nan
-        while np.isnan(winner) and iquit<35:
-            execution = simulate_multirace(p, si=si, dt=dt)
-            winner, rt, traces, p, qdict, choice_prob, choices = analyze_multiresponse(execution, p, qdict=qdict, vals=vals, names=names, a_go=a_go, a_no=a_no, aX=aX, beta=beta, choice_prob=choice_prob, dt=dt, choices=choices, prevWinner=prevWinner)
+        winner=-1
+        while winner<0 and iquit<35:
+            winner, rt, nsteps = igt.race_trial(p['vd'], p['vi'], p['a'], p['tr'], p['xb'], dx, si, dt, ntime, traces)
             iquit+=1
-            if np.isnan(np.mean(p['xb'])):
-                iquit=36
-        prevWinner=winner
-        if winner>=len(names) or np.isnan(winner):
+            if winner<0 and np.mean(p['xb']) <= 4.0:
+                # if no response occurs, increase exponential bias
+                p['xb']=p['xb']*1.005
+        if winner<0:
             needsfixed+=1
             winner = int(np.random.choice(np.arange(len(names))))
+            choices.append(winner)
+            # no learning update, Q-values carry over to the next trial
+            for name in names:
+                qdict[name].append(qdict[name][-1])
+            prevWinner=np.nan
+        else:
+            p, qdict, choice_prob, choices = update_choice(winner, p, qdict=qdict, vals=vals, names=names, a_go=a_go, a_no=a_no, aX=aX, beta=beta, choice_prob=choice_prob, choices=choices, prevWinner=prevWinner)
+            prevWinner=winner
         choice_name = names[choices[i]]
-        oldval = trials.loc[i, choice_name]
-        new_col = trials[choice_name].shift(-1)
-        new_col.set_value(new_col.index[-1], oldval)
-        trials=trials.copy()
-        trials.loc[:, choice_name] = new_col
-
-        vdhist.iloc[i, :] = p['vd']
-        vihist.iloc[i, :] = p['vi']
-        choice_name = names[winner]
-        rts[choice_name].append(rt[winner]); all_traces.append(traces)
+        decks[ntrials + ndrawn[choices[i]], choices[i]] = vals[choices[i]]
+        ndrawn[choices[i]] += 1
+
+        vdhist[i, :] = p['vd']
+        vihist[i, :] = p['vi']
+        rts[choice_name].append(rt)
+        if plot:
+            all_traces.append([traces[k, :nsteps].copy() for k in range(len(names))])
     percent_random_choice = (needsfixed*100.)/ntrials
     if percent_random_choice>=10.:
         print("trials with no winner {:.2f}%".format(percent_random_choice))
     if plot:
+        from radd.adapt import visr
         visr.plot_traces_rts(p, all_traces, rts)
         return all_traces, rts
+    vdhist = pd.DataFrame(vdhist, columns=names)
+    vihist = pd.DataFrame(vihist, columns=names)
     return choices, rts, all_traces, qdict, choice_prob, vdhist, vihist
 
 
 def simulate_multirace(p, pcmap={'vd': ['vd_a', 'vd_b', 'vd_c', 'vd_d'], 'vi': ['vi_a', 'vi_b', 'vi_c', 'vi_d']}, dt=.001, si=.01, tb=.9, single_process=0, return_di=False):
 
-    nresp = len(pcmap.values()[0])
+    nresp = len(list(pcmap.values())[0])
     dx = si * np.sqrt(dt)
     p = vectorize_params(p, pcmap=pcmap, nresp=nresp)
 
@@ -181,11 +235,18 @@ def analyze_multiresponse(execution, p, qdict={}, vals=[], names=[], a_go=.2, a_
         return np.nan, rts, execution, p, qdict, choice_prob, choices
     # get accumulator with fastest RT (winner) in each cond
     winner = np.argmin(rts)
-    choices.append(winner)
     # get rt of winner in each cond
     winrt = rts[winner]
     # slice all traces at time the winner crossed boundary
     traces = [execution[i, :nsteps_to_rt[winner]] for i in range(len(rts))]
+    p, qdict, choice_prob, choices = update_choice(winner, p, qdict=qdict, vals=vals, names=names, a_go=a_go, a_no=a_no, aX=aX, beta=beta, choice_prob=choice_prob, choices=choices, prevWinner=prevWinner)
+    return winner, rts, traces, p, qdict, choice_prob, choices
+
+
+def update_choice(winner, p, qdict={}, vals=[], names=[], a_go=.2, a_no=.2, beta=5, choice_prob={}, aX=.001, choices=[], prevWinner=np.nan):
+    """update bounds, Q-values, choice probabilities and drift-rates after
+    the multirace winner's reward"""
+    choices.append(winner)
     reward = vals[winner]
     winner_name = names[winner]
     if prevWinner==winner and reward>0:
@@ -219,7 +280,7 @@ def analyze_multiresponse(execution, p, qdict={}, vals=[], names=[], a_go=.2, a_
         p = reweight_drift(p, alt_i, delta_prob, a_go, a_no)
         #p = weight_drift(p, alt_i, deltaQ, a_go, a_no)
     #p['a'] = array([a_no*(bound_expected-np.sum(p['vi']))]*p['a'].size)
-    return winner, rts, traces, p, qdict, choice_prob, choices
+    return p, qdict, choice_prob, choices
 
 def weight_drift(p, alt_i, deltaQ, a_go, a_no):
     vd_exp = p['vd'][alt_i]
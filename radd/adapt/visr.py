@@ -42,7 +42,7 @@ def plot_rt_dists(simdf, axes=None):
 
 def plot_traces_rts(p, all_traces, rts, names=['A', 'B', 'C', 'D'], tb=1000):
     tr = np.mean(p['tr'])*1e3
-    rtkeys = np.sort(rts.keys())
+    rtkeys = np.sort(list(rts.keys()))
     rt_dists = [np.asarray(rts[k])*1e3-tr for k in rtkeys]
     tb = np.ceil(np.max([np.max(rti) if len(rti)>0 else 0 for rti in rt_dists]))+50
     sns.set(style='white', font_scale=1.5)
@@ -62,7 +62,7 @@ def plot_traces_rts(p, all_traces, rts, names=['A', 'B', 'C', 'D'], tb=1000):
         axx.set_yticklabels([])
         if len(rt_dists[i])<=1:
             continue
-        sns.distplot(rt_dists[i], ax=axx, label=k, kde=True, hist=True, color=clrs[i], bins=20)
+        sns.distplot(rt_dists[i], ax=axx, label=rtkeys[i], kde=True, hist=True, color=clrs[i], bins=20)
         text_str='$\mu_{%s}=%.fms$'%(names[i], tr+np.mean(rt_dists[i]))
         ax.text(x[0]-50, np.mean(p['a'])-.1*np.mean(p['a']), text_str, fontsize=21)
 
@@ -72,7 +72,7 @@ def plot_summary(outcomes, plot_traces=False, p=None, tb=1000, ntime=5):
     f, axes = plt.subplots(3, 2, figsize=(12,14))
     a1, a2, a3, a4, a5, a6 = axes.flatten()
     choices, rts, all_traces, qdict, choicep, vdhist, vihist = outcomes
-    names = np.sort(qdict.keys())
+    names = np.sort(list(qdict.keys()))
     clrs = ['#3572C6',  '#c44e52', '#8172b2', '#83a83b']
     targetColors = dict(zip(targets,clrs))
     choices = np.asarray(choices)
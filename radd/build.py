@@ -7,12 +7,16 @@ import pandas as pd
 from numpy import array
 from radd.models import Simulator
 from radd.CORE import RADDCore
-from radd import vis
-from radd.tools import utils, analyze, messages
+from radd.tools import utils, analyze, messages, trials
 from radd.tools.analyze import pandaify_results, rangl_data
 import multiprocessing as mp
-import matplotlib.pyplot as plt
-from IPython.display import clear_output
+
+# model shared by the bootstrap fits of a worker process (see Model.fit_bootstrap)
+_shared = {}
+
+
+def init_worker(model):
+    _shared['model'] = model
 
 
 class Model(RADDCore):
@@ -45,11 +49,19 @@ class Model(RADDCore):
 
         quantiles (array):
             set the RT quantiles used to fit model
+
+        headless (bool):
+            if True, never create notebook progress widgets (for compute nodes
+            and batch workers without a Jupyter frontend)
+
+        compact (bool):
+            if True, store data with compact dtypes (categorical idx & conditions,
+            int8 ttype/response/acc, float32 rt, int16 ssd; see tools.trials)
     """
 
-    def __init__(self, data=pd.DataFrame, kind='xdpm', inits=None, fit_on='average', depends_on={'all':'flat'}, weighted=True, ssd_method=None, learn=False, bwfactors=None, custompath=None, presample=False, ssdelay=False, gbase=False, quantiles=np.arange(.1, 1.,.1), ksfit=False):
+    def __init__(self, data=pd.DataFrame, kind='xdpm', inits=None, fit_on='average', depends_on={'all':'flat'}, weighted=True, ssd_method=None, learn=False, bwfactors=None, custompath=None, presample=False, ssdelay=False, gbase=False, quantiles=np.arange(.1, 1.,.1), ksfit=False, headless=False, compact=False):
 
-        super(Model, self).__init__(data=data, inits=inits, fit_on=fit_on, depends_on=depends_on, kind=kind, quantiles=quantiles, weighted=weighted, ssd_method=ssd_method, learn=learn, bwfactors=bwfactors, custompath=custompath, presample=presample, ssdelay=ssdelay, gbase=gbase, ksfit=ksfit)
+        super(Model, self).__init__(data=data, inits=inits, fit_on=fit_on, depends_on=depends_on, kind=kind, quantiles=quantiles, weighted=weighted, ssd_method=ssd_method, learn=learn, bwfactors=bwfactors, custompath=custompath, presample=presample, ssdelay=ssdelay, gbase=gbase, ksfit=ksfit, headless=headless, compact=compact)
 
         groups = self.handler.groups
         bwcol = None
@@ -58,7 +70,7 @@ class Model(RADDCore):
             self.bwcol = [df[self.bwfactors].unique()[0] for _, df in self.data.groupby('idx')]
 
 
-    def optimize(self, plotfits=False, saveplot=False, saveresults=False, custompath=None, progress=True, get_results=False, powell=True, hop=False):
+    def optimize(self, plotfits=False, saveplot=False, saveresults=False, custompath=None, progress=True, get_results=False, powell=True, hop=False, bootparams={}):
         """ Method to be used for accessing fitting methods in Optimizer class
         see Optimizer method optimize()
         ::Arguments::
@@ -75,6 +87,8 @@ class Model(RADDCore):
                 all saved output will write to "~/<custompath>/<self.model_id>/"
             progress (bool):
                 track progress across ninits and basinhopping
+            bootparams (dict):
+                fit_bootstrap arguments (nboot, nproc, ci, seed) used if fit_on='bootstrap'
         """
         #self.toggle_pbars(progress=progress)
         self.custompath=custompath
@@ -95,8 +109,11 @@ class Model(RADDCore):
             if plotfits:
                 self.plot_model_fits(save=saveplot)
 
-        if progress:
-            if self.fit_on=='subjects':
+            if self.fit_on == 'bootstrap':
+                self.fit_bootstrap(progress=progress, **bootparams)
+
+        if progress and self.opt.progress:
+            if hasattr(self, 'idxbar'):
                 self.idxbar.clear()
             self.opt.ibar.clear()
             self.opt.gbar.clear()
@@ -114,8 +131,10 @@ class Model(RADDCore):
         nruns = int(len(self.idx) / nproc)
         fits, popts, yhats = [], [], []
         self.toggle_pbars(progress=progress)
-        self.idxbar.update(value=0, status=0)
-        self.opt.make_progress_bars(inits=False, basin=True)
+        showbars = hasattr(self, 'idxbar') and self.opt.progress
+        if showbars:
+            self.idxbar.update(value=0, status=0)
+            self.opt.make_progress_bars(inits=False, basin=True)
 
         # self.iohandler = ModelIO(fitparams=self.fitparams, mname=self.model_id)
         self.yhatdf = self.observedDF[self.observedDF.idx.isin(self.idx)].copy()
@@ -144,7 +163,8 @@ class Model(RADDCore):
             popts.append(pd.DataFrame([res['popt'] for res in results]))
             yhat = np.array([res['yhat'] for res in results])
             self.yhatdf.loc[ix0:ix1, datcols] = yhat.reshape(nproc, -1)
-            self.idxbar.update(value=ix1, status=ix1)
+            if showbars:
+                self.idxbar.update(value=ix1, status=ix1)
 
         self.fitdf = pd.concat(fits)
         self.poptdf = pd.concat(popts)
@@ -152,11 +172,65 @@ class Model(RADDCore):
         if self.bwfactors is not None:
             self.poptdf.insert(1, self.bwfactors, self.bwcol)
             self.fitdf.insert(1, self.bwfactors, self.bwcol)
-        self.idxbar.clear()
+        if showbars:
+            self.idxbar.clear()
         return self.fitdf, self.poptdf, self.yhatdf
 
 
 
+    def fit_bootstrap(self, nboot=100, nproc=1, ci=.95, seed=None, progress=False):
+        """ fit nboot bootstrap replicates of the data (fit_on='bootstrap'),
+        each with the flat & conditional routines of an average fit and the
+        cost f(x) wts of the observed data, and estimate percentile confidence
+        intervals of every parameter. Replicate data arrays are built at once
+        (see dfhandler.DataHandler.make_boot_arrays)
+        ::Arguments::
+            nboot (int):
+                number of bootstrap replicates
+            nproc (int):
+                number of worker processes (1 fits replicates serially), each
+                receiving a copy of the model once (see init_worker)
+            ci (float):
+                confidence level of the percentile intervals
+            seed (int):
+                seed for resampling and the per-replicate random streams
+        ::Returns::
+            bootdf (DataFrame): fit statistics & parameters, one row per replicate
+            cidf (DataFrame): lower & upper CI bound (rows) of every parameter
+        """
+        if self.fit_on != 'bootstrap':
+            raise ValueError("fit_bootstrap requires a model with fit_on='bootstrap'")
+        self.handler.nboot, self.handler.bootSeed = nboot, seed
+        self.handler.make_fit_arrays()
+        self.__set_dataframes__()
+        seeds = np.random.RandomState(seed).randint(0, 2**31-1, size=nboot)
+        tasks = [(ix, seeds[ix-1]) for ix in range(1, nboot+1)]
+
+        # results & fit settings of the average fit (overwritten by serial replicate fits)
+        avgResults = {attr: getattr(self, attr) for attr in ['finfo', 'popt', 'yhat'] if hasattr(self, attr)}
+        avgFitparams = {key: self.fitparams[key] for key in ['ix', 'nlevels', 'inits', 'method', 'maxfev']}
+        if nproc == 1:
+            self.toggle_pbars(progress=progress)
+            init_worker(self)
+            results = [fit_replicate(*task) for task in tasks]
+            _shared.clear()
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            self.toggle_pbars(progress=False)
+            with ProcessPoolExecutor(max_workers=nproc, initializer=init_worker, initargs=(self,)) as pool:
+                results = list(pool.map(fit_replicate, *zip(*tasks)))
+        for attr, val in avgResults.items():
+            setattr(self, attr, val)
+        self.set_fitparams(**avgFitparams)
+
+        self.bootdf = pd.DataFrame([dict(finfo, **popt) for finfo, popt in results])
+        params = [p for p in results[0][1]]
+        alpha = (1. - ci) / 2.
+        self.bootci = self.bootdf[params].quantile([alpha, 1. - alpha])
+        self.bootci.index = ['lower', 'upper']
+        return self.bootdf, self.bootci
+
+
     def optimize_flat(self, param_sets=None, get_results=False):
         """ optimizes flat model to data collapsing across all conditions
         ::Arguments::
@@ -185,6 +259,7 @@ class Model(RADDCore):
         if get_results:
             return self.finfo, self.popt, self.yhat
         if self.opt.progress:
+            from IPython.display import clear_output
             self.opt.ibar.clear()
             self.opt.gbar.clear()
             clear_output()
@@ -253,6 +328,7 @@ class Model(RADDCore):
     def plot_model_fits(self, y=None, yhat=None, kde=True, err=None, save=False, bw='scott', savestr=None, same_axis=True, clrs=None, lbls=None, cumulative=True, simdf=None, suppressLegend=False, simData=None, condData=None, shade=True, plot_error_rts=True, figure=None, reorder=None):
         """ wrapper for radd.tools.vis.plot_model_fits
         """
+        from radd import vis
         data = self.handler.data.copy()
 
         if y is None:
@@ -301,10 +377,11 @@ class Model(RADDCore):
             p (dict):
                 parameters dictionary
             analyze (bool):
-                if True (default) returns yhat vector. else, returns decision traces
+                if True (default) returns yhat vector. else, returns simulated trials
         :: Returns ::
             out (array):
-                1d array if analyze is True, else ndarray of decision traces
+                1d array if analyze is True, else tools.trials.SimTrials
+                (see SimTrials.to_frame for a DataFrame)
         """
         if p is None:
             try:
@@ -316,27 +393,28 @@ class Model(RADDCore):
         return yhat
 
 
-    def optimize_idx_params(self, idxlist=None, pos=0, output=None, progress=True):
+    def optimize_idx_params(self, idxlist=None, pos=0, output=None, progress=True, append=False):
         """ optimize parameters for individual subjects, store results
         :: Arguments ::
-        param_sets (list):
-            parameters dictionary
-        force (str):
-            if 'cond' forces fits to conditional data, if 'flat' forces flat data
-        save (bool):
-            save output dataframes if True
+        idxlist (list):
+            subjects to fit (default: all subjects in self.idx)
+        append (bool):
+            append results to the current (saved) fitdf, poptdf & yhatdf
         :: Returns ::
             fitdf (DataFrame): fit statistics
             poptdf (DataFrame): optimized parameters
             yhatdf (DataFrame): model predictions
         """
-
+        if idxlist is None:
+            idxlist = self.idx
+        if append:
+            prevResults = self.iohandler.read_model_results()
         self.iohandler = ModelIO(fitparams=self.fitparams, mname=self.model_id)
-        yhatdf = self.observedDF[self.observedDF.idx.isin(self.idx)].copy()
+        yhatdf = self.observedDF[self.observedDF.idx.isin(idxlist)].copy()
         datcols = yhatdf.loc[:, 'acc':].columns.tolist()
         # fit result lists for each param set
         finfoList, poptList, yhatList = [], [], []
-        for idx in self.idx:
+        for idx in idxlist:
 
             self.toggle_pbars(progress=progress)
 
@@ -362,23 +440,79 @@ class Model(RADDCore):
             poptList.append(deepcopy(popt))
             yhatdf.loc[yhatdf.idx==idx, datcols] = yhat
 
-            self.opt.ibar.clear()
-            self.opt.gbar.clear()
-            clear_output()
+            if self.opt.progress:
+                from IPython.display import clear_output
+                self.opt.ibar.clear()
+                self.opt.gbar.clear()
+                clear_output()
 
         # concatenate all subjects together into single fitdf, poptdf, & yhatdf
         fitdf = pd.concat(finfoList, axis=1).T
         poptdf = pd.DataFrame.from_dict(poptList)
-        poptdf.insert(0, 'idx', self.idx)
+        poptdf.insert(0, 'idx', idxlist)
         if self.bwfactors is not None:
-            poptdf.insert(1, self.bwfactors, self.bwcol)
-            fitdf.insert(1, self.bwfactors, self.bwcol)
+            bwcol = [self.bwcol[self.idx.index(idx)] for idx in idxlist]
+            poptdf.insert(1, self.bwfactors, bwcol)
+            fitdf.insert(1, self.bwfactors, bwcol)
+        if append:
+            fitdf, poptdf, yhatdf = [pd.concat([prev, df], ignore_index=True) for prev, df in zip(prevResults, [fitdf, poptdf, yhatdf])]
 
         self.iohandler.save_model_results(fitdf, poptdf, yhatdf, write=True)
         self.fitdf, self.poptdf, self.yhatdf = self.iohandler.read_model_results()
         return self.fitdf, self.poptdf, self.yhatdf
 
 
+    def add_data(self, data, fit=True, progress=False):
+        """ add trials of new subjects to the model. Only the new trials are
+        summarized (observedDF, wtsDF, ssdDF & fit arrays are appended to),
+        the Optimizer/Simulator and their random arrays are kept.
+        Not available for adaptive (learn=True) models, whose block curves are
+        built from the trials of all subjects at once (raises ValueError)
+        ::Arguments::
+            data (DataFrame):
+                trials of subjects not yet in the model (same columns as model data)
+            fit (bool):
+                if True and fit_on=='subjects', fit the new subjects and append
+                their results to fitdf, poptdf & yhatdf
+        ::Returns::
+            newidx (list): idx of the added subjects
+        """
+        if self.learn:
+            raise ValueError("add_data does not support adaptive (learn=True) models, build a new Model with the combined trials instead")
+        newidx = list(data.idx.unique())
+        oldidx = [idx for idx in newidx if idx in self.idx]
+        if oldidx:
+            raise ValueError("data contains subjects already in the model: {}".format(oldidx))
+
+        data = data.copy()
+        if self.is_flat:
+            data['flat'] = 'flat'
+        if self.compact:
+            self.data = trials.append_trials(self.data, data)
+        else:
+            self.data = pd.concat([self.data, data], ignore_index=True)
+        self.handler.data = self.data
+        self.opt.data = self.data
+        self.idx = self.idx + newidx
+        self.nidx = len(self.idx)
+        if self.bwfactors is not None:
+            self.bwcol = self.bwcol + [df[self.bwfactors].unique()[0] for _, df in data.groupby('idx')]
+
+        # keep fit results (replaced by the handler's empty dataframes)
+        results = [self.fitdf, self.poptdf, self.yhatdf]
+        if self.handler.add_data(data):
+            self.__set_dataframes__()
+        else:
+            # new SSDs: rebuild dataframes of all subjects
+            self.__make_dataframes__()
+        self.fitdf, self.poptdf, self.yhatdf = results
+        self.set_fitparams(nidx=self.nidx)
+
+        if fit and self.fit_on=='subjects':
+            self.optimize_idx_params(newidx, progress=progress, append=hasattr(self, 'iohandler'))
+        return newidx
+
+
     def nested_optimize(self, depends=[], flatp=None, saveplot=True, plotfits=False, custompath=None, progress=True, saveresults=True, saveobserved=False):
         """ optimize a series of models using same init parameters where the i'th model
             has depends_on = {<depends[i]> : <cond>}.
@@ -414,6 +548,26 @@ class Model(RADDCore):
         return self.fitdf, self.poptdf, self.yhatdf
 
 
+def fit_replicate(ix, seed):
+    """ fit the ix'th data arrays of the shared model (bootstrap replicate)
+    ::Returns:: finfo (dict), popt (dict of scalar parameters, conditional
+    parameters expanded to one per level, e.g. v_bsl, v_pnl)
+    """
+    m = _shared['model']
+    np.random.seed(seed)
+    m.set_fitparams(ix=ix, force='flat', nlevels=1)
+    finfo, popt, yhat = m.optimize_flat(get_results=True)
+    if not m.is_flat:
+        finfo, popt, yhat = m.optimize_conditional(popt, get_results=True)
+    pvals = {}
+    for pkey, val in popt.items():
+        if np.ndim(val)==0:
+            pvals[pkey] = val
+        else:
+            pvals.update(zip(m.pcmap[pkey], np.ravel(val)))
+    return finfo.to_dict(), pvals
+
+
 def nested_optimize(depends, data, kind='xdpm', flatp=None, basinparams=None, fitparams=None, saveplot=True, plotfits=False, custompath=None, progress=True, saveresults=False, saveobserved=False, ssd_method='all'):
     """ optimize a series of models using same init parameters where the i'th model
         has depends_on = {<depends[i]> : <cond>}.
@@ -438,7 +592,7 @@ def nested_optimize(depends, data, kind='xdpm', flatp=None, basinparams=None, fi
 
     for i, depends_on in enumerate(depends):
 
-        m = Model(data=data, kind=kind, depends_on=depends_on, ssd_method=ssd_method, quantiles=fitparams['quantiles'])
+        m = Model(data=data, kind=kind, depends_on=depends_on, ssd_method=ssd_method, quantiles=fitparams['quantiles'], headless=not progress)
 
         basinMethod = basinparams['method']
         nsamples = basinparams['nsamples']
@@ -530,6 +684,7 @@ class ModelIO(object):
     def save_fit_figure(self, f, savestr='avgYhat'):
         """ save model fits figure
         """
+        import matplotlib.pyplot as plt
         savepath = os.path.join(self.mdir, '_'.join([self.mname, savestr]) + '.png')
         plt.tight_layout()
         f.savefig(savepath, dpi=600)
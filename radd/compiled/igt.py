@@ -0,0 +1,130 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import numpy as np
+import numba as nb
+from numba import jit
+
+# Iowa gambling task (IGT) multirace agents.
+#
+# On every trial the nalt accumulators (direct - indirect pathways, direct
+# scaled by cosh(xb*t)) race until the first one crosses its bound (early
+# exit). The winner's card is drawn from its deck, its Q-value is updated
+# (a_go if the reward beats the current Q-value, a_no otherwise) and the
+# softmax (beta) change in choice probability of every deck shifts its
+# direct/indirect drift-rates. Decks are queues: drawing a card moves it to
+# the end of the deck (radd.adapt.multirace.run_trials semantics).
+
+
+@jit(nopython=True, cache=True)
+def race_trial(vd, vi, a, tr, xb, dx, si, dt, ntime, traces):
+    """ advance all accumulators one step at a time and stop at the first
+    bound crossing (cost scales with rt, not the deadline). Execution
+    traces are written to traces (nalt x ntime) unless it has no columns
+    ::Returns:: winner (-1 if no accumulator crossed within ntime steps),
+    rt and the number of steps before the crossing
+    """
+    nalt = vd.size
+    record = traces.shape[1] > 0
+    x = np.zeros(nalt)
+    Pd = 0.5 * (1 + vd * dx / si)
+    Pi = 0.5 * (1 + vi * dx / si)
+    for t in range(ntime):
+        tt = (t + 1) * dt
+        for k in range(nalt):
+            direct = dx if np.random.random() < Pd[k] else -dx
+            indirect = dx if np.random.random() < Pi[k] else -dx
+            x[k] += np.cosh(xb[k] * tt) * direct - indirect
+            if record:
+                traces[k, t] = x[k]
+        if t > 0:
+            for k in range(nalt):
+                if x[k] >= a[k]:
+                    return k, tr[k] + t * dt, t
+    return -1, np.nan, ntime
+
+
+@jit(nopython=True, cache=True)
+def igt_agent(deck, vd, vi, a, tr, xb, a_go, a_no, beta, aX, dx, si, dt, ntime, maxtries, choices, rts, Q, P, vdHist, viHist):
+    """ simulate one agent over the rows of deck (ntrials x nalt card values),
+    updating vd, vi, a and xb in place and writing the trialwise choices, rts,
+    Q-values & choice probabilities (ntrials+1 x nalt, row 0 = initial) and
+    drift-rates. Trials without a winner after maxtries races get a random
+    choice (rt=nan) and no learning update.
+    ::Returns:: number of trials without a winner
+    """
+    ntrials, nalt = deck.shape
+    noTraces = np.empty((nalt, 0))
+    cards = np.empty((2 * ntrials, nalt))
+    cards[:ntrials] = deck
+    ndrawn = np.zeros(nalt, dtype=np.int64)
+    Q[0, :] = 0.
+    P[0, :] = 1. / nalt
+    prevWinner = -1
+    nfailed = 0
+    for i in range(ntrials):
+        winner = -1
+        rt = np.nan
+        tries = 0
+        while winner < 0 and tries < maxtries:
+            winner, rt, nsteps = race_trial(vd, vi, a, tr, xb, dx, si, dt, ntime, noTraces)
+            tries += 1
+            # no response: increase exponential bias
+            if winner < 0 and np.mean(xb) <= 4.0:
+                xb *= 1.005
+
+        Q[i + 1, :] = Q[i, :]
+        P[i + 1, :] = P[i, :]
+        if winner < 0:
+            nfailed += 1
+            winner = np.random.randint(nalt)
+            reward = cards[i + ndrawn[winner], winner]
+            prevWinner = -1
+        else:
+            reward = cards[i + ndrawn[winner], winner]
+            if prevWinner == winner:
+                if reward > 0:
+                    a[winner] = a[winner] * (1. - aX)
+                elif reward < 0:
+                    a[winner] = a[winner] * (1. + aX)
+            prevWinner = winner
+            qval = Q[i, winner]
+            alpha = a_go if reward >= qval else a_no
+            Q[i + 1, winner] = qval + alpha * (reward - qval)
+            expQ = np.exp(beta * Q[i + 1, :])
+            P[i + 1, :] = expQ / expQ.sum()
+            for k in range(nalt):
+                deltaProb = P[i + 1, k] - P[i, k]
+                vd[k] = vd[k] + a_go * deltaProb
+                vi[k] = vi[k] - a_no * deltaProb
+
+        # move the drawn card to the end of its deck
+        cards[ntrials + ndrawn[winner], winner] = reward
+        ndrawn[winner] += 1
+        choices[i] = winner
+        rts[i] = rt
+        vdHist[i, :] = vd
+        viHist[i, :] = vi
+    return nfailed
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def igt_agents(deck, vd, vi, a, tr, xb, a_go, a_no, beta, aX, dx, si, dt, ntime, maxtries, seeds):
+    """ simulate len(seeds) independent agents in parallel, agent j starting
+    from row j of vd, vi, a, tr, xb (nagents x nalt) with learning rates
+    a_go[j], a_no[j] and inverse temperature beta[j]
+    ::Returns:: choices, rts (nagents x ntrials), Q, P (nagents x ntrials+1 x nalt),
+    vdHist, viHist (nagents x ntrials x nalt) and nfailed (nagents)
+    """
+    nagents = seeds.size
+    ntrials, nalt = deck.shape
+    choices = np.zeros((nagents, ntrials), dtype=np.int64)
+    rts = np.zeros((nagents, ntrials))
+    Q = np.zeros((nagents, ntrials + 1, nalt))
+    P = np.zeros((nagents, ntrials + 1, nalt))
+    vdHist = np.zeros((nagents, ntrials, nalt))
+    viHist = np.zeros((nagents, ntrials, nalt))
+    nfailed = np.zeros(nagents, dtype=np.int64)
+    for j in nb.prange(nagents):
+        np.random.seed(seeds[j])
+        nfailed[j] = igt_agent(deck, vd[j].copy(), vi[j].copy(), a[j].copy(), tr[j].copy(), xb[j].copy(), a_go[j], a_no[j], beta[j], aX, dx, si, dt, ntime, maxtries, choices[j], rts[j], Q[j], P[j], vdHist[j], viHist[j])
+    return choices, rts, Q, P, vdHist, viHist, nfailed
@@ -6,50 +6,131 @@ from __future__ import division
 import numpy as np
 import numba as nb
 from scipy.stats import norm
-from numba.decorators import jit
+from numba import jit
 from numba import float64, int64, vectorize, boolean
 from numpy.random import random_sample as randsample
 
 
-def sample_posterior_belief(data, m0=300, k0=1, s2=1, v0=1, nsamples=800):
-
-    ntrials = data.shape[0]
-    muPosterior = np.zeros((ntrials, nsamples))
-    varPosterior = np.zeros((ntrials, nsamples))
-
-    for i in range(1, ntrials+1):
-        mu_t, var_t = draw_mus_and_sigmas(data[:i], m0, k0, s2, v0, nsamples)
-        muPosterior[i-1, :] = mu_t
-        varPosterior[i-1, :] = var_t
-
-    return muPosterior, varPosterior
-
-
-def rolling_variance(old_avg, new, old, N):
+def sample_posterior_belief(data, m0=300, k0=1, s2=1, v0=1, nsamples=800, seed=None):
+    """ online Normal-inverse-gamma belief about the mean and variance of
+    data (e.g. SSDs), updated one trial at a time, with nsamples posterior
+    (mu, var) draws after every trial. nan trials leave the belief unchanged
+    ::Arguments::
+        data (array):
+            ntrials (one observer) or nsubjects x ntrials (one observer per row)
+        m0, k0, s2, v0 (float):
+            prior mean, mean pseudo-count, prior variance and its degrees of freedom
+        nsamples (int):
+            posterior samples per trial
+        seed (int):
+            seed for the per-subject random streams
+    ::Returns::
+        muPosterior, varPosterior (arrays shaped data.shape + (nsamples,))
+    """
+    data = np.asarray(data, dtype=np.float64)
+    batch = np.atleast_2d(data)
+    seeds = np.random.RandomState(seed).randint(0, 2**31-1, size=batch.shape[0]).astype(np.int64)
+    post, muPosterior, varPosterior = nig_belief_batch(np.ascontiguousarray(batch), m0, k0, s2, v0, int(nsamples), seeds)
+    shape = data.shape + (int(nsamples),)
+    return muPosterior.reshape(shape), varPosterior.reshape(shape)
+
+
+def posterior_belief(data, m0=300, k0=1, s2=1, v0=1):
+    """ Normal-inverse-gamma posterior after every trial of data
+    (see sample_posterior_belief) without sampling
+    ::Returns::
+        array shaped data.shape + (4,) with the posterior (mN, kN, alphaN, betaN):
+        E[mu] = mN, E[var] = betaN / (alphaN - 1)
+    """
+    data = np.asarray(data, dtype=np.float64)
+    batch = np.atleast_2d(data)
+    seeds = np.zeros(batch.shape[0], dtype=np.int64)
+    post, mu, var = nig_belief_batch(np.ascontiguousarray(batch), m0, k0, s2, v0, 0, seeds)
+    return post.reshape(data.shape + (4,))
+
+
+@jit(nopython=True, cache=True)
+def nig_update(data, m0, k0, s2, v0, post):
+    """ Normal-inverse-gamma posterior (mN, kN, alphaN, betaN) after each
+    trial of data, from running (Welford) mean and sum of squared deviations
+    """
+    n = 0.
+    mean = 0.
+    ssd = 0.
+    mN, kN, alphaN, betaN = m0, k0, v0/2., v0*s2/2.
+    for t in range(data.size):
+        x = data[t]
+        if not np.isnan(x):
+            n += 1.
+            delta = x - mean
+            mean += delta / n
+            ssd += delta * (x - mean)
+            kN = k0 + n
+            mN = (k0 * m0 + n * mean) / kN
+            alphaN = (v0 + n) / 2.
+            betaN = (v0 * s2 + ssd + n * k0 * (m0 - mean)**2 / kN) / 2.
+        post[t, 0] = mN
+        post[t, 1] = kN
+        post[t, 2] = alphaN
+        post[t, 3] = betaN
+
+
+@jit(nopython=True, cache=True)
+def nig_sample(post, mu, var):
+    """ draw var ~ InvGamma(alphaN, betaN), mu ~ N(mN, var/kN) for each row of post
+    """
+    for t in range(post.shape[0]):
+        for j in range(mu.shape[1]):
+            v = post[t, 3] / np.random.gamma(post[t, 2], 1.)
+            var[t, j] = v
+            mu[t, j] = np.random.normal(post[t, 0], np.sqrt(v / post[t, 1]))
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def nig_belief_batch(data, m0, k0, s2, v0, nsamples, seeds):
+    """ nig_update (and nig_sample) for every row of data in parallel
+    """
+    nidx, ntrials = data.shape
+    post = np.zeros((nidx, ntrials, 4))
+    mu = np.zeros((nidx, ntrials, nsamples))
+    var = np.zeros((nidx, ntrials, nsamples))
+    for i in nb.prange(nidx):
+        np.random.seed(seeds[i])
+        nig_update(data[i], m0, k0, s2, v0, post[i])
+        if nsamples > 0:
+            nig_sample(post[i], mu[i], var[i])
+    return post, mu, var
+
+
+@jit(nopython=True, cache=True)
+def rolling_variance(oldavg, variance, new, old, N):
+    """ update the mean and variance of a window of N values when old is
+    replaced by new
+    ::Returns:: newavg, variance
+    """
     newavg = oldavg + (new - old)/N
-    average = newavg
     variance += (new-old)*(new-newavg+old-oldavg)/(N-1)
-    stddev = sqrt(variance)
+    return newavg, variance
 
 
 def get_norm(mu, sd, sample):
     return norm(mu, sd).logpdf(sample)
 
 
-@vectorize([float64(boolean, float64, float64)])
+@vectorize([float64(boolean, float64, float64)], nopython=True, cache=True)
 def ufunc_where(condition, x, y):
     if condition:
         return x
     else:
         return y
 
-@vectorize([int64(float64, float64)], nopython=True)
+@vectorize([int64(float64, float64)], nopython=True, cache=True)
 def get_onset_index(onset, dt):
     onsets = int(onset / dt)
     return onsets
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def slice_theta_array(theta_array, index_arrays, n_vals):
     i, ix = 0, 0
     param_array = np.empty(index_arrays.T.shape)
@@ -62,7 +143,7 @@ def slice_theta_array(theta_array, index_arrays, n_vals):
 
 
 
-@jit(nb.typeof((1, 1))(float64[:], float64[:], float64, float64, float64, float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_ddm_trace(rProb, trace, vProb, bound, gbase, dx):
     evidence = gbase
     trace[0] = evidence
@@ -80,7 +161,7 @@ def sim_ddm_trace(rProb, trace, vProb, bound, gbase, dx):
     return -1, -1
 
 
-@jit((float64[:,:,:], float64[:,:,:], float64[:,:], float64[:,:], float64[:], float64[:], float64[:], int64[:], float64[:], float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_many_ddm_traces(rProb, dvg, rts, choices, vProb, bound, gbase, gOnset, dx, dt):
     ncond, ntrials, ntime = rProb.shape
     for i in range(ncond):
@@ -98,7 +179,7 @@ def sim_many_ddm_traces(rProb, dvg, rts, choices, vProb, bound, gbase, gOnset, d
 
 
 
-@jit(int64(float64[:], float64[:], float64[:], float64, float64, float64, float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_dpm_trace_upper(rProb, trace, xtb, vProb, bound, gbase, dx):
     evidence = gbase
     trace[0] = evidence
@@ -115,7 +196,7 @@ def sim_dpm_trace_upper(rProb, trace, xtb, vProb, bound, gbase, dx):
     return -1
 
 
-@jit(float64(float64[:], float64, float64, int64, float64, float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_dpm_trace_lower(rProbSS, ssbase, vsProb, onset, dx, dt):
     ix = onset
     evidence = ssbase
@@ -129,7 +210,7 @@ def sim_dpm_trace_lower(rProbSS, ssbase, vsProb, onset, dx, dt):
     return ix * dt
 
 
-@jit((float64[:,:,:], float64[:,:,:,:], float64[:,:,:], float64[:,:], float64[:,:,:], float64[:,:], float64[:], float64[:], float64[:], float64[:], int64[:], int64[:,:], float64[:], float64[:], float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_many_dpm(rProb, rProbSS, dvg, rts, ssrts, xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx, si, dt):
     ncond, ntrials, ntime = rProb.shape
     ncond, nssd, nss_per, ntime = rProbSS.shape
@@ -158,7 +239,7 @@ def sim_many_dpm(rProb, rProbSS, dvg, rts, ssrts, xtb, drift, ssdrift, bound, gb
 
 
 
-@jit(float64(float64[:], float64[:], float64, float64, int64, float64, float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_dpm_trace_lower_trace(rProbSS, dvs, ssbase, vsProb, onset, dx, dt):
     ix = onset
     evidence = ssbase
@@ -173,37 +254,61 @@ def sim_dpm_trace_lower_trace(rProbSS, dvs, ssbase, vsProb, onset, dx, dt):
     return ix * dt
 
 
-@jit((float64[:,:,:], float64[:,:,:,:], float64[:,:,:], float64[:,:,:,:], float64[:,:], float64[:,:,:], float64[:,:], float64[:], float64[:], float64[:], float64[:], int64[:], int64[:,:], float64[:], float64[:], float64), nopython=True)
-def sim_many_dpm_traces(rProb, rProbSS, dvg, dvs, rts, ssrts, xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx, si, dt):
+@jit(nopython=True, cache=True)
+def record_trace(trace, out, start, end, stride):
+    """ copy every stride'th time step of trace[start:end+1] (absolute time
+    index, frame f = step f*stride) to out
+    """
+    f0 = (start + stride - 1) // stride
+    f1 = min(end // stride, out.size - 1)
+    for f in range(f0, f1 + 1):
+        out[f] = trace[f * stride]
+
+
+@jit(nopython=True, cache=True)
+def sim_many_dpm_traces(rProb, rProbSS, goRec, goTraces, ssTraces, rts, ssrts, xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx, si, dt, stride):
+    """ sim_many_dpm with decision traces recorded for a subset of trials:
+    go trial j (and its stop trials, j < nss_per) is recorded in row goRec[j]
+    of goTraces (ncond x nrec x nframes) and ssTraces (ncond x nssd x nrec x
+    nframes) unless goRec[j] < 0, every stride time steps (frame f = step
+    f*stride). Steps a process did not run are left untouched (e.g. nan).
+    RTs of all trials are written to rts & ssrts. Traces are computed in
+    per-trial scratch rows, so memory does not scale with ntrials
+    """
     ncond, ntrials, ntime = rProb.shape
     ncond, nssd, nss_per, ntime = rProbSS.shape
     vProb = 0.5 * (1 + (drift * np.sqrt(dt))/si)
     vsProb = 0.5 * (1 + (ssdrift * np.sqrt(dt))/si)
+    dvg = np.zeros(ntime)
+    dvs = np.zeros(ntime)
     for i in range(ncond):
         tr = gOnset[i]
         ssOn = ssOnset[i]
-        dvg[i,:,:tr] = gbase[i]
+        dvg[:tr] = gbase[i]
         for j in range(ntrials):
-            ix = sim_dpm_trace_upper(rProb[i,j,tr:], dvg[i,j,tr:], xtb[i], vProb[i], bound[i], gbase[i], dx[i])
+            ix = sim_dpm_trace_upper(rProb[i,j,tr:], dvg[tr:], xtb[i], vProb[i], bound[i], gbase[i], dx[i])
             if ix<0:
                 rt_ix = ntime + 1
                 rts[i,j] = 1000.
             else:
                 rt_ix = tr + ix
                 rts[i,j] = rt_ix * dt
+            rec = goRec[j]
+            if rec >= 0:
+                record_trace(dvg, goTraces[i, rec], 0, min(rt_ix, ntime - 1), stride)
             # Simulate Stop Process
             if j<nss_per:
-                ssbase = dvg[i,j][ssOn]
+                ssbase = dvg[ssOn]
                 for k in range(nssd):
                     if rt_ix < ssOn[k] or ix<0:
                         ssrts[i,k,j] = 1000.
                         continue
-                    ssrts[i,k,j] = sim_dpm_trace_lower_trace(rProbSS[i,k,j], dvs[i,k,j], ssbase[k], vsProb[i], ssOn[k], dx[i], dt)
-
+                    ssrts[i,k,j] = sim_dpm_trace_lower_trace(rProbSS[i,k,j], dvs, ssbase[k], vsProb[i], ssOn[k], dx[i], dt)
+                    if rec >= 0:
+                        record_trace(dvs, ssTraces[i, k, rec], ssOn[k], int(np.round(ssrts[i,k,j] / dt)) - 1, stride)
 
 
-
-@jit(nb.typeof((1.0, 1.0))(float64[:], float64[:], float64, float64, int64, float64[:], float64, int64, float64, float64, float64, float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_dpm_go_stop(rProb, xtb, vProb, bound, onsetIX, rProbSS, vsProb, ssdIX, dx, dt, evidence, ssbound):
     ssEvidence = 0
     ssStarted = 0
@@ -234,7 +339,7 @@ def sim_dpm_go_stop(rProb, xtb, vProb, bound, onsetIX, rProbSS, vsProb, ssdIX, d
     return 0., ix*dt
 
 
-@jit(nb.typeof((1.0, 1.0))(float64[:], float64[:], float64, float64, int64, float64, float64, float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_dpm_go(rProb, xtb, vProb, bound, onsetIX, dx, dt, evidence):
     timebound = rProb.shape[0]
     for ix in range(onsetIX, timebound):
@@ -249,123 +354,6 @@ def sim_dpm_go(rProb, xtb, vProb, bound, onsetIX, dx, dt, evidence):
 
 
 
-@jit((float64[:,:], float64[:,:], float64[:,:], float64[:], int64[:], float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, int64), nopython=True)
-def sim_dpm_learning(results, rProb, rProbSS, xtb, idxArray, drift, ssdrift, bound, onset, AX, BX, PX, dx, dt, tb, maxTrials):
-
-    onsetIX = np.int(onset)
-    TargetRT = .52
-    goStartTrial = 0.
-    ssbound = 0.
-    si = .1
-    tb = tb + .02
-
-    vsProb = 0.5 * (1 + (ssdrift * np.sqrt(dt))/si)
-
-    for idx in idxArray:
-        idxResults = results[results[:, 0]==idx]
-        ntrials = idxResults.shape[0]
-        vTrial = drift
-        aTrial = bound
-        errT = 10000
-
-        for t in range(ntrials):
-            ttype, ssOnset = idxResults[t, 1:3]
-            sensitivity = np.exp2(-t*PX)
-            AX_t = AX * sensitivity
-            BX_t = BX * sensitivity
-            vProbTrial = 0.5 * (1 + (vTrial * np.sqrt(dt))/si)
-
-            if ttype==0.:
-                ssdIX = np.int(ssOnset)
-                response, rt = sim_dpm_go_stop(rProb[t], xtb, vProbTrial, aTrial, onsetIX, rProbSS[t], vsProb, ssdIX, dx, dt, goStartTrial, ssbound)
-                if response:
-                    correct = 0.; score = -1.; errT = 0.
-                    vTrial = vTrial + AX_t * ((aTrial/tb) - (aTrial/rt))
-                else:
-                    correct = 1.; score = 0.; errT += 1.
-            else:
-                errT += 1
-                response, rt = sim_dpm_go(rProb[t], xtb, vProbTrial, aTrial, onsetIX, dx, dt, goStartTrial)
-                if response:
-                    correct = 1.
-                    score = np.exp(-abs(TargetRT-rt)*10)
-                    vTrial = vTrial + AX * ((aTrial/TargetRT) - (aTrial/rt))
-                else:
-                    correct = 0.
-                    score = -1.
-
-            aTrial = bound + BX_t * np.exp(-errT)
-
-            if vTrial > 2.0:
-                vTrial = 1.8
-            elif vTrial < .25:
-                vTrial = .28
-
-            idxResults[t] = np.array([idx, ttype, ssOnset, response, correct, rt, sensitivity, vTrial, aTrial])
-
-        results[results[:, 0]==idx] = idxResults
-
-
-
-@jit((float64[:,:], float64[:,:], float64[:,:], float64[:], int64[:], float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, int64), nopython=True)
-def sim_dpm_learning_alt(results, rProb, rProbSS, xtb, idxArray, drift, ssdrift, bound, onset, AX, BX, PX, dx, dt, tb, maxTrials):
-
-    onsetIX = np.int(onset)
-    TargetRT = .52
-    goStartTrial = 0.
-    ssbound = 0.
-    si = .1
-    tb = tb + .02
-
-    vsProb = 0.5 * (1 + (ssdrift * np.sqrt(dt))/si)
-
-    for idx in idxArray:
-        idxResults = results[results[:, 0]==idx]
-        ntrials = idxResults.shape[0]
-        vTrial = drift
-        aTrial = bound
-        errT = 10000
-
-        for t in range(ntrials):
-            ttype, ssOnset = idxResults[t, 1:3]
-            sensitivity = np.exp2(-t*PX)
-            AX_t = AX * sensitivity
-            BX_t = BX * sensitivity
-
-            vProbTrial = 0.5 * (1 + (vTrial * np.sqrt(dt))/si)
-
-            if ttype==0.:
-                ssdIX = np.int(ssOnset)
-                response, rt = sim_dpm_go_stop(rProb[t], xtb, vProbTrial, aTrial, onsetIX, rProbSS[t], vsProb, ssdIX, dx, dt, goStartTrial, ssbound)
-
-                if response:
-                    correct = 0.; score = -1.; errT = 0.
-                    aTrial = aTrial * 1/np.exp((rt-tb) * AX_t)
-                else:
-                    correct = 1.; score = 0.; errT += 1.
-            else:
-                errT += 1
-                response, rt = sim_dpm_go(rProb[t], xtb, vProbTrial, aTrial, onsetIX, dx, dt, goStartTrial)
-                if response:
-                    correct = 1.
-                    score = np.exp(-abs(TargetRT-rt)*10)
-                    aTrial = aTrial * 1/np.exp((rt-TargetRT) * AX_t)
-                else:
-                    correct = 0.
-                    score = -1.
-
-            vTrial = drift - BX_t * np.exp(-errT)
-
-            if vTrial > 2.0:
-                vTrial = 1.8
-            elif vTrial < .25:
-                vTrial = .28
-
-            idxResults[t] = np.array([idx, ttype, ssOnset, response, correct, rt, sensitivity, vTrial, aTrial])
-
-        results[results[:, 0]==idx] = idxResults
-
-
 #
 # @jit((float64[:,:], float64[:,:], float64[:,:], float64[:], int64[:], float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, int64), nopython=True)
 # def sim_dpm_learning(results, rProb, rProbSS, xtb, idxArray, vProb, vsProb, bound, onset, AX, BX, R, dx, dt, tb, maxTrials):
@@ -455,19 +443,7 @@ def sim_dpm_learning_alt(results, rProb, rProbSS, xtb, idxArray, drift, ssdrift,
         # idxBXount += 1
 
 
-# @jit(float64[:,:](float64[:,:], float64[:,:], float64[:,:], float64[:], int64[:], float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, int64, int64), nopython=True)
-# def sim_dpm_learning_nruns(nresults, rProb, rProbSS, xtb, idxArray, vProb, vsProb, bound, onset, AX, BX, R, dx, dt, tb, ntrials, n):
-#     nidx = idxArray.size
-#     nrowsTotal = nidx * ntrials
-#     for i in range(n):
-#         start = nrowsTotal*i
-#         end = nrowsTotal*(i+1)
-#         res = nresults[start:end, :]
-#         nresults[start:end, :] = sim_dpm_learning(res, rProb, rProbSS, xtb, idxArray, vProb, vsProb, bound, onset, AX, BX, R, dx, dt, tb, ntrials)
-#     return nresults
-
-
-@jit((float64[:,:,:], float64[:,:], float64[:,:], float64[:], float64[:], int64[:], float64[:], float64), nopython=True)
+@jit(nopython=True, cache=True)
 def sim_many_single(rProb, rts, xtb, vProb, bound, gOnset, dx, dt):
     ncond, ntrials, ntime = rProb.shape
     tb = ntime * dt
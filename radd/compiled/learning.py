@@ -0,0 +1,160 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import numpy as np
+import numba as nb
+from numba import jit, types, float64, int64
+from radd.compiled.jitfx import sim_dpm_go, sim_dpm_go_stop
+
+# Adaptive DPM trial loop with pluggable drift/bound update rules.
+#
+# Rules are compiled with a fixed signature and passed to the trial loop
+# as first-class functions, so the loop (and every rule) is compiled and
+# cached once. A rule receives the outcome of trial t and returns the
+# (drift, bound) used on trial t+1:
+#
+#   rule(ttype, response, rt, errT, vTrial, aTrial, drift, bound,
+#        AX, AX_t, BX_t, tb, TargetRT) -> (vTrial, aTrial)
+#
+#   ttype:      1. (go) or 0. (stop)
+#   response:   1. if the go process crossed the bound
+#   errT:       trials since the last failed stop (0. on a failed stop)
+#   drift/bound: initial drift-rate and bound
+#   AX_t, BX_t: learning rates scaled by sensitivity exp2(-t*PX)
+#
+# New rules are added with @learning_rule('name') and selected with
+# models_rl.Simulator.update(simfx_version='name').
+
+rule_signature = types.UniTuple(float64, 2)(float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, float64)
+rule_type = types.FunctionType(rule_signature)
+
+rules = {}
+
+
+def learning_rule(name, *aliases):
+    """ decorator compiling fx as an update rule and registering it under
+    name (and any aliases) in rules
+    """
+    def register(fx):
+        rule = jit(rule_signature, nopython=True, cache=True)(fx)
+        for key in (name,) + aliases:
+            rules[key] = rule
+        return rule
+    return register
+
+
+@jit(nopython=True, cache=True)
+def clip_drift(vTrial):
+    if vTrial > 2.0:
+        return 1.8
+    elif vTrial < .25:
+        return .28
+    return vTrial
+
+
+@learning_rule('drift', 'v1')
+def drift_rule(ttype, response, rt, errT, vTrial, aTrial, drift, bound, AX, AX_t, BX_t, tb, TargetRT):
+    """ drift-rate learns from timing errors, bound is boosted after failed stops
+    """
+    if response:
+        if ttype==0.:
+            vTrial = vTrial + AX_t * ((aTrial/tb) - (aTrial/rt))
+        else:
+            vTrial = vTrial + AX * ((aTrial/TargetRT) - (aTrial/rt))
+    aTrial = bound + BX_t * np.exp(-errT)
+    return clip_drift(vTrial), aTrial
+
+
+@learning_rule('bound', 'v2')
+def bound_rule(ttype, response, rt, errT, vTrial, aTrial, drift, bound, AX, AX_t, BX_t, tb, TargetRT):
+    """ bound learns from timing errors, drift-rate is slowed after failed stops
+    """
+    if response:
+        if ttype==0.:
+            aTrial = aTrial * 1/np.exp((rt-tb) * AX_t)
+        else:
+            aTrial = aTrial * 1/np.exp((rt-TargetRT) * AX_t)
+    vTrial = drift - BX_t * np.exp(-errT)
+    return clip_drift(vTrial), aTrial
+
+
+@jit(types.void(rule_type, float64[:,::1], float64[:,::1], float64[:,::1], float64[::1], int64[:,::1], float64, float64, float64, float64, float64, float64, float64, float64, float64, float64), nopython=True, cache=True)
+def sim_dpm_learning(rule, results, rProb, rProbSS, xtb, idxOffsets, drift, ssdrift, bound, onset, AX, BX, PX, dx, dt, tb):
+    """ simulate the trial sequence of each subject (contiguous rows of
+    results, idxOffsets[i] = (start, stop)), updating drift and bound after
+    every trial with rule. Writes response, acc, rt, sensitivity, drift and
+    bound columns of results in place
+    """
+    onsetIX = int(onset)
+    TargetRT = .52
+    goStartTrial = 0.
+    ssbound = 0.
+    si = .1
+    tb = tb + .02
+
+    vsProb = 0.5 * (1 + (ssdrift * np.sqrt(dt))/si)
+
+    for i in range(idxOffsets.shape[0]):
+        idxResults = results[idxOffsets[i, 0]:idxOffsets[i, 1]]
+        ntrials = idxResults.shape[0]
+        vTrial = drift
+        aTrial = bound
+        errT = 10000.
+
+        for t in range(ntrials):
+            ttype = idxResults[t, 1]
+            sensitivity = np.exp2(-t*PX)
+            vProbTrial = 0.5 * (1 + (vTrial * np.sqrt(dt))/si)
+
+            if ttype==0.:
+                ssdIX = int(idxResults[t, 2])
+                response, rt = sim_dpm_go_stop(rProb[t], xtb, vProbTrial, aTrial, onsetIX, rProbSS[t], vsProb, ssdIX, dx, dt, goStartTrial, ssbound)
+                if response:
+                    correct = 0.; errT = 0.
+                else:
+                    correct = 1.; errT += 1.
+            else:
+                errT += 1.
+                response, rt = sim_dpm_go(rProb[t], xtb, vProbTrial, aTrial, onsetIX, dx, dt, goStartTrial)
+                correct = response
+
+            vTrial, aTrial = rule(ttype, response, rt, errT, vTrial, aTrial, drift, bound, AX, AX*sensitivity, BX*sensitivity, tb, TargetRT)
+
+            # write in place (idx, ttype & ssd columns are unchanged)
+            idxResults[t, 3] = response
+            idxResults[t, 4] = correct
+            idxResults[t, 5] = rt
+            idxResults[t, 6] = sensitivity
+            idxResults[t, 7] = vTrial
+            idxResults[t, 8] = aTrial
+
+
+@jit(types.UniTuple(float64[:,:,:], 4)(rule_type, float64[:,::1], int64[::1], int64, float64[::1], int64[:,::1], float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, int64, int64[:]), nopython=True, parallel=True, cache=True)
+def sim_dpm_learning_nruns(rule, results, blockIX, nblocks, xtb, idxOffsets, drift, ssdrift, bound, onset, AX, BX, PX, dx, dt, tb, ntime, seeds):
+    """ run len(seeds) independent replicates of the adaptive trial sequence
+    in parallel, each with its own random stream, and return per-replicate
+    block sums/counts of go RTs (responses) and stop accuracy, each shaped
+    (nruns, nidx, nblocks)
+    """
+    nruns = seeds.size
+    nidx = idxOffsets.shape[0]
+    maxTrials = np.max(idxOffsets[:, 1] - idxOffsets[:, 0])
+    rtSum = np.zeros((nruns, nidx, nblocks))
+    rtN = np.zeros((nruns, nidx, nblocks))
+    saccSum = np.zeros((nruns, nidx, nblocks))
+    saccN = np.zeros((nruns, nidx, nblocks))
+    for r in nb.prange(nruns):
+        np.random.seed(seeds[r])
+        rProb = np.random.random((maxTrials, ntime))
+        rProbSS = np.random.random((maxTrials, ntime))
+        res = results.copy()
+        sim_dpm_learning(rule, res, rProb, rProbSS, xtb, idxOffsets, drift, ssdrift, bound, onset, AX, BX, PX, dx, dt, tb)
+        for i in range(nidx):
+            for row in range(idxOffsets[i, 0], idxOffsets[i, 1]):
+                b = blockIX[row]
+                if res[row, 3]==1.:
+                    rtSum[r, i, b] += res[row, 5]
+                    rtN[r, i, b] += 1.
+                if res[row, 1]==0.:
+                    saccSum[r, i, b] += res[row, 4]
+                    saccN[r, i, b] += 1.
+    return rtSum, rtN, saccSum, saccN
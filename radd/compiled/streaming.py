@@ -0,0 +1,155 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import numpy as np
+from numba import jit
+
+# One-pass (streaming) summary statistics for trial sequences.
+#
+# Each statistic keeps its state in a small float64 array that is updated
+# in place one observation at a time, so the update functions can be called
+# from other nopython kernels (e.g. radd.compiled.learning) as well as used
+# through the whole-sequence helpers (running_moments, ew_moments,
+# window_quantiles). nan observations are skipped.
+#
+#   welford state:  [n, mean, M2]        (welford_state())
+#   ew state:       [n, mean, var]       (ew_state())
+#   window state:   ring buffer of the last `window` values + sorted copy
+
+
+def welford_state():
+    return np.zeros(3)
+
+
+def ew_state():
+    return np.zeros(3)
+
+
+@jit(nopython=True, cache=True)
+def welford_update(state, x):
+    """ add x to a running mean / sum of squared deviations
+    """
+    if np.isnan(x):
+        return
+    state[0] += 1.
+    delta = x - state[1]
+    state[1] += delta / state[0]
+    state[2] += delta * (x - state[1])
+
+
+@jit(nopython=True, cache=True)
+def welford_var(state, ddof=1):
+    if state[0] <= ddof:
+        return np.nan
+    return state[2] / (state[0] - ddof)
+
+
+@jit(nopython=True, cache=True)
+def welford_merge(a, b, out):
+    """ combine the states of two disjoint sequences (Chan et al.) into out
+    """
+    n = a[0] + b[0]
+    if n == 0:
+        out[:] = 0.
+        return
+    delta = b[1] - a[1]
+    out[1] = a[1] + delta * b[0] / n
+    out[2] = a[2] + b[2] + delta**2 * a[0] * b[0] / n
+    out[0] = n
+
+
+@jit(nopython=True, cache=True)
+def ew_update(state, x, alpha):
+    """ exponentially weighted mean and variance with smoothing factor alpha
+    (weight of the newest observation)
+    """
+    if np.isnan(x):
+        return
+    if state[0] == 0:
+        state[1] = x
+        state[2] = 0.
+    else:
+        delta = x - state[1]
+        state[1] += alpha * delta
+        state[2] = (1. - alpha) * (state[2] + alpha * delta**2)
+    state[0] += 1.
+
+
+@jit(nopython=True, cache=True)
+def running_moments(x, ddof=1):
+    """ ::Returns:: (len(x) x 2) running mean and variance after each observation
+    """
+    state = np.zeros(3)
+    out = np.empty((x.size, 2))
+    for t in range(x.size):
+        welford_update(state, x[t])
+        out[t, 0] = state[1] if state[0] > 0 else np.nan
+        out[t, 1] = welford_var(state, ddof)
+    return out
+
+
+@jit(nopython=True, cache=True)
+def ew_moments(x, alpha):
+    """ ::Returns:: (len(x) x 2) exponentially weighted mean and variance after each observation
+    """
+    state = np.zeros(3)
+    out = np.empty((x.size, 2))
+    for t in range(x.size):
+        ew_update(state, x[t], alpha)
+        out[t, 0] = state[1] if state[0] > 0 else np.nan
+        out[t, 1] = state[2] if state[0] > 0 else np.nan
+    return out
+
+
+@jit(nopython=True, cache=True)
+def sorted_insert(srt, n, x):
+    """ insert x into the first n (sorted) values of srt
+    """
+    i = np.searchsorted(srt[:n], x)
+    srt[i+1:n+1] = srt[i:n].copy()
+    srt[i] = x
+
+
+@jit(nopython=True, cache=True)
+def sorted_remove(srt, n, x):
+    """ remove one x from the first n (sorted) values of srt
+    """
+    i = np.searchsorted(srt[:n], x)
+    srt[i:n-1] = srt[i+1:n].copy()
+
+
+@jit(nopython=True, cache=True)
+def sorted_quantile(srt, n, q):
+    """ quantile q of the first n sorted values (linear interpolation, as np.quantile)
+    """
+    if n == 0:
+        return np.nan
+    h = (n - 1) * q
+    lo = int(np.floor(h))
+    hi = min(lo + 1, n - 1)
+    return srt[lo] + (h - lo) * (srt[hi] - srt[lo])
+
+
+@jit(nopython=True, cache=True)
+def window_quantiles(x, window, q):
+    """ quantiles q of the last `window` observations after each observation,
+    kept in a sorted ring buffer (O(window) memory, no window copies)
+    ::Returns:: (len(x) x len(q)) array
+    """
+    ring = np.empty(window)
+    srt = np.empty(window)
+    out = np.empty((x.size, q.size))
+    n = 0
+    for t in range(x.size):
+        # value leaving the window
+        if t >= window:
+            old = ring[t % window]
+            if not np.isnan(old):
+                sorted_remove(srt, n, old)
+                n -= 1
+        ring[t % window] = x[t]
+        if not np.isnan(x[t]):
+            sorted_insert(srt, n, x[t])
+            n += 1
+        for j in range(q.size):
+            out[t, j] = sorted_quantile(srt, n, q[j])
+    return out
@@ -1,19 +1,20 @@
 #!usr/bin/env python
 from __future__ import division
 import os
+import warnings
 from future.utils import listvalues
 from copy import deepcopy
 import pandas as pd
 import numpy as np
 from numpy import array
-from radd.tools import analyze
+from radd.tools import analyze, trials
 from radd import theta
 from itertools import product
 
 
 class DataHandler(object):
 
-    def __init__(self, model, max_wt=3., verbose=False):
+    def __init__(self, model, max_wt=3., verbose=False, wts_method='mj', nthreads=1):
         self.model = model
         self.data = model.data
         self.inits = model.inits
@@ -22,6 +23,9 @@ class DataHandler(object):
         self.nidx = model.nidx
         self.weighted = model.weighted
         self.max_wt = max_wt
+        # quantile SE estimator & threads for quantile wts (see analyze.sorted_quantile_se)
+        self.wts_method = wts_method
+        self.nthreads = nthreads
         self.ssd_method = model.ssd_method
         self.kind = model.kind
         self.fit_on = model.fit_on
@@ -36,7 +40,11 @@ class DataHandler(object):
         self.cond_matrix = model.cond_matrix
         self.bwfactors = model.bwfactors
         self.nrows = self.nidx * model.nlevels
-        self.grpData = self.data.groupby(self.groups)
+        # trial group codes & keys (cached for make_rt_index)
+        self.grpCodes = None
+        # bootstrap replicates appended to the fit arrays (fit_on='bootstrap')
+        self.nboot = 0
+        self.bootSeed = None
         self.verbose = verbose
 
 
@@ -65,6 +73,13 @@ class DataHandler(object):
         self.fitdf = self.make_fit_df()
         # make poptdf for storing popt of conditional models as matrix
         self.poptdf = self.make_popt_df()
+        self.make_fit_arrays()
+
+
+    def make_fit_arrays(self):
+        """ observed data & wts arrays entered into the costfx
+        (observed, cond_wts, observed_flat, flat_wts)
+        """
         odf = self.observedDF.copy()
         wdf = self.wtsDF.copy()
         condvalues = lambda df: df.loc[:, 'acc':].dropna(axis=1).values.squeeze()
@@ -74,38 +89,100 @@ class DataHandler(object):
             self.cond_wts = [condvalues(wdf[wdf['idx']==idx]) for idx in self.idx]
             self.observed_flat = [flatvalues(odf[odf['idx']==idx].mean()) for idx in self.idx]
             self.flat_wts = [flatvalues(wdf[wdf['idx']==idx].mean()) for idx in self.idx]
-        elif self.fit_on=='average':
+        elif self.fit_on in ['average', 'bootstrap']:
             self.observed = [condvalues(odf.groupby(self.conds).mean())]
             self.cond_wts = [condvalues(wdf.groupby(self.conds).mean())]
             self.observed_flat = [flatvalues(odf.mean())]
             self.flat_wts = [flatvalues(wdf.mean())]
+            if self.fit_on=='bootstrap' and self.nboot:
+                # replicates follow the average arrays (fitparams ix=1...nboot)
+                bootObserved, bootFlat = self.make_boot_arrays(self.nboot, seed=self.bootSeed)
+                self.observed = self.observed + bootObserved
+                self.observed_flat = self.observed_flat + bootFlat
+                self.cond_wts = self.cond_wts * (self.nboot + 1)
+                self.flat_wts = self.flat_wts * (self.nboot + 1)
+
+
+    def make_boot_arrays(self, nboot=100, seed=None, chunksize=2**22):
+        """ observed & observed_flat arrays (as fit_on='average') of nboot
+        bootstrap replicates of the data. Every replicate resamples the trials
+        of each group x ttype (x ssd, probe) cell with replacement
+        (analyze.bootstrap_index). Replicates are summarized in chunks of
+        <= chunksize trials, each with a single make_rt_index pass over
+        (replicate, group) codes. Columns dropped from (nan in) the observed
+        average are dropped from (filled in) every replicate
+        ::Returns::
+            observed, observed_flat (lists, nboot long)
+        """
+        rng = np.random.RandomState(seed)
+        if self.grpCodes is None:
+            self.grpCodes = trials.group_codes(self.data, self.groups)
+        codes, keys = self.grpCodes
+        ngroups, ntrials = len(keys), codes.size
+        strata = [col for col in ['ttype', 'ssd', 'probe'] if col in self.data.columns]
+        strata = trials.group_codes(self.data.assign(grp=codes), ['grp'] + strata)[0]
+        trialdf = self.data[[col for col in ['ttype', 'response', 'acc', 'rt', 'ssd', 'probe'] if col in self.data.columns]]
+        obscols = self.p_cols + self.q_cols
+
+        values = np.zeros((nboot, ngroups, len(obscols)))
+        nchunk = max(1, chunksize // ntrials)
+        for b0 in range(0, nboot, nchunk):
+            nb = min(nchunk, nboot - b0)
+            ix = analyze.bootstrap_index(strata, nb, rng).ravel()
+            bootcodes = np.repeat(np.arange(nb) * ngroups, ntrials) + codes[ix]
+            bootkeys = pd.concat([keys] * nb, ignore_index=True)
+            index = analyze.make_rt_index(trialdf.take(ix), codes=(bootcodes, bootkeys), ssd_method=self.ssd_method, cells=False)
+            cq, eq = analyze.index_quantiles(index, self.quantiles)
+            values[b0:b0+nb] = analyze.index_observed(index, cq, eq, self.p_cols).reshape(nb, ngroups, -1)
+
+        # average across subjects (per condition level & flat)
+        levels, levelkeys = trials.group_codes(keys, self.conds)
+        odf = self.observedDF
+        condavg = odf[self.conds + obscols].groupby(self.conds, observed=True).mean().values
+        flatavg = odf[obscols].mean().values
+        keepcols = ~np.isnan(condavg).any(axis=0)
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            bootCond = np.stack([np.nanmean(values[:, levels==i], axis=1) for i in range(len(levelkeys))], axis=1)
+            bootFlat = np.nanmean(values, axis=1)
+        bootCond = np.where(np.isnan(bootCond), condavg, bootCond)[:, :, keepcols]
+        bootFlat = np.where(np.isnan(bootFlat), flatavg, bootFlat)
+        return [y.squeeze() for y in bootCond], list(bootFlat)
+
+
+    def update_quantiles(self, quantiles):
+        """ recompute the RT quantile columns of observedDF, their weights
+        (wtsDF), observedErr, yhatdf and fit arrays for new quantiles from the
+        cached sorted RTs (self.rtIndex). Accuracy columns & wts are reused
+        """
+        self.quantiles = quantiles
+        nq = len(self.q_cols)
+        keepcols = [col for col in self.observedDF.columns if col not in self.q_cols]
+        self.make_q_cols()
+        self.idx_cols = [cols[:len(cols)-nq] + self.q_cols for cols in self.idx_cols]
+        cq, eq = analyze.index_quantiles(self.rtIndex, self.quantiles)
+        qdf = pd.DataFrame(np.hstack([cq, eq]), columns=self.q_cols)
+        self.observedDF = pd.concat([self.observedDF[keepcols], qdf], axis=1)
+        self.wtsDF = self.make_wts_df()
+        self.make_observed_err()
+        self.yhatdf = self.make_yhat_df()
+        self.make_fit_arrays()
 
 
     def make_observed_groupDFs(self):
         """ concatenate all idx data vectors into a dataframe
         """
         odf_header = self.make_headers()
-        data = self.data.copy()
-        ssdmethod = self.ssd_method
-        self.grpData = data.groupby(np.hstack(['idx', self.conds]).tolist())
-        datdf = self.grpData.apply(analyze.rangl_data, ssdmethod, self.quantiles).sort_index(0)
-        # self.datdf = datdf
-        groupvalues = datdf.reset_index()[self.groups].values
-        nan_data = np.zeros((groupvalues.shape[0], len(odf_header)), dtype=np.int64)
-        self.observedDF = pd.DataFrame(nan_data, columns=odf_header, index=range(nan_data.shape[0]))
-        self.observedDF.loc[:, self.groups] = groupvalues
+        # sorted RTs & accuracy of every group, cached for update_quantiles
+        if self.grpCodes is None:
+            self.grpCodes = trials.group_codes(self.data, self.groups)
+        self.rtIndex = analyze.make_rt_index(self.data, self.groups, self.ssd_method, codes=self.grpCodes)
+        self.observedDF = self.make_observed_rows(self.rtIndex)
         self.wtsDF = self.make_wts_df()
-        for rowi in self.observedDF.index.values:
-            # fill observedDF one row at a time, using idx_rows
-            self.observedDF.loc[rowi, self.idx_cols[rowi]] = datdf.values[rowi]
 
         if self.bwfactors is not None and self.model.fit_on=='subjects':
             bwix = self.observedDF[self.groups].columns.size
-            bwunique = [self.data[self.data.idx==idx][self.bwfactors].unique() for idx in self.idx]
-            #wfactors = list(self.clmap)
-            #wfactors.remove(self.bwfactors)
-            # nwithin = np.sum([len(self.clmap[wfactor]) for wfactor in wfactors])
-            bwcast = np.hstack([np.tile(bw, self.nlevels) for bw in bwunique])
+            bwcast = self.make_bw_column(self.data, self.idx)
 
             print(len(bwcast))
             print(self.observedDF.shape[0])
@@ -113,16 +190,86 @@ class DataHandler(object):
             #print(self.observedDF)
             self.observedDF.insert(bwix, self.bwfactors, bwcast)
             self.wtsDF.insert(bwix, self.bwfactors, bwcast)
+        self.make_observed_err()
+
+
+    def make_observed_rows(self, rtIndex):
+        """ observedDF rows (groups, p_cols, q_cols) of every group in rtIndex
+        """
+        keys = rtIndex['keys'].copy()
+        keys.columns = self.groups
+        cq, eq = analyze.index_quantiles(rtIndex, self.quantiles)
+        obsvalues = analyze.index_observed(rtIndex, cq, eq, self.p_cols)
+        return pd.concat([keys, pd.DataFrame(obsvalues, columns=self.p_cols+self.q_cols)], axis=1)
+
+
+    def make_bw_column(self, data, idxlist):
+        """ between-subject factor level of each idx, repeated across its nlevels rows
+        """
+        bwunique = [data[data.idx==idx][self.bwfactors].unique() for idx in idxlist]
+        #wfactors = list(self.clmap)
+        #wfactors.remove(self.bwfactors)
+        # nwithin = np.sum([len(self.clmap[wfactor]) for wfactor in wfactors])
+        return np.hstack([np.tile(bw, self.nlevels) for bw in bwunique])
+
+
+    def add_data(self, data):
+        """ append trials of new subjects (data, already appended to self.data)
+        to rtIndex, observedDF, wtsDF, ssdDF and the fit arrays, summarizing
+        only the new trials
+        ::Returns::
+            False (nothing updated) if data has SSDs without a column in
+            observedDF, i.e. when make_dataframes is needed instead
+        """
+        newidx = list(data.idx.unique())
+        if 'ssd' in data.columns:
+            stopdf = data[data.ttype=='stop']
+            if 'probe' in stopdf.columns and self.ssd_method=='all':
+                stopdf = stopdf[stopdf.probe==1]
+            if self.ssd_method=='all':
+                get_df_ssds = lambda df: np.round(df.ssd.unique(), 1).astype(int)
+                ssd_list = [np.sort(get_df_ssds(df)).tolist() for _, df in stopdf.groupby(self.groups, observed=True)]
+                if ssd_list and not set(np.hstack(ssd_list)).issubset(self.p_cols[1:]):
+                    return False
+            else:
+                ssd_list = [['sacc'] for i in range(len(newidx) * self.nlevels)]
+            self.idx_cols = self.idx_cols + [self.p_cols[:1] + issd + self.q_cols for issd in ssd_list]
+            self.ssdDF = pd.concat([self.ssdDF, self.make_ssd_df(stopdf)], ignore_index=True)
+
+        rtIndex = analyze.make_rt_index(data, self.groups, self.ssd_method)
+        observedDF = self.make_observed_rows(rtIndex)
+        wtsDF = self.make_wts_df(observedDF, rtIndex, data)
+        if self.bwfactors is not None and self.model.fit_on=='subjects':
+            bwix = observedDF[self.groups].columns.size
+            bwcast = self.make_bw_column(data, newidx)
+            observedDF.insert(bwix, self.bwfactors, bwcast)
+            wtsDF.insert(bwix, self.bwfactors, bwcast)
+
+        self.observedDF = pd.concat([self.observedDF, observedDF], ignore_index=True)
+        self.wtsDF = pd.concat([self.wtsDF, wtsDF], ignore_index=True)
+        self.rtIndex = analyze.concat_rt_index(self.rtIndex, rtIndex)
+        # group codes of self.data are rebuilt on the next make_dataframes
+        self.grpCodes = None
+        self.idx = self.idx + newidx
+        self.nidx = len(self.idx)
+        self.nrows = self.nidx * self.nlevels
+        self.make_observed_err()
+        self.make_fit_arrays()
+        return True
+
+
+    def make_observed_err(self):
+        """ 2*SEM of observedDF across subjects (per condition)
+        """
+        if self.bwfactors is not None and self.model.fit_on=='subjects':
             errdf = self.observedDF.groupby(self.conds+[self.bwfactors]).sem()*2.
-            self.observedErr = errdf.reset_index()[self.observedDF.columns[1:]]
         else:
             errdf = self.observedDF.groupby(self.conds).sem()*2
-            self.observedErr = errdf.reset_index()[self.observedDF.columns[1:]]
+        self.observedErr = errdf.reset_index()[self.observedDF.columns[1:]]
 
 
     def make_freq_df(self):
-        data = self.data.copy()
-        self.grpData = data.groupby(self.groups)
+        self.grpData = self.data.groupby(self.groups, observed=True)
         freqdf = self.grpData.apply(analyze.rangl_freq, self.quantiles)
         countdf =  self.grpData.apply(analyze.rangl_counts)
 
@@ -136,15 +283,18 @@ class DataHandler(object):
         return freqDF
 
 
-    def make_wts_df(self):
+    def make_wts_df(self, observedDF=None, rtIndex=None, data=None):
         """ calculate and store cost_function weights
-        for all subjects/conditions in data
+        for all subjects/conditions in data (default: observedDF, rtIndex
+        and data of the handler)
         """
-        wtsDF = self.observedDF.copy()
+        if observedDF is None:
+            observedDF = self.observedDF
+        wtsDF = observedDF.copy()
         if self.weighted:
             try:
                 # calc & fill wtsDF with idx quantile and accuracy weights (ratios)
-                quant_wts, acc_wts = self.calc_empirical_weights()
+                quant_wts, acc_wts = self.calc_empirical_weights(rtIndex, data)
                 qwts = np.vstack(quant_wts).reshape(wtsDF.shape[0], -1)
                 awts = np.vstack(acc_wts).reshape(wtsDF.shape[0], -1)
                 wtsDF.loc[:, self.q_cols] = qwts
@@ -160,15 +310,27 @@ class DataHandler(object):
         return wtsDF.copy()
 
 
-    def calc_empirical_weights(self):
+    def calc_empirical_weights(self, rtIndex=None, data=None):
         """ calculates weight vectors for observed correct & err RT quantiles and
         go and stop accuracy for each subject (see funcs in radd.tools.analyze)
         """
-        data = self.data.copy()
+        cached = rtIndex is None
+        if cached:
+            rtIndex, data = self.rtIndex, self.data
         # quant_wts = [analyze.idx_quant_weights(df, conds=self.conds, max_wt=self.max_wt, quantiles=self.quantiles, bwfactors=self.bwfactors) for i, df in data.groupby('idx')]
-        quant_wts = analyze.idx_quant_weights_OLD(data, prob=self.quantiles, groups=self.groups, nsplits=np.cumprod(self.cond_matrix)[-1], max_wt=self.max_wt)
-        acc_wts = [analyze.idx_acc_weights(df, conds=self.conds, ssd_method=self.ssd_method) for i, df in data.groupby('idx')]
-        return quant_wts, acc_wts
+        nidx = data.idxN.unique().size if 'idxN' in data.columns else data.idx.unique().size
+        quant_wts = analyze.index_quant_weights(rtIndex, nidx, prob=self.quantiles, nsplits=np.cumprod(self.cond_matrix)[-1], max_wt=self.max_wt, method=self.wts_method, nthreads=self.nthreads)
+        get_acc_wts = lambda df: [analyze.idx_acc_weights(idf, conds=self.conds, ssd_method=self.ssd_method) for i, idf in df.groupby('idx', observed=True)]
+        if not cached:
+            # new subjects (add_data): extend the cached accuracy wts
+            acc_wts = get_acc_wts(data)
+            if hasattr(self, 'acc_wts'):
+                self.acc_wts = self.acc_wts + acc_wts
+            return quant_wts, acc_wts
+        # accuracy wts do not depend on quantiles (reused by update_quantiles)
+        if not hasattr(self, 'acc_wts'):
+            self.acc_wts = get_acc_wts(data)
+        return quant_wts, self.acc_wts
 
 
     def get_cond_combos(self):
@@ -304,9 +466,15 @@ class DataHandler(object):
             self.ssd_method = analyze.determine_ssd_method(stopdf)
             self.model.ssd_method = self.ssd_method
 
+        self.ssdDF = self.make_ssd_df(stopdf)
+
+
+    def make_ssd_df(self, stopdf):
+        """ model ssds of every idx (and condition) in stopdf
+        """
         bwfactors = self.bwfactors
         if bwfactors is not None:
-            stop_dfs = stopdf.groupby(bwfactors)
+            stop_dfs = stopdf.groupby(bwfactors, observed=True)
         else:
             stop_dfs = [[None, stopdf]]
 
@@ -317,7 +485,7 @@ class DataHandler(object):
                 sdf[bwfactors] = lvl
             ssdList.append(sdf)
 
-        self.ssdDF = pd.concat(ssdList, ignore_index=True)
+        return pd.concat(ssdList, ignore_index=True)
 
 
     def make_headers(self, ssd_list=None):
@@ -330,7 +498,7 @@ class DataHandler(object):
             self.set_model_ssds(stopdf)
             if self.ssd_method=='all':
                 get_df_ssds = lambda df: np.round(df.ssd.unique(), 1).astype(int)
-                ssds = [get_df_ssds(df) for _, df in stopdf.groupby(g_cols)]
+                ssds = [get_df_ssds(df) for _, df in stopdf.groupby(g_cols, observed=True)]
                 ssd_list = [np.sort(issd).tolist() for issd in ssds]
             else:
                 ssd_list = [['sacc'] for i in range(self.nrows)]
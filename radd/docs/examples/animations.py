@@ -72,7 +72,8 @@ def build_decision_axis(onset, bound, ssd=np.array([300, 400]), tb=650):
 
 def gen_re_traces(model):
     params = deepcopy(model.inits)
-    dvg, dvs, rt, ssrt = model.sim.simulate_traces(params)
+    # only go trials 0, 1 (and the stop traces of trial 0) are animated
+    dvg, dvs, rt, ssrt = model.sim._simulate_traces(params, trial_ix=np.arange(2))
     bound = params['a']
     tr = params['tr']
     goOn = model.sim.gOnset[0]
@@ -12,8 +12,9 @@ from scipy.stats import ks_2samp as KS
 from scipy.stats.mstats import mquantiles
 from itertools import product
 from radd import theta
-from radd.tools.utils import pandaify_results
+from radd.tools import trials
 from numpy import hstack as hs
+from time import perf_counter
 from radd.compiled.jitfx import *
 
 
@@ -21,6 +22,7 @@ class Simulator(object):
 
     def __init__(self, inits, fitparams=None, ssdMethod='all', **kwargs):
         self.ssdMethod = ssdMethod
+        self.profiler = None
         self.update(fitparams=fitparams, inits=inits)
         self.ksData = None
 
@@ -85,6 +87,18 @@ class Simulator(object):
         self.RTQ = lambda zpd: [mquantiles(rt[rt < deadline], prob) for rt, deadline in zpd]
         self.filterRT = lambda zpd: [rt[rt < deadline] for rt, deadline in zpd]
 
+    def __getstate__(self):
+        # analysis closures are rebuilt on unpickling (e.g. in worker processes)
+        state = self.__dict__.copy()
+        for fx in ['RTQ', 'filterRT']:
+            state.pop(fx, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'quantiles' in state:
+            self.__init_analyze_functions__()
+
     def cost_fx(self, theta_array):
         yhat = self.simulate_model(theta_array)
         return np.sum((self.wts * (yhat - self.y))**2)
@@ -145,6 +159,8 @@ class Simulator(object):
 
 
     def simulate_model(self, params, analyze=True, get_rts=False):
+        if self.profiler is not None:
+            return self._profiled_simulate_model(params, analyze=analyze, get_rts=get_rts)
         xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx = self.params_to_array(params, preprocess=True)
         dvg, goRT, ssRT = self.get_io_copies()
 
@@ -155,14 +171,79 @@ class Simulator(object):
         elif get_rts:
             return [goRT, ssRT]
 
-        return pandaify_results(goRT, ssRT, ssd=self.ssd, bootstrap=False, clmap=self.clmap, tb=self.tb)
+        return trials.sim_trials(goRT, ssRT, tb=self.tb, ssd=self.ssd, clmap=self.clmap)
+
+
+    def _profiled_simulate_model(self, params, analyze=True, get_rts=False):
+        """ simulate_model with per-stage timers and kernel counters
+        accumulated in self.profiler (see set_profiling)
+        """
+        prof = self.profiler
+        t0 = perf_counter()
+        theta_array = self.params_to_array(params)
+        prof.add('params_to_array', t0)
+        t0 = perf_counter()
+        p = self.preproc_params(theta_array)
+        prof.add('preproc_params', t0)
+        xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx = p
+        t0 = perf_counter()
+        io = self.get_io_copies()
+        prof.add('get_io_copies', t0)
+        dvg, goRT, ssRT = io
+        t0 = perf_counter()
+        sim_many_dpm(self.rProb, self.rProbSS, dvg, goRT, ssRT, xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx, self.si, self.dt)
+        prof.add('sim_many_dpm', t0)
+
+        # kernel counters: go process steps simulated per trial and
+        # fraction of trials that never crossed before the time bound
+        goSteps = np.minimum(np.round(goRT / self.dt), self.ntime) - gOnset[:, None]
+        prof.count('mean_steps_per_trial', goSteps.mean())
+        prof.count('frac_time_bound', np.mean(goRT >= self.tb))
+        nbytes = self.pmatrix_vals.values.nbytes + theta_array.nbytes
+        nbytes += np.sum([np.asarray(x).nbytes for x in p]) + np.sum([v.nbytes for v in io])
 
+        if analyze:
+            t0 = perf_counter()
+            yhat = self.analyze(goRT, ssRT)
+            prof.add('analyze', t0)
+            prof.count('bytes_per_eval', nbytes + yhat.nbytes)
+            return yhat
+        prof.count('bytes_per_eval', nbytes)
+        if get_rts:
+            return [goRT, ssRT]
+        return trials.sim_trials(goRT, ssRT, tb=self.tb, ssd=self.ssd, clmap=self.clmap)
 
-    def _simulate_traces(self, params):
+
+    def set_profiling(self, profiler=None):
+        """ accumulate simulate_model stage timers and kernel counters
+        in profiler (tools.profiler.Profiler), disabled if None
+        """
+        self.profiler = profiler
+
+
+    def _simulate_traces(self, params, ntraces=10, trial_ix=None, stride=1):
+        """ simulate all trials and record go & stop decision traces of a subset
+        of trials (float32, nan where a process did not run)
+        ::Arguments::
+            ntraces (int): record the first ntraces trials (if trial_ix is None)
+            trial_ix (array): indices of the recorded go trials (stop traces
+                are recorded for trials < nss_per)
+            stride (int): record every stride'th time step (frame f = time step f*stride)
+        ::Returns::
+            dvg (nlevels x ntraces x nframes), dvs (nlevels x nssd x ntraces x nframes),
+            goRT, ssRT (all trials)
+        """
         xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx = self.params_to_array(params, preprocess=True)
-        dvg, goRT, ssRT = self.get_io_copies()
-        dvs = self.dvs.copy()
-        sim_many_dpm_traces(self.rProb, self.rProbSS, dvg, dvs, goRT, ssRT, xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx, self.si, self.dt)
+        _, goRT, ssRT = self.vectors
+        goRT, ssRT = goRT.copy(), ssRT.copy()
+        if trial_ix is None:
+            trial_ix = np.arange(min(ntraces, self.ntrials))
+        goRec = np.full(self.ntrials, -1, dtype=np.int64)
+        goRec[trial_ix] = np.arange(len(trial_ix))
+        nframes = (self.ntime - 1) // stride + 1
+        dvg = np.full((self.nlevels, len(trial_ix), nframes), np.nan, dtype=np.float32)
+        dvs = np.full((self.nlevels, ssRT.shape[1], len(trial_ix), nframes), np.nan, dtype=np.float32)
+        sim_many_dpm_traces(self.rProb, self.rProbSS, goRec, dvg, dvs, goRT, ssRT, xtb, drift, ssdrift, bound, gbase, gOnset, ssOnset, dx, self.si, self.dt, stride)
         return [dvg, dvs, goRT, ssRT]
 
 
@@ -288,7 +369,11 @@ class Simulator(object):
         self.set_pconstant_values_matrix(self.theta)
 
 
-    def make_io_vectors(self):
+    def make_io_vectors(self, rng=None):
+        """ draw the random arrays of a simulation (from rng, a RandomState,
+        if given, else the global numpy RNG) and allocate the rt arrays
+        """
+        randsample = np.random.random_sample if rng is None else rng.random_sample
         self.rProb = randsample((self.nlevels, self.ntrials, self.ntime))
         dvg = np.zeros_like(self.rProb)
         self.goRT = np.zeros((self.nlevels, self.ntrials))
@@ -297,7 +382,6 @@ class Simulator(object):
             self.rProbSS = randsample((self.nlevels, nssd, nss_per, self.ntime))
             self.rProbSS3d = randsample((self.nlevels, nssd * nss_per, self.ntime))
             self.ssRT = np.zeros((self.nlevels, nssd, nss_per))
-            self.dvs = np.zeros_like(self.rProbSS)
             self.vectors = [dvg, self.goRT, self.ssRT]
             ssdSteps = get_onset_index(self.ssd, self.dt)
             self.ssdTrials = np.sort(np.tile(ssdSteps, nss_per))
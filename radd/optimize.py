@@ -7,14 +7,15 @@ from future.utils import listvalues
 import os, sys
 import numpy as np
 import pandas as pd
+from collections import deque
 from radd import models, theta
 from radd.adapt import models_rl
 from radd.tools import messages, utils
+from radd.tools.profiler import Profiler
+from time import perf_counter
 from copy import deepcopy
 from scipy.optimize import basinhopping, differential_evolution, fmin
 from numpy.random import uniform
-from lmfit import minimize, fit_report
-from IPython.display import clear_output
 
 
 class GlobalBounds(object):
@@ -44,13 +45,14 @@ class HopStep(object):
         keys (list): list of parameter names
         nlevels (list): list of levels per parameter
         stepsize (list): initial stepsize
+        maxlen (int): number of recent stepsizes kept in stepsizeList
     """
 
-    def __init__(self, keys, nlevels, stepsize=.15):
+    def __init__(self, keys, nlevels, stepsize=.15, maxlen=100):
         self.stepsize_scalars = self.get_stepsize_scalars(keys, nlevels)
         self.stepsize = stepsize
         self.np = self.stepsize_scalars.size
-        self.stepsizeList = []
+        self.stepsizeList = deque(maxlen=maxlen)
 
     def get_stepsize_scalars(self, keys, nlevels):
         """ returns an array of scalars used by for controlling
@@ -80,8 +82,7 @@ class HopStep(object):
         s = self.stepsize
         self.stepsizeList.append(s)
         ss = self.stepsize_scalars
-        x = np.array([x[i] + uniform(-ss[i]*s, ss[i]*s) for i in range(self.np)])
-        return x
+        return x + uniform(-ss*s, ss*s)
 
 
 def format_local_bounds(xmin, xmax):
@@ -115,10 +116,11 @@ class Optimizer(object):
         basinparams (dict): dictionary of global optimization params
         progress (bool): initialize progress bars (default=True)
         custompath (str): local path from ~ to save results
-        custompath (str): local path from ~ to save results
+        sink (object): tools.telemetry sink receiving (fev, fmin, x) records
+        profile (bool): accumulate stage timers in self.profiler (see set_profiling)
     """
 
-    def __init__(self, fitparams={}, basinparams={}, inits=None, param_sets=None, custompath=None, nruns=10, data=None):
+    def __init__(self, fitparams={}, basinparams={}, inits=None, param_sets=None, custompath=None, nruns=10, data=None, sink=None, profile=False):
 
         self.fitparams = fitparams
         self.basinparams = basinparams
@@ -136,9 +138,10 @@ class Optimizer(object):
         self.constants = list(inits)
         self.param_sets = param_sets
         self.nruns=nruns
+        self.set_telemetry(sink=sink)
 
         self.progress = self.basinparams['progress']
-        if self.progress:
+        if self.monitor:
             self.make_progress_bars(inits=True, basin=True)
 
         if self.learn:
@@ -146,6 +149,7 @@ class Optimizer(object):
             self.simRL = models_rl.Simulator(self.inits, data=data, fitparams=self.fitparams, ssdMethod=self.ssdMethod, constants=self.constants)
 
         self.sim = models.Simulator(self.inits, fitparams=self.fitparams, ssdMethod=self.ssdMethod)
+        self.set_profiling(profile)
         self.update()
         self.make_results_dir(custompath=custompath)
 
@@ -197,7 +201,7 @@ class Optimizer(object):
         if param_sets is None:
             self.sample_param_sets(learn)
             param_sets = self.param_sets
-        if self.progress:
+        if self.monitor:
             self.make_progress_bars(inits=True, basin=True)
 
         xpopt, xfmin, global_results = [], [], []
@@ -213,8 +217,9 @@ class Optimizer(object):
             xfmin.append(fmin)
             global_results.append(out)
 
-        if self.progress:
+        if self.monitor:
             self.gbar.clear()
+        if self.progress:
             self.ibar.clear()
 
         keep_ix = np.argmin(xfmin)
@@ -288,15 +293,21 @@ class Optimizer(object):
             if self.ksTest:
                 costfx = self.sim.ks_stat
 
-        if self.progress:
-            if resetProgress:
-                self.make_progress_bars(inits=True, basin=True)
-                clear_output()
+        if self.progress and resetProgress:
+            from IPython.display import clear_output
+            self.make_progress_bars(inits=True, basin=True)
+            clear_output()
+        if self.monitor and hasattr(self, 'gbar'):
             self.callback = self.gbar.reset(get_call=True, gbasin=resetProgress)
 
         # create args for customizing global optimizer
         self.set_global_options(learn=learn)
 
+        if self.profiler is not None:
+            costfx = self.profiler.wrap('global_cost_fx', costfx)
+            self.callback = self.profiler.wrap('global_callback', self.callback)
+            t0 = perf_counter()
+
         # run global optimization (basinhopping/differential_evolution)
         if bp['method']=='basin':
             out = basinhopping(costfx, x0=x0, minimizer_kwargs=self.polish_args, T=bp['T'], stepsize=bp['stepsize'], niter_success=bp['nsuccess'], niter=bp['niter'], interval=bp['interval'], take_step=self.custom_step, accept_test=self.accept_step, callback=self.callback)
@@ -304,10 +315,13 @@ class Optimizer(object):
 
         elif bp['method']=='evolution':
             out = differential_evolution(costfx, bounds = self.polish_args['bounds'], popsize=bp['popsize'], recombination=bp['recombination'], mutation=bp['mutation'], strategy=bp['strategy'], disp=bp['disp'], polish=True, maxiter=bp['maxiter'], tol=bp['tol'], callback=self.callback, atol=self.fitparams['tol'])
-            if self.progress:
+            if self.monitor:
                 self.gbar.clear()
             fit_info = out
 
+        if self.profiler is not None:
+            self.profiler.add('global', t0)
+
         pdict = self.popt_array_to_dict(fit_info.x,  learn=learn)
         popt.update(pdict)
         fmin = fit_info.fun
@@ -332,6 +346,7 @@ class Optimizer(object):
             popt (dict):    optimized parameter dictionary
             yhat (array):   model-predicted data vector
         """
+        from lmfit import minimize, fit_report
         flat= False
 
         fp = self.fitparams
@@ -359,20 +374,27 @@ class Optimizer(object):
 
         self.lmParams = lmParams
 
-        if self.progress:
-            self.lbar = utils.GradientCallback(n=fp['maxfev'], fmin=10000)
+        if self.monitor:
+            self.lbar = utils.GradientCallback(n=fp['maxfev'], fmin=10000, progress=self.progress, sink=self.sink, every=self.telemetry_every)
             self.lcallback = self.lbar.callback
         else:
             self.lcallback = None
 
+        if self.profiler is not None:
+            costfx = self.profiler.wrap('lmfit_cost_fx', costfx)
+            self.lcallback = self.profiler.wrap('lmfit_callback', self.lcallback)
+            t0 = perf_counter()
+
         if 'least' in fp['method']:
-            self.lmMin = minimize(costfx, lmParams, method=fp['method'], iter_cb=self.lbar.callback)
+            self.lmMin = minimize(costfx, lmParams, method=fp['method'], iter_cb=self.lcallback)
         elif fp['method']=='brute':
             #rranges = (slice(-4, 4, 0.25), slice(-4, 4, 0.25))
-            self.lmMin = minimize(costfx, lmParams, method=fp['method'], iter_cb=self.lbar.callback, Ns=20)
+            self.lmMin = minimize(costfx, lmParams, method=fp['method'], iter_cb=self.lcallback, Ns=20)
         else:
-            self.lmMin = minimize(costfx, lmParams, method=fp['method'], tol=fp['tol'],  options=optkws, iter_cb=self.lbar.callback)
-        if hasattr(self, 'lbar'):
+            self.lmMin = minimize(costfx, lmParams, method=fp['method'], tol=fp['tol'],  options=optkws, iter_cb=self.lcallback)
+        if self.profiler is not None:
+            self.profiler.add('lmfit', t0)
+        if self.monitor:
             self.lbar.clear()
 
         self.param_report = fit_report(self.lmMin.params)
@@ -399,10 +421,12 @@ class Optimizer(object):
         self.custom_step = HopStep(sim.pvary, nlevels=sim.nvary, stepsize=bp['stepsize'])
         self.polish_args = {"method": bp['local_method'], 'bounds': bounds, 'tol': bp['polish_tol'], 'options': {'xtol': bp['polish_tol'], 'ftol': bp['polish_tol']}}
 
-        if self.progress:
-            if not hasattr(self, 'gbar') or self.gbar.pbar.displayed==False:
-                self.make_progress_bars(inits=False, basin=True)
+        if self.monitor:
+            if not hasattr(self, 'gbar') or (self.progress and (self.gbar.pbar is None or not self.gbar.pbar.displayed)):
+                self.make_progress_bars(inits=False, basin=True, lBasin=False)
             self.callback = self.gbar.reset(get_call=True, gbasin=False, history=False)
+        else:
+            self.callback = None
 
 
     def sample_param_sets(self, learn=False, fitDynamics=True):
@@ -641,9 +665,39 @@ class Optimizer(object):
         self.resultsdir = savedir
 
 
+    def set_telemetry(self, sink=None, every=25):
+        """ set the tools.telemetry sink that global and local optimization
+        callbacks emit (fev, fmin, x) records to (every n-th evaluation).
+        With no sink and progress=False no callbacks are attached at all.
+        """
+        self.sink = sink
+        self.telemetry_every = every
+        if hasattr(self, 'gbar'):
+            # rebuilt with the new sink on the next global fit
+            self.gbar.clear()
+            del self.gbar
+
+
+    def set_profiling(self, profile=True):
+        """ enable (or disable) hot-path profiling: stage timers for the
+        simulator (params_to_array, preproc_params, get_io_copies, sim_many_dpm,
+        analyze), cost function, callbacks and optimizer overhead plus kernel
+        counters, accumulated across fits in self.profiler
+        (see self.profiler.report(), counter_report() and save())
+        """
+        self.profiler = Profiler() if profile else None
+        self.sim.set_profiling(self.profiler)
+
+
+    @property
+    def monitor(self):
+        return self.basinparams['progress'] or self.sink is not None
+
+
     def make_progress_bars(self, inits=True, basin=True, lBasin=True):
         bp = self.basinparams
-        if inits:
+        progress = bp['progress']
+        if inits and progress:
             ninits = bp['ninits']
             status=' / '.join(['Inits {}', '{}'.format(ninits)])
             self.ibar = utils.PBinJ(n=ninits, color='b', status=status)
@@ -654,11 +708,11 @@ class Optimizer(object):
                 niter = bp['nsuccess']
             else:
                 niter = bp['maxiter']
-            self.gbar = utils.GlobalCallback(n=niter, fmin=10000, method=bp['method'])
+            self.gbar = utils.GlobalCallback(n=niter, fmin=10000, method=bp['method'], progress=progress, sink=self.sink, every=self.telemetry_every)
             self.callback = self.gbar.reset(get_call=True)
         if lBasin:
             fp = self.fitparams
             if hasattr(self, 'lbar'):
                 self.lbar.clear()
-            self.lbar = utils.GradientCallback(n=fp['maxfev'], fmin=10000)
+            self.lbar = utils.GradientCallback(n=fp['maxfev'], fmin=10000, progress=progress, sink=self.sink, every=self.telemetry_every)
             self.callback = self.lbar.reset(get_call=True)
@@ -6,8 +6,6 @@ import numpy as np
 from copy import deepcopy
 from numpy import array
 from scipy.stats.distributions import norm, gamma, uniform
-from lmfit import Parameters as lmParameters
-from pyDOE import lhs
 
 
 def random_inits(pkeys, ninits=1, kind='dpm', as_list=False, force_normal=False, method='random'):
@@ -39,6 +37,7 @@ def latin_hypercube(pkeys, kind='dpm', nrvs=25, tb=.65, force_normal=False):
     """ sample random parameter sets to explore global minima (called by
     Optimizer method __hop_around__())
     """
+    from pyDOE import lhs
     nparams = len(pkeys)
     design = lhs(nparams, samples=nrvs, criterion='center')
     bounds = get_bounds(kind=kind)
@@ -155,6 +154,7 @@ def loadParameters(inits=None, is_flat=False, kind=None, pcmap={}):
     """ Generates and returns an lmfit Parameters object with
     bounded parameters initialized for flat or non flat model fit
     """
+    from lmfit import Parameters as lmParameters
     lmParams = lmParameters()
     pnames = ['a', 'tr', 'v', 'ssv', 'z', 'xb', 'si', 'sso', 'BX', 'AX', 'PX']
     pfit = list(set(inits.keys()).intersection(pnames))
@@ -192,6 +192,7 @@ def loadParameters_RL(inits, pvary, pflat, nlevels=1, kind='dpm'):
     """ Generates and returns an lmfit Parameters object with
     bounded parameters initialized for flat or non flat model fit
     """
+    from lmfit import Parameters as lmParameters
     lmParams = lmParameters()
     bounds = get_bounds(kind=kind)
     if nlevels > 1:
@@ -5,7 +5,6 @@ import numpy as np
 import os
 from numpy import array
 from future.utils import listvalues
-from sklearn.neighbors import KernelDensity
 from scipy.stats.mstats import mquantiles as mq
 from scipy.stats.mstats_extras import mjci
 from scipy import optimize
@@ -13,6 +12,7 @@ import functools
 from scipy.interpolate import interp1d
 from scipy import stats
 from scipy.optimize import leastsq, minimize, curve_fit
+from radd.tools import trials
 
 
 def ezdiff(rt, correct, s=1.):
@@ -67,7 +67,6 @@ def rangl_data(data, ssd_method='all', quantiles=np.linspace(.01,.99,15), fit_on
     """ called by DataHandler.__make_dataframes__ to generate
     observed data arrays
     """
-    data = data.copy()
     if 1 in data.ttype.unique():
         goQuery = 'ttype==1.'
         stopQuery = 'ttype==0.'
@@ -95,6 +94,187 @@ def rangl_data(data, ssd_method='all', quantiles=np.linspace(.01,.99,15), fit_on
     return np.hstack(data_vector)
 
 
+def make_rt_index(data, groups=['idx'], ssd_method='all', codes=None, cells=True):
+    """ summarize data once into everything that does not depend on the RT
+    quantiles: go accuracy and stop accuracy (per SSD) of every group, and
+    sorted RT segments of every group for correct ('cor') and error ('err')
+    responses (rt < 5) and for every (group, ttype, acc) cell of responses
+    ('cells', used for quantile weights). Go/stop accuracy and RT segments are
+    computed with one groupby code pass, bincount means and one (code, rt) sort
+    ::Arguments::
+        codes (tuple): cached trials.group_codes(data, groups)
+        cells (bool): if False, skip the 'cells' segments (None)
+    ::Returns::
+        dict with
+        keys (DataFrame): group values (sorted, one row per group)
+        gac (array): go accuracy (ngroups)
+        sacc (array): stop accuracy (ngroups x nssd, nan if a group lacks an SSD),
+            nssd=1 if ssd_method is not 'all', None if data has no ssd column
+        ssds (array): SSD of each sacc column (None unless ssd_method=='all')
+        cor, err, cells: (sorted rts, segment starts, segment counts)
+    """
+    if codes is None:
+        codes = trials.group_codes(data, groups)
+    codes, keys = codes
+    ngroups = len(keys)
+    if pd.api.types.is_numeric_dtype(data.ttype):
+        isgo, isstop = data.ttype.values==1., data.ttype.values==0.
+    else:
+        isgo, isstop = data.ttype.values=='go', data.ttype.values=='stop'
+    acc = data.acc.values.astype(float)
+    rt = data.rt.values.astype(float)
+    response = data.response.values
+
+    index = {'keys': keys, 'gac': segment_means(codes[isgo], acc[isgo], ngroups)}
+    for name, cor in [('cor', 1), ('err', 0)]:
+        keep = (response==1) & (acc==cor) & (rt < 5.)
+        index[name] = segment_sorted(codes[keep], rt[keep], ngroups)
+
+    # (group, ttype, acc) cells of all responses, ordered as groupby
+    index['cells'] = None
+    if cells:
+        respdf = data[response==1]
+        cellcodes, cellkeys = trials.group_codes(respdf, list(groups) + ['ttype', 'acc'])
+        index['cells'] = segment_sorted(cellcodes, respdf.rt.values.astype(float), len(cellkeys))
+
+    index['sacc'], index['ssds'] = None, None
+    if 'ssd' in data.columns:
+        if 'probe' in data.columns:
+            isstop = isstop & (data.probe.values==1)
+        if ssd_method=='all':
+            ssds, ssdIX = np.unique(data.ssd.values[isstop], return_inverse=True)
+            cells = codes[isstop] * ssds.size + ssdIX
+            index['sacc'] = segment_means(cells, acc[isstop], ngroups * ssds.size).reshape(ngroups, ssds.size)
+            index['ssds'] = ssds
+        else:
+            index['sacc'] = segment_means(codes[isstop], acc[isstop], ngroups)[:, None]
+    return index
+
+
+def index_quantiles(index, quantiles):
+    """ correct & error RT quantiles (ngroups x nquantiles) from make_rt_index
+    (or ingest.TrialSummary.make_rt_index)
+    """
+    return [sorted_mquantiles(*index[name][:3], prob=quantiles, freq=index_freq(index, name)) for name in ['cor', 'err']]
+
+
+def concat_rt_index(a, b):
+    """ make_rt_index of two datasets with disjoint groups (groups of b
+    follow those of a). Stop accuracy columns are aligned on the union of SSDs
+    """
+    index = {'keys': pd.concat([a['keys'], b['keys']], ignore_index=True), 'gac': np.r_[a['gac'], b['gac']]}
+    index['sacc'], index['ssds'] = a['sacc'], a['ssds']
+    if a['sacc'] is not None and a['ssds'] is not None:
+        ssds = np.union1d(a['ssds'], b['ssds'])
+        sacc = np.full((len(index['keys']), ssds.size), np.nan)
+        sacc[:a['gac'].size, np.searchsorted(ssds, a['ssds'])] = a['sacc']
+        sacc[a['gac'].size:, np.searchsorted(ssds, b['ssds'])] = b['sacc']
+        index['sacc'], index['ssds'] = sacc, ssds
+    elif a['sacc'] is not None:
+        index['sacc'] = np.vstack([a['sacc'], b['sacc']])
+    for name in ['cor', 'err', 'cells']:
+        xa, starta, counta = a[name][:3]
+        xb, startb, countb = b[name][:3]
+        index[name] = (np.r_[xa, xb], np.r_[starta, startb + xa.size], np.r_[counta, countb])
+        if len(a[name]) > 3:
+            index[name] += (np.r_[a[name][3], b[name][3]],)
+    return index
+
+
+def index_observed(index, cq, eq, p_cols):
+    """ observedDF values (ngroups x p_cols + quantile cols) of all groups:
+    go accuracy, stop accuracy per SSD (or 'sacc') and correct/error RT
+    quantiles. SSDs missing in a group stay 0
+    """
+    obsvalues = np.zeros((len(index['keys']), len(p_cols) + cq.shape[1] + eq.shape[1]))
+    obsvalues[:, 0] = index['gac']
+    if index['sacc'] is not None:
+        if index['ssds'] is not None:
+            ssdcols = [p_cols.index(ssd) for ssd in np.round(index['ssds'], 1).astype(int)]
+        else:
+            ssdcols = [1]
+        obsvalues[:, ssdcols] = np.where(np.isnan(index['sacc']), 0, index['sacc'])
+    obsvalues[:, len(p_cols):] = np.hstack([cq, eq])
+    return obsvalues
+
+
+def index_freq(index, name):
+    """ frequencies of the sorted values of index[name], None if each value
+    is a single trial (index[name] = (values, starts, counts[, freq]))
+    """
+    segs = index[name]
+    return segs[3] if len(segs) > 3 else None
+
+
+def segment_means(codes, values, nsegments):
+    """ mean of values within each segment code (nan if empty)
+    """
+    n = np.bincount(codes, minlength=nsegments)
+    total = np.bincount(codes, weights=values, minlength=nsegments)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / n
+
+
+def segment_sorted(codes, values, nsegments):
+    """ sort values by (segment code, value)
+    ::Returns:: sorted values, segment starts, segment counts
+    """
+    order = np.lexsort((values, codes))
+    counts = np.bincount(codes, minlength=nsegments)
+    starts = np.cumsum(counts) - counts
+    return values[order], starts, counts
+
+
+def sorted_mquantiles(x, starts, counts, prob, alphap=.4, betap=.4, freq=None):
+    """ mquantiles (same plotting positions) of each sorted segment
+    x[starts[i]:starts[i]+counts[i]]. If freq is given, x[j] occurs freq[j]
+    times. Empty segments are nan
+    ::Returns:: (nsegments x len(prob)) array
+    """
+    prob = np.asarray(prob, dtype=float)
+    nsegments = counts.size
+    n = segment_totals(starts, counts, freq)[:, None]
+    m = alphap + prob*(1.-alphap-betap)
+    aleph = n*prob + m
+    k = np.floor(np.clip(aleph, 1, np.maximum(n-1, 1))).astype(int)
+    gamma = np.clip(aleph-k, 0, 1)
+    out = np.full((nsegments, prob.size), np.nan)
+    many = n[:, 0] > 1
+    lo, hi = order_stats(x, starts[many], counts[many], k[many], freq), order_stats(x, starts[many], counts[many], k[many]+1, freq)
+    out[many] = (1.-gamma[many])*lo + gamma[many]*hi
+    one = n[:, 0] == 1
+    out[one] = x[starts[one]][:, None]
+    return out
+
+
+def segment_totals(starts, counts, freq=None):
+    """ number of observations in each segment
+    """
+    if freq is None:
+        return counts.astype(float)
+    cum = np.r_[0., np.cumsum(freq)]
+    return cum[starts + counts] - cum[starts]
+
+
+def order_stats(x, starts, counts, k, freq=None):
+    """ k-th (1-based, nsegments x nk) smallest value of each sorted segment
+    """
+    if freq is None:
+        return x[starts[:, None] + k - 1]
+    cum = np.cumsum(freq)
+    base = np.r_[0, cum][starts]
+    return x[np.searchsorted(cum, base[:, None] + k, side='left')]
+
+
+def gather_segments(x, starts, counts, freq=None):
+    """ contiguous copy of the segments of x (and freq)
+    ::Returns:: values, starts, counts, freq
+    """
+    offsets = np.cumsum(counts) - counts
+    ix = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+    return x[ix], offsets, counts, (None if freq is None else freq[ix])
+
+
 def rangl_freq(df, quantiles=np.arange(.1, 1.,.2)):
 
     prob = np.asarray([0.] + quantiles.tolist() + [1.])
@@ -169,35 +349,108 @@ def calculate_qpdata(data, quantiles=np.linspace(.02,.98,10)):
     return quantMeans, quantErr
 
 
-def idx_quant_weights_OLD(df, groups=[], nsplits=1, prob=np.arange(.1,1.,.1), max_wt=2.5):
-
-    """ calculates weight vectors for reactive RT quantiles by
-    first estimating the SEM of RT quantiles for corr. and err. responses.
-    (using Maritz-Jarrett estimatation: scipy.stats.mstats_extras.mjci).
-    Then representing these variances as ratios.
-    e.g.
-          QSEM = mjci(rtvectors)
-          wts = median(QSEM)/QSEM
+def index_quant_weights(index, nidx, nsplits=1, prob=np.arange(.1,1.,.1), max_wt=2.5, method='mj', nthreads=1):
+    """ calculates weight vectors for reactive RT quantiles by first
+    estimating the SEM of RT quantiles for corr. and err. responses from the
+    sorted (group, ttype, acc) response cells of make_rt_index (see
+    sorted_quantile_se for method, nthreads), then representing these
+    variances as ratios (see quant_weight_ratios)
     """
-    idx_mjci = lambda x: mjci(x.rt, prob=prob)
+    quant_err = sorted_quantile_se(*index['cells'][:3], prob=prob, method=method, nthreads=nthreads, freq=index_freq(index, 'cells'))
+    return quant_weight_ratios(quant_err, nidx, nsplits, max_wt)
 
-    nquant = prob.size
-
-    if 'idxN' in df.columns:
-        nidx = df.idxN.unique().size
-    else:
-        nidx = df.idx.unique().size
-
-    # get all trials with response recorded
-    godf = df.query('response==1')
-
-    # sort by ttype first so go(acc==1) occurs before stop(acc==0)
-    ttype_ordered_groups = np.hstack([groups, 'ttype', 'acc']).tolist()
-    godf_grouped = godf.groupby(ttype_ordered_groups)
-
-    # apply self.idx_mjci() to estimate quantile CI's
-    quant_err = np.vstack(godf_grouped.apply(idx_mjci).values)
 
+def sorted_quantile_se(x, starts, counts, prob, method='mj', nthreads=1, chunksize=2**22, freq=None):
+    """ standard error of quantiles prob of each sorted segment
+    x[starts[i]:starts[i]+counts[i]] (x[j] occurs freq[j] times if given)
+    ::Arguments::
+        method (str):
+            'mj': Maritz-Jarrett estimate (same values as scipy's mjci)
+            'asymptotic': sqrt(p(1-p)/n) / f(q_p), with the density f(q_p)
+                estimated from order statistic spacings (Hall-Sheather bandwidth)
+        nthreads (int):
+            segments are split into contiguous chunks (at most ~chunksize
+            values x quantiles each) and evaluated on a pool of nthreads threads
+    ::Returns:: (nsegments x len(prob)) array
+    """
+    prob = np.asarray(prob, dtype=float)
+    starts, counts = np.asarray(starts), np.asarray(counts)
+    sefx = {'mj': mj_se, 'asymptotic': asymptotic_se}[method]
+    nchunks = max(nthreads, int(np.ceil((counts.sum() + counts.size) * prob.size / chunksize)))
+    chunks = [ix for ix in np.array_split(np.arange(counts.size), min(nchunks, counts.size)) if ix.size]
+    if len(chunks) < 2:
+        return sefx(x, starts, counts, prob, freq)
+    def run_chunk(ix):
+        values, offsets, n, f = gather_segments(x, starts[ix], counts[ix], freq)
+        return sefx(values, offsets, n, prob, f)
+    if nthreads > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            return np.vstack(list(pool.map(run_chunk, chunks)))
+    return np.vstack([run_chunk(ix) for ix in chunks])
+
+
+def mj_se(x, starts, counts, prob, freq=None):
+    """ vectorized Maritz-Jarrett standard errors (see sorted_quantile_se):
+    the beta cdf of every segment is evaluated once per value at its
+    cumulative position c/n (W = cdf(c/n) - cdf(c_prev/n)) in one call and
+    weighted sums are taken per segment. Quantiles without a valid beta
+    weight (m < 2 or m >= n, as in mjci) are nan
+    """
+    from scipy.special import betainc
+    nseg = counts.size
+    out = np.full((nseg, prob.size), np.nan)
+    full = counts > 0
+    if not full.any():
+        return out
+    values, offsets, counts, freq = gather_segments(x, starts[full], counts[full], freq)
+    seg = np.repeat(np.arange(counts.size), counts)
+    freq = np.ones(values.size) if freq is None else freq.astype(float)
+    cum = np.cumsum(freq)
+    segcum = cum - np.r_[0., cum][offsets][seg]
+    n = segment_totals(offsets, counts, freq)
+    m = (prob[None, :] * n[:, None] + .5).astype(int)
+    a, b = m - 1., n[:, None] - m
+    valid = (a > 0) & (b > 0)
+    a, b = np.where(valid, a, 1.), np.where(valid, b, 1.)
+
+    cdf = betainc(a[seg], b[seg], (segcum / n[seg])[:, None])
+    W = cdf.copy()
+    W[1:] -= cdf[:-1]
+    W[offsets] = cdf[offsets]
+    values = values[:, None]
+    C1 = np.add.reduceat(W * values, offsets, axis=0)
+    C2 = np.add.reduceat(W * values**2, offsets, axis=0)
+    with np.errstate(invalid='ignore'):
+        out[full] = np.where(valid, np.sqrt(C2 - C1**2), np.nan)
+    return out
+
+
+def asymptotic_se(x, starts, counts, prob, freq=None):
+    """ closed-form quantile standard errors sqrt(p(1-p)/n) * s(p), with the
+    sparsity s(p) = 1/f(q_p) estimated by the spacing of the order statistics
+    at p +/- h (Hall-Sheather bandwidth h). nan for segments with < 2 values
+    """
+    out = np.full((counts.size, prob.size), np.nan)
+    n = segment_totals(starts, counts, freq)
+    full = n > 1
+    starts, counts, n = starts[full], counts[full], n[full][:, None]
+    z = stats.norm.ppf(prob)
+    h = n**(-1/3) * stats.norm.ppf(.975)**(2/3) * (1.5 * stats.norm.pdf(z)**2 / (2 * z**2 + 1))**(1/3)
+    lo = np.clip(np.ceil(n * (prob - h)), 1, n).astype(int)
+    hi = np.clip(np.ceil(n * (prob + h)), 1, n).astype(int)
+    gap = hi - lo
+    sparsity = (order_stats(x, starts, counts, hi, freq) - order_stats(x, starts, counts, lo, freq)) * n / np.maximum(gap, 1)
+    se = np.sqrt(prob * (1 - prob) / n) * sparsity
+    out[full] = np.where(gap > 0, se, np.nan)
+    return out
+
+
+def quant_weight_ratios(quant_err, nidx, nsplits, max_wt):
+    """ quantile weights from their standard errors (ncells x nquant):
+    median(QSEM) / QSEM per subject, capped at max_wt
+    """
+    nquant = quant_err.shape[1]
     # reshape [nidx   x   ncond * nquant * nacc]
     idx_qerr = quant_err.reshape(nidx, nsplits * nquant * 2)
 
@@ -279,7 +532,7 @@ def idx_acc_weights(data, conds=['flat'], ssd_method='all'):
         split_by = conds
         _ = index.remove(split_by)
     df['n'] = 1
-    countdf = df.pivot_table('n', index=index, columns=split_by, aggfunc=np.sum)
+    countdf = df.pivot_table('n', index=index, columns=split_by, aggfunc=np.sum, observed=True)
     idx_pwts = countdf.values / countdf.median(axis=1).values[:, None]
     idx_pwts = np.ones_like(idx_pwts) #+ .5
     # idx_pwts = countdf.values / countdf.median(axis=0).values
@@ -340,11 +593,11 @@ def pandaify_results(gort, ssrt, tb=.7, bootstrap=False, bootinfo={'nsubjects':2
         dfData = [cond, ttype, delays, response, acc, responseTime, ssResponseTime, trial]
         df = pd.DataFrame(dict(zip(dfColumns, dfData)), index=dfIndex)
         dfList.append(df[dfColumns])
-    df = pd.concat(dfList)
-    df.reset_index(drop=True, inplace=True)
-    # stopdf = resultsdf[resultsdf.ttype==0.]
-    df.loc[(df.rt==1000.)&(df.ssrt==1000.)&(df.ttype==0.), 'response'] = 0
-    df.loc[(df.rt==1000.)&(df.ssrt==1000.)&(df.ttype==0.), 'acc'] = 1
+    resultsdf = pd.concat(dfList)
+    resultsdf.reset_index(drop=True, inplace=True)
+    nogo = (resultsdf.rt==1000.)&(resultsdf.ssrt==1000.)&(resultsdf.ttype==0.)
+    resultsdf.loc[nogo, 'response'] = 0
+    resultsdf.loc[nogo, 'acc'] = 1
 
     if bootstrap:
         resultsdf = bootstrap_data(resultsdf, nsubjects=bootinfo['nsubjects'], n=bootinfo['ntrials'], groups=bootinfo['groups'])
@@ -352,34 +605,39 @@ def pandaify_results(gort, ssrt, tb=.7, bootstrap=False, bootinfo={'nsubjects':2
 
 
 def bootstrap_data(data, nsubjects=25, n=120, groups=['cond', 'ssd']):
-    """ generates n resampled datasets using rwr()
-    for bootstrapping model fits
+    """ generates nsubjects resampled datasets (n trials drawn with
+    replacement from all rows of data) for bootstrapping model fits.
+    All resample indices are drawn at once and the rows gathered with a
+    single take (groups is unused, see bootstrap_index for stratified resampling)
+    ::Returns::
+        DataFrame with idx (resample) and trial (0...n-1) columns
     """
-    df = data.copy()
-    bootlist = []
-    idxList = []
+    df = data.reset_index(drop=True)
     if 'idx' in df.columns:
         df = df.drop('idx', axis=1)
     if n == None:
         n = len(df)
-    # bootdfList = []
-    # for level, levelDF in df.groupby(groups[0]):
-    bootlist = []
-    for idx in range(nsubjects):
-        boots = df.reset_index(drop=True)
-        orig_ix = np.asarray(boots.index[:])
-        resampled_ix = rwr(orig_ix, get_index=True, n=n)
-        bootdf = df.iloc[resampled_ix]
-        bootdf = bootdf.copy()
-        bootdf.insert(0, 'idx', idx)
-        bootdf['trial'] = np.arange(bootdf.shape[0])
-        bootlist.append(bootdf)
-    # concatenate and return all resampled conditions
-    bootdf = pd.concat(bootlist)
-    bootdf.reset_index(drop=True, inplace=True)
-    # bootdfList.append(bootdf)
-    # bootdf = pd.concat(bootdfList)
-    return bootdf
+    resampled_ix = np.floor(np.random.rand(nsubjects, n) * len(df)).astype(int)
+    bootdf = df.take(resampled_ix.ravel())
+    bootdf.insert(0, 'idx', np.repeat(np.arange(nsubjects), n))
+    bootdf['trial'] = np.tile(np.arange(n), nsubjects)
+    return bootdf.reset_index(drop=True)
+
+
+def bootstrap_index(codes, nboot, rng=None):
+    """ row indices (nboot x ntrials) of nboot bootstrap resamples of the
+    trials, each trial drawn with replacement from the trials of its stratum
+    (codes, e.g. trials.group_codes) so every resample keeps the trial count
+    of every stratum. Row r holds the trials of resample r; all resamples
+    are drawn at once
+    """
+    if rng is None:
+        rng = np.random
+    order = np.argsort(codes, kind='mergesort')
+    counts = np.bincount(codes)
+    starts = np.cumsum(counts) - counts
+    draws = (rng.random_sample((nboot, codes.size)) * counts[codes]).astype(np.int64)
+    return order[starts[codes] + draws]
 
 
 def rwr(X, get_index=False, n=None):
@@ -488,6 +746,7 @@ def kde_fit_quantiles(rtquants, nsamples=1000, bw=.1):
     """ takes quantile estimates and fits cumulative density function
     returns samples to pass to sns.kdeplot()
     """
+    from sklearn.neighbors import KernelDensity
     kdefit = KernelDensity(kernel='gaussian', bandwidth=bw).fit(rtquants)
     samples = kdefit.sample(n_samples=nsamples).flatten()
     return samples
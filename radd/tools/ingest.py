@@ -0,0 +1,218 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import numpy as np
+import pandas as pd
+from radd.tools import analyze
+
+# Chunked ingestion of trials data.
+#
+# TrialSummary keeps per-group sufficient statistics that are updated one
+# chunk of trials at a time, so large CSV/Parquet files never have to be held
+# in memory:
+#
+#   groupN:   trials per group
+#   goAcc:    go trials & correct go trials per group
+#   stopAcc:  stop trials (probe==1 if present) & correct stops per group x ssd
+#   stopN:    stop trials per group x ssd (for mean SSDs, see make_ssd_df)
+#   rtHist:   responses per group x ttype x acc x rt bin (sparse histogram
+#             with bins of width resolution)
+#
+# The RT histograms are the quantile sketches: their cumulative counts give
+# the order statistics of every group, so RT quantiles and their standard
+# errors (analyze.sorted_mquantiles / sorted_quantile_se with freq) match
+# DataHandler's. By default (resolution=None) every distinct RT is kept, so
+# observedDF & wtsDF are exact and memory grows with the number of distinct
+# RTs. With a bin width, quantiles are exact whenever RTs are recorded at (a
+# multiple of) resolution and otherwise off by at most resolution/2. The
+# quantile weights (wtsDF) are ratios of Maritz-Jarrett SEs, which weight the
+# order statistics around each quantile, so binning error is amplified there:
+# on the continuous eLife RTs (resolution=.0001) quantiles are within 5e-5 of
+# DataHandler's but weights differ by up to ~.01.
+
+
+class TrialSummary(object):
+    """ per-group sufficient statistics of trials data (see module notes)
+    ::Arguments::
+        groups (list): columns defining the groups (e.g. ['idx', 'Cond']).
+            'flat' is added to chunks without a flat column
+        resolution (float): RT histogram bin width (sec), None (default) to
+            keep exact RTs (see module notes)
+        rtmax (float): RTs >= rtmax are excluded from the RT quantiles (as in
+            analyze.make_rt_index)
+    """
+    def __init__(self, groups=['idx'], resolution=None, rtmax=5.):
+        self.groups = list(groups)
+        self.resolution = resolution
+        self.rtmax = rtmax
+        self.ntrials = 0
+        self.groupN = None
+        self.goAcc = None
+        self.stopAcc = None
+        self.stopN = None
+        self.rtHist = None
+
+    def update(self, data):
+        """ add a chunk of trials (DataFrame) to the summaries
+        """
+        if 'flat' in self.groups and 'flat' not in data.columns:
+            data = data.assign(flat='flat')
+        if pd.api.types.is_numeric_dtype(data.ttype):
+            isgo, isstop = data.ttype.values==1., data.ttype.values==0.
+        else:
+            isgo, isstop = data.ttype.values=='go', data.ttype.values=='stop'
+
+        self.groupN = accumulate(self.groupN, data.groupby(self.groups, observed=True).size())
+        self.goAcc = accumulate(self.goAcc, data[isgo].groupby(self.groups, observed=True).acc.agg(['sum', 'count']))
+        if 'ssd' in data.columns:
+            self.stopN = accumulate(self.stopN, data[isstop].groupby(self.groups + ['ssd'], observed=True).size())
+            if 'probe' in data.columns:
+                isstop = isstop & (data.probe.values==1)
+            stopAcc = data[isstop].groupby(self.groups + ['ssd'], observed=True).acc.agg(['sum', 'count'])
+            self.stopAcc = accumulate(self.stopAcc, stopAcc)
+
+        respdf = data[data.response.values==1]
+        if self.resolution is None:
+            rtbin = respdf.rt.values.astype(float)
+        else:
+            rtbin = np.round(respdf.rt.values / self.resolution).astype(np.int64)
+        hist = respdf.assign(rtbin=rtbin).groupby(self.groups + ['ttype', 'acc', 'rtbin'], observed=True).size()
+        self.rtHist = accumulate(self.rtHist, hist)
+        self.ntrials += len(data)
+
+    def make_rt_index(self, ssd_method='all'):
+        """ analyze.make_rt_index from the summaries: keys, gac, sacc, ssds and
+        frequency-weighted sorted RT segments (values, starts, counts, freq)
+        for 'cor', 'err' and 'cells'
+        """
+        groupN = self.groupN.sort_index()
+        keys = groupN.index.to_frame(index=False)
+        keys.columns = self.groups
+        ngroups = len(keys)
+        codes = keys.assign(code=np.arange(ngroups))
+
+        goAcc = self.goAcc.reindex(groupN.index)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            index = {'keys': keys, 'gac': (goAcc['sum'] / goAcc['count']).values}
+
+        index['sacc'], index['ssds'] = None, None
+        if self.stopAcc is not None:
+            if ssd_method=='all':
+                stopAcc = self.stopAcc.unstack('ssd').sort_index(axis=1).reindex(groupN.index)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    index['sacc'] = stopAcc['sum'].values / stopAcc['count'].values
+                index['ssds'] = stopAcc['sum'].columns.values.astype(float)
+            else:
+                stopAcc = self.stopAcc.groupby(level=self.groups).sum().reindex(groupN.index)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    index['sacc'] = (stopAcc['sum'] / stopAcc['count']).values[:, None]
+
+        hist = self.rtHist.reset_index(name='n')
+        hist = hist.merge(codes, on=self.groups, how='left')
+        rt = self.bin_rts(hist.rtbin.values)
+        acc = hist.acc.values.astype(float)
+        fast = rt < self.rtmax
+        for name, cor in [('cor', 1.), ('err', 0.)]:
+            segdf = hist[fast & (acc==cor)].groupby(['code', 'rtbin']).n.sum().reset_index()
+            index[name] = hist_segments(segdf.code.values, self.bin_rts(segdf.rtbin.values), segdf.n.values, ngroups)
+
+        cellkeys = hist[self.groups + ['ttype', 'acc']].drop_duplicates()
+        cellkeys = cellkeys.sort_values(self.groups + ['ttype', 'acc']).assign(cell=np.arange(len(cellkeys)))
+        hist = hist.merge(cellkeys, on=self.groups + ['ttype', 'acc'])
+        index['cells'] = hist_segments(hist.cell.values, self.bin_rts(hist.rtbin.values), hist.n.values, len(cellkeys))
+        return index
+
+    def bin_rts(self, rtbin):
+        """ RTs of histogram bins
+        """
+        if self.resolution is None:
+            return rtbin
+        return rtbin * self.resolution
+
+    def make_observed(self, quantiles=np.arange(.1, 1.,.1), ssd_method='all', weighted=True, max_wt=3., wts_method='mj'):
+        """ observedDF & wtsDF (as made by DataHandler for the same groups,
+        see module notes for the binning error of binned summaries)
+        ::Returns:: observedDF, wtsDF
+        """
+        index = self.make_rt_index(ssd_method=ssd_method)
+        cq, eq = analyze.index_quantiles(index, quantiles)
+        q_cols = ['c' + str(int(n * 100)) for n in quantiles] + ['e' + str(int(n * 100)) for n in quantiles]
+        p_cols = ['acc']
+        if index['ssds'] is not None:
+            p_cols = p_cols + np.unique(np.round(index['ssds'], 1).astype(int)).tolist()
+        elif index['sacc'] is not None:
+            p_cols = p_cols + ['sacc']
+        obsvalues = analyze.index_observed(index, cq, eq, p_cols)
+        observedDF = pd.concat([index['keys'], pd.DataFrame(obsvalues, columns=p_cols+q_cols)], axis=1)
+
+        wtsDF = observedDF.copy()
+        wtsDF.loc[:, p_cols+q_cols] = 1.
+        if weighted:
+            nidx = index['keys'].idx.unique().size
+            nsplits = len(index['keys']) // nidx
+            qwts = analyze.index_quant_weights(index, nidx, nsplits=nsplits, prob=quantiles, max_wt=max_wt, method=wts_method)
+            wtsDF.loc[:, q_cols] = qwts.reshape(wtsDF.shape[0], -1)
+            # accuracy wts are 1 (see analyze.idx_acc_weights)
+            wtsDF.loc[:, 'acc':] = wtsDF.loc[:, 'acc':].apply(analyze.fill_nan_vals, axis=1)
+        return observedDF, wtsDF
+
+    def make_ssd_df(self, conds=[], ssd_method='all', scale=.001):
+        """ ssdDF (as made by analyze.get_model_ssds): sorted SSDs of the
+        probe stop trials (ssd_method='all') or mean SSD of all stop trials
+        ('central') of every conds x idx group, in sec (scale)
+        ::Arguments::
+            conds (list): condition columns, a subset of groups
+        ::Returns:: ssdDF
+        """
+        groups = list(conds) + ['idx']
+        if ssd_method=='all':
+            ssds = self.stopAcc['count'].groupby(level=groups + ['ssd']).sum().reset_index()
+            ssds = ssds.assign(col=ssds.groupby(groups).cumcount(), ssd=ssds.ssd * scale)
+            ssdDF = ssds.set_index(groups + ['col']).ssd.unstack('col').reset_index()
+            ssdDF.columns.name = None
+        else:
+            stopN = self.stopN.groupby(level=groups + ['ssd']).sum().reset_index(name='n')
+            stopN = stopN.assign(wssd=stopN.ssd * stopN.n)
+            sums = stopN.groupby(groups)[['wssd', 'n']].sum()
+            ssdDF = (sums.wssd / sums.n * scale).reset_index(name=0)
+        return ssdDF
+
+
+def accumulate(total, new):
+    """ add counts/sums (Series or DataFrame) aligned on their index
+    """
+    if total is None:
+        return new
+    return total.add(new, fill_value=0)
+
+
+def hist_segments(codes, values, freq, nsegments):
+    """ frequency-weighted sorted segments from (segment code, value, count)
+    rows: values sorted by (code, value)
+    ::Returns:: values, starts, counts, freq
+    """
+    order = np.lexsort((values, codes))
+    counts = np.bincount(codes, minlength=nsegments)
+    starts = np.cumsum(counts) - counts
+    return values[order], starts, counts, freq[order].astype(float)
+
+
+def load_trials(path, groups=['idx'], chunksize=200000, columns=None, resolution=None, **kwargs):
+    """ read a trials CSV (or Parquet) file in chunks of chunksize rows and
+    summarize it into a TrialSummary without loading all trials at once
+    ::Arguments::
+        path (str): .csv (read with pd.read_csv) or .parquet/.pq (requires pyarrow)
+        groups (list): grouping columns (see TrialSummary)
+        resolution (float): RT histogram bin width (see TrialSummary)
+        columns (list): columns to read (default all)
+        kwargs: passed to pd.read_csv
+    ::Returns:: TrialSummary
+    """
+    summary = TrialSummary(groups=groups, resolution=resolution)
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns))
+    else:
+        chunks = pd.read_csv(path, chunksize=chunksize, usecols=columns, **kwargs)
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary
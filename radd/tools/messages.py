@@ -4,7 +4,6 @@ from copy import deepcopy
 from future.utils import listvalues
 import numpy as np
 from numpy.random import randint
-from lmfit import fit_report
 from time import strftime
 
 
@@ -0,0 +1,99 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import json
+from time import perf_counter
+import numpy as np
+import pandas as pd
+
+
+class Profiler(object):
+    """ accumulates per-stage wall time, call counts and kernel counters
+    for the fit pipeline (see Simulator/Optimizer.set_profiling)
+
+    Stages are timed with explicit perf_counter() pairs, i.e.
+        t0 = perf_counter(); ...; profiler.add('stage', t0)
+    so the disabled path costs a single attribute check.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+
+    def add(self, stage, t0):
+        """ add time elapsed since t0 (perf_counter) to stage
+        """
+        dt = perf_counter() - t0
+        rec = self.timers.get(stage)
+        if rec is None:
+            self.timers[stage] = [dt, 1]
+        else:
+            rec[0] += dt
+            rec[1] += 1
+
+    def count(self, name, value, n=1):
+        """ accumulate a counter (reported as the mean over n updates)
+        """
+        rec = self.counters.get(name)
+        if rec is None:
+            self.counters[name] = [float(value), n]
+        else:
+            rec[0] += value
+            rec[1] += n
+
+    def wrap(self, stage, fx):
+        """ returns fx with each call timed under stage
+        """
+        if fx is None:
+            return None
+        def timed(*args, **kwargs):
+            t0 = perf_counter()
+            out = fx(*args, **kwargs)
+            self.add(stage, t0)
+            return out
+        return timed
+
+    def report(self):
+        """ ::Returns:: DataFrame of stage timers (total/mean seconds, ncalls, pct of
+        total) sorted by total time. If lmfit/global optimizer stages were recorded,
+        optimizer overhead (minimizer time not spent in cost_fx or callbacks)
+        is added as its own row
+        """
+        timers = {k: list(v) for k, v in self.timers.items()}
+        for outer in ['lmfit', 'global']:
+            if outer in timers:
+                inner = '{}_cost_fx'.format(outer), '{}_callback'.format(outer)
+                spent = np.sum([timers[k][0] for k in inner if k in timers])
+                timers[outer+'_overhead'] = [timers[outer][0] - spent, timers[outer][1]]
+        if not timers:
+            return pd.DataFrame(columns=['total', 'ncalls', 'mean', 'pct'])
+        df = pd.DataFrame(timers, index=['total', 'ncalls']).T
+        df['ncalls'] = df.ncalls.astype(int)
+        df['mean'] = df.total / df.ncalls
+        top = [k for k in ['lmfit', 'global'] if k in timers]
+        ref = df.loc[top, 'total'].sum() if top else df.total.sum()
+        df['pct'] = 100 * df.total / ref
+        df.index.name = 'stage'
+        return df.sort_values('total', ascending=False)
+
+    def counter_report(self):
+        """ ::Returns:: Series with the mean value of each kernel counter
+        """
+        return pd.Series({k: v[0] / v[1] for k, v in self.counters.items()})
+
+    def to_dict(self):
+        return {'timers': self.report().reset_index().to_dict(orient='records'),
+                'counters': self.counter_report().to_dict()}
+
+    def save(self, path):
+        """ export timers and counters to path: a single .json file, otherwise
+        timers to path (.csv) and counters to <path>_counters.csv
+        """
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
+        else:
+            self.report().to_csv(path)
+            root = path[:-4] if path.endswith('.csv') else path
+            self.counter_report().to_frame('mean').to_csv(root + '_counters.csv', index_label='counter')
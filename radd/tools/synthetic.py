@@ -0,0 +1,140 @@
+#!/usr/local/bin/env python
+from __future__ import division
+from collections import deque
+import numpy as np
+import pandas as pd
+
+# Large synthetic datasets.
+#
+# generate_trials simulates the trials of one synthetic subject per row of a
+# parameter table with a model's Simulator and yields them in batches of
+# subjects, so only the batches in flight are ever held in memory (the
+# Simulator keeps one subject's random arrays at a time and no traces).
+# write_trials streams the batches to a CSV or Parquet file. Subjects are
+# simulated from their own seeds, so the trials do not depend on batchsize
+# or the number of worker processes.
+
+# model shared by the batches of a worker process (set once per
+# generate_trials call, see init_worker)
+_shared = {}
+
+# Simulator attributes replaced by simulate_batch
+sim_state = ['rProb', 'rProbSS', 'rProbSS3d', 'goRT', 'ssRT', 'vectors', 'pmatrix_vals']
+
+
+def subject_params(model, params):
+    """ parameter dicts (model.inits updated with each row of params) and idx
+    of every synthetic subject. Conditional parameters are read from their
+    pcmap columns (e.g. v_bsl, v_pnl) when present
+    ::Arguments::
+        params (DataFrame): one row per subject, parameter columns (+ idx)
+    ::Returns:: list of (idx, pdict)
+    """
+    params = params.reset_index(drop=True)
+    idxlist = params['idx'].tolist() if 'idx' in params.columns else list(range(1, len(params)+1))
+    subjects = []
+    for idx, row in zip(idxlist, params.to_dict('records')):
+        p = dict(model.inits)
+        p.update({pkey: val for pkey, val in row.items() if pkey in model.inits})
+        for pkey, pcols in model.pcmap.items():
+            if all(pc in row for pc in pcols):
+                p[pkey] = np.array([row[pc] for pc in pcols])
+        subjects.append((idx, p))
+    return subjects
+
+
+def init_worker(model):
+    _shared['model'] = model
+
+
+def simulate_batch(batch):
+    """ simulate the trials of a batch of (idx, pdict, seed) subjects with the
+    shared model's Simulator. Each subject's random arrays are drawn from its
+    own RandomState (the global numpy RNG is not touched)
+    ::Returns:: DataFrame (idx + Simulator.simulate_model(analyze=False) columns)
+    """
+    sim = _shared['model'].sim
+    dfList = []
+    for idx, p, seed in batch:
+        sim.make_io_vectors(rng=np.random.RandomState(seed))
+        sim.set_pconstant_values_matrix(p)
+        df = sim.simulate_model(p, analyze=False).to_frame()
+        df.insert(0, 'idx', idx)
+        dfList.append(df)
+    return pd.concat(dfList, ignore_index=True)
+
+
+def generate_trials(model, params, ntrials=None, batchsize=10, nproc=1, seed=None):
+    """ yield simulated trials (DataFrames) of batchsize synthetic subjects at
+    a time, one subject per row of params (see subject_params)
+    ::Arguments::
+        model (build.Model): model (kind, conditions, ssds, tb) to simulate
+        ntrials (int): trials per subject & condition (default fitparams.ntrials)
+        nproc (int): number of worker processes (each receives a copy of the
+            model once); at most 2*nproc batches are in flight at once
+        seed (int): seed for the per-subject random streams
+    """
+    subjects = subject_params(model, params)
+    seeds = np.random.RandomState(seed).randint(0, 2**31-1, size=len(subjects))
+    tasks = [(idx, p, s) for (idx, p), s in zip(subjects, seeds)]
+    batches = [tasks[i:i+batchsize] for i in range(0, len(tasks), batchsize)]
+
+    # random arrays & constant params replaced while simulating and the global
+    # RNG (drawn from when ntrials changes) are restored after
+    simState = {attr: getattr(model.sim, attr) for attr in sim_state if hasattr(model.sim, attr)}
+    rngState = np.random.get_state()
+    ntrials0 = model.fitparams['ntrials']
+    if ntrials is not None and ntrials != ntrials0:
+        model.set_fitparams(ntrials=ntrials)
+    try:
+        if nproc == 1:
+            init_worker(model)
+            for batch in batches:
+                yield simulate_batch(batch)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=nproc, initializer=init_worker, initargs=(model,)) as pool:
+                pending = deque()
+                for batch in batches:
+                    pending.append(pool.submit(simulate_batch, batch))
+                    if len(pending) >= 2 * nproc:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+    finally:
+        _shared.clear()
+        if model.fitparams['ntrials'] != ntrials0:
+            model.set_fitparams(ntrials=ntrials0)
+        for attr, val in simState.items():
+            setattr(model.sim, attr, val)
+        np.random.set_state(rngState)
+
+
+def write_trials(model, params, path, ntrials=None, batchsize=10, nproc=1, seed=None, **kwargs):
+    """ simulate trials of every subject in params (see generate_trials) and
+    stream them to path, one batch of subjects at a time
+    ::Arguments::
+        path (str): .csv (appended with DataFrame.to_csv) or .parquet/.pq
+            (one row group per batch, requires pyarrow)
+        kwargs: passed to DataFrame.to_csv
+    ::Returns:: number of trials written
+    """
+    batches = generate_trials(model, params, ntrials=ntrials, batchsize=batchsize, nproc=nproc, seed=seed)
+    ntotal = 0
+    if path.endswith('.parquet') or path.endswith('.pq'):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for df in batches:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            ntotal += len(df)
+        if writer is not None:
+            writer.close()
+    else:
+        for i, df in enumerate(batches):
+            df.to_csv(path, mode='w' if i==0 else 'a', header=i==0, index=False, **kwargs)
+            ntotal += len(df)
+    return ntotal
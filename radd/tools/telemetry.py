@@ -0,0 +1,185 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import json
+import numpy as np
+
+
+class NullSink(object):
+    """ telemetry sink that discards everything (default for headless fits)
+    """
+    def emit(self, fev, fmin, x):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RingBufferSink(object):
+    """ records the last (fev, fmin, x) emissions in preallocated arrays
+    ::Arguments::
+        size (int):
+            number of records kept (oldest are overwritten)
+        nparams (int):
+            length of x (allocated on first emit if None)
+    """
+    def __init__(self, size=1000, nparams=None):
+        self.size = int(size)
+        self.fev = np.zeros(self.size, dtype=np.int64)
+        self.fmin = np.full(self.size, np.nan)
+        self.x = None
+        self.n = 0
+        if nparams is not None:
+            self.x = np.full((self.size, nparams), np.nan)
+
+    def emit(self, fev, fmin, x):
+        i = self.n % self.size
+        if self.x is None:
+            self.x = np.full((self.size, np.size(x)), np.nan)
+        self.fev[i] = fev
+        self.fmin[i] = fmin
+        self.x[i] = x
+        self.n += 1
+
+    def to_arrays(self):
+        """ returns fev, fmin and x arrays in the order they were emitted
+        """
+        if self.n <= self.size:
+            ix = np.arange(self.n)
+        else:
+            ix = np.roll(np.arange(self.size), -(self.n % self.size))
+        x = self.x[ix] if self.x is not None else np.empty((0, 0))
+        return self.fev[ix], self.fmin[ix], x
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONLinesSink(object):
+    """ appends one JSON record per emission to a file, written in batches
+    ::Arguments::
+        path (str):
+            output file (opened in append mode on each write)
+        batch (int):
+            number of records buffered between writes
+        label (str):
+            optional tag added to every record (e.g. subject idx)
+    """
+    def __init__(self, path, batch=100, label=None):
+        self.path = path
+        self.batch = int(batch)
+        self.label = label
+        self.buffer = []
+
+    def emit(self, fev, fmin, x):
+        rec = {'fev': int(fev), 'fmin': float(fmin), 'x': np.asarray(x, dtype=float).tolist()}
+        if self.label is not None:
+            rec['label'] = self.label
+        self.buffer.append(json.dumps(rec))
+        if len(self.buffer) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with open(self.path, 'a') as f:
+            f.write('\n'.join(self.buffer) + '\n')
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+
+
+class ProgressSink(object):
+    """ forwards emissions to a utils.PBinJ progress bar (best / current fmin)
+    """
+    def __init__(self, pbar):
+        self.pbar = pbar
+        self.best = np.inf
+
+    def emit(self, fev, fmin, x):
+        from radd.tools.utils import MyFloat
+        self.best = min(self.best, fmin)
+        status = (MyFloat(self.best), MyFloat(fmin))
+        self.pbar.update(value=fev, status=status)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.pbar.clear()
+
+
+class TeeSink(object):
+    """ forwards emissions to multiple sinks
+    """
+    def __init__(self, *sinks):
+        self.sinks = [s for s in sinks if s is not None]
+
+    def emit(self, fev, fmin, x):
+        for s in self.sinks:
+            s.emit(fev, fmin, x)
+
+    def flush(self):
+        for s in self.sinks:
+            s.flush()
+
+    def close(self):
+        for s in self.sinks:
+            s.close()
+
+
+class Throttle(object):
+    """ tracks the running minimum on every call but only emits to the
+    sink once every `every` calls (and on flush), so per-evaluation cost
+    is a counter increment and a float comparison
+    ::Arguments::
+        sink (object):
+            any object with emit(fev, fmin, x), flush() and close()
+        every (int):
+            emit every n-th call
+    """
+    def __init__(self, sink=None, every=10):
+        self.sink = NullSink() if sink is None else sink
+        self.every = max(int(every), 1)
+        self.reset()
+
+    def reset(self):
+        self.ncalls = 0
+        self.nemit = 0
+        self.fmin = np.inf
+        self.xmin = None
+
+    def __call__(self, fmin, x=None, fev=None):
+        """ returns True if fmin is a new minimum
+        """
+        self.ncalls += 1
+        improved = fmin < self.fmin
+        if improved:
+            self.fmin = fmin
+            self.xmin = np.array(x() if callable(x) else x, dtype=float)
+        if self.ncalls - self.nemit >= self.every:
+            self.emit(fmin, x, fev)
+        return improved
+
+    def emit(self, fmin, x=None, fev=None):
+        self.nemit = self.ncalls
+        if fev is None:
+            fev = self.ncalls
+        if callable(x):
+            x = x()
+        self.sink.emit(fev, fmin, x)
+
+    def flush(self):
+        if self.ncalls > self.nemit and self.xmin is not None:
+            self.emit(self.fmin, self.xmin)
+        self.sink.flush()
+
+    def close(self):
+        self.flush()
+        self.sink.close()
@@ -0,0 +1,182 @@
+#!/usr/local/bin/env python
+from __future__ import division
+import numpy as np
+import pandas as pd
+
+# Compact trial tables.
+#
+# compact_trials normalizes trials data once into narrow dtypes:
+#
+#   idx, condition (object) columns   category
+#   ttype                             category ('go', 'stop') or int8 (1/0)
+#   response, acc                     int8
+#   rt                                float32
+#   ssd                               int16 (ms)
+#
+# Columns that cannot be represented exactly (nan in an integer column,
+# fractional or out-of-range ssds) keep their dtype. Groupby on category
+# columns must pass observed=True, otherwise pandas returns every
+# combination of levels, observed or not (see also group_codes).
+
+int8_cols = ['response', 'acc']
+
+# record layout of simulated trials (see SimTrials), condition fields
+# (int16 level codes) are prepended
+sim_fields = [('ttype', np.int8), ('ssd', np.int16), ('response', np.int8), ('acc', np.int8), ('rt', np.float64), ('ssrt', np.float64), ('trial', np.int32)]
+
+
+def compact_trials(data, conds=[]):
+    """ copy of data with compact dtypes (see module notes)
+    ::Arguments::
+        data (DataFrame): trials data (idx, ttype, response, acc, rt[, ssd])
+        conds (list): condition columns to store as categories (in addition
+            to object columns)
+    ::Returns:: DataFrame
+    """
+    columns = {}
+    for col in data.columns:
+        values = data[col]
+        if col=='ttype':
+            values = compact_ttype(values)
+        elif col=='idx' or col in conds or values.dtype==object:
+            values = values.astype('category')
+        elif col in int8_cols:
+            values = downcast_int(values, np.int8)
+        elif col=='rt':
+            values = values.astype(np.float32)
+        elif col=='ssd':
+            values = downcast_int(values, np.int16)
+        columns[col] = values
+    return pd.DataFrame(columns, index=data.index)
+
+
+def append_trials(data, new):
+    """ compact trial table with the rows of new (compacted) appended.
+    Category columns get the union of both tables' categories
+    ::Returns:: DataFrame (RangeIndex)
+    """
+    from pandas.api.types import union_categoricals
+    new = compact_trials(new)
+    columns = {}
+    for col in data.columns:
+        a, b = data[col], new[col]
+        if pd.api.types.is_categorical_dtype(a) or pd.api.types.is_categorical_dtype(b):
+            columns[col] = union_categoricals([a.astype('category'), b.astype('category')], sort_categories=True)
+        else:
+            columns[col] = np.concatenate([a.values, b.values])
+    return pd.DataFrame(columns)
+
+
+def compact_ttype(ttype):
+    if pd.api.types.is_numeric_dtype(ttype):
+        return downcast_int(ttype, np.int8)
+    return pd.Categorical(ttype, categories=['go', 'stop'])
+
+
+def downcast_int(values, dtype):
+    """ values as dtype if every value is an integer in range of dtype
+    """
+    if pd.api.types.is_bool_dtype(values) or pd.api.types.is_categorical_dtype(values):
+        return values
+    x = values.values
+    info = np.iinfo(dtype)
+    if not pd.api.types.is_numeric_dtype(values) or np.isnan(x.astype(float)).any():
+        return values
+    if x.size and (x.min() < info.min or x.max() > info.max or (x != np.round(x)).any()):
+        return values
+    return values.astype(dtype)
+
+
+def group_codes(data, groups):
+    """ integer code of every trial's group and the group keys (observed
+    combinations only, sorted as groupby(groups, sort=True)). Codes are built
+    from each column's sorted factorization, so category columns group by
+    their values without expanding unobserved combinations
+    ::Returns:: codes (array), keys (DataFrame, one row per group)
+    """
+    colcodes, uniques = [], []
+    for col in groups:
+        codes, levels = pd.factorize(data[col], sort=True)
+        colcodes.append(codes.astype(np.int64))
+        uniques.append(np.asarray(levels))
+    combined = np.zeros(len(data), dtype=np.int64)
+    for codes, levels in zip(colcodes, uniques):
+        combined = combined * levels.size + codes
+    ukeys, codes = np.unique(combined, return_inverse=True)
+    keys = {}
+    for col, levels in list(zip(groups, uniques))[::-1]:
+        keys[col] = levels[ukeys % levels.size]
+        ukeys = ukeys // levels.size
+    return codes, pd.DataFrame({col: keys[col] for col in groups})
+
+
+class SimTrials(object):
+    """ simulated trials of a Simulator (simulate_model(analyze=False)) as
+    one structured array, written directly from the go & stop RT arrays.
+    Records are ordered by condition level, then trial (stop trials first)
+    ::Attributes::
+        values (structured array): condition level codes (int16), ttype (code
+            of ['go', 'stop']), ssd (int16, ms; 1000 on go trials), response,
+            acc (int8), rt, ssrt (nan on go trials) and trial (int32) fields
+        levels (dict): level names of every condition field
+    """
+    def __init__(self, values, levels):
+        self.values = values
+        self.levels = levels
+
+    def __len__(self):
+        return self.values.size
+
+    def __getitem__(self, field):
+        return self.values[field]
+
+    def to_frame(self):
+        """ DataFrame of the records. Numeric columns are views of the record
+        fields (no copy), ttype & conditions are categoricals over the codes
+        """
+        columns = {}
+        for name in self.values.dtype.names:
+            values = self.values[name]
+            if name=='ttype':
+                values = pd.Categorical.from_codes(values, categories=['go', 'stop'])
+            elif name in self.levels:
+                values = pd.Categorical.from_codes(values, categories=self.levels[name])
+            columns[name] = values
+        return pd.DataFrame(columns, copy=False)
+
+
+def sim_trials(gort, ssrt, tb=.68, ssd=np.array([[.2, .25, .3, .35, .4]]), clmap=None):
+    """ SimTrials from the go RTs (nlevels x ntrials, the first nssd*nssPer
+    trials of each level are stop trials) and SSRTs (nlevels x nssd x nssPer)
+    of a simulation. A go response is an RT < tb, a stop trial response an
+    RT < SSRT. ssd (sec) is (1 | nlevels) x nssd
+    ::Returns:: SimTrials
+    """
+    nlevels, ntrials = gort.shape
+    nss = ssrt[0].size
+    nssPer = ssrt.shape[-1]
+    if nlevels==1 or clmap is None:
+        clmap = {'flat': ['flat']}
+    conds = list(clmap)
+    dtype = [(cond, np.int16) for cond in conds] + sim_fields
+    records = np.empty((nlevels, ntrials), dtype=dtype)
+
+    levelcodes = np.unravel_index(np.arange(nlevels), [len(clmap[cond]) for cond in conds])
+    for cond, codes in zip(conds, levelcodes):
+        records[cond] = codes[:, None]
+    ssd = np.broadcast_to(np.atleast_2d(ssd), (nlevels, ssrt.shape[1]))
+    ssdms = np.round(np.round(ssd, 2) * 1000)
+    records['ssd'][:, :nss] = np.repeat(ssdms, nssPer, axis=1)
+    records['ssd'][:, nss:] = 1000
+    records['ttype'][:, :nss] = 1
+    records['ttype'][:, nss:] = 0
+    records['rt'] = gort
+    records['ssrt'][:, :nss] = ssrt.reshape(nlevels, nss)
+    records['ssrt'][:, nss:] = np.nan
+    records['response'][:, :nss] = gort[:, :nss] < records['ssrt'][:, :nss]
+    records['response'][:, nss:] = gort[:, nss:] < tb
+    records['acc'][:, :nss] = 1 - records['response'][:, :nss]
+    records['acc'][:, nss:] = records['response'][:, nss:]
+    records['trial'] = np.arange(ntrials)
+    levels = {cond: list(clmap[cond]) for cond in conds}
+    return SimTrials(records.reshape(-1), levels)
@@ -1,77 +1,23 @@
 #!/usr/local/bin/env python
 from __future__ import division
 import sys
-from future.utils import listvalues
 from copy import deepcopy
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from radd.tools import colors, messages, analyze
 from radd.tools.analyze import bootstrap_data
-from radd import theta
-from IPython.display import display, Latex
-from ipywidgets import IntProgress, HTML, Box
-from itertools import product
+from radd.tools import telemetry, trials
 
 
 def pandaify_results(gort, ssrt, tb=.68, clmap=None, bootstrap=False, bootinfo={'nsubjects':25, 'ntrials':1000, 'groups':['ssd']}, ssd=np.array([[.2, .25, .3, .35, .4]])):
-
-    nlevels = gort.shape[0]
-    if nlevels==1:
-        clmap = {'flat': ['flat']}
-    conds = list(clmap)
-    cond_levels = list(product(*[list(levels) for levels in listvalues(clmap)]))
-    dfColumns=['ttype', 'ssd', 'response', 'acc', 'rt', 'ssrt', 'trial']
-    dfColumns = conds + dfColumns
-
-    # bootinfo['groups'] = bootinfo['groups'] + conds
-    dfList = []
-    for i in range(nlevels):
-        df = create_sim_dataframe(gort[i], ssrt[i], tb=tb, ssd=ssd)
-        for ii, c in enumerate(conds):
-            df[c] = cond_levels[i][ii]
-        dfList.append(df[dfColumns])
-
-    resultsdf = pd.concat(dfList)
-    resultsdf.reset_index(drop=True, inplace=True)
-
+    """ DataFrame of simulated trials (see trials.sim_trials), resampled with
+    bootstrap_data if bootstrap is True
+    """
+    resultsdf = trials.sim_trials(gort, ssrt, tb=tb, ssd=ssd, clmap=clmap).to_frame()
     if bootstrap:
         resultsdf = bootstrap_data(resultsdf, nsubjects=bootinfo['nsubjects'], n=bootinfo['ntrials'], groups=bootinfo['groups'])
-
     return resultsdf
 
 
-def create_sim_dataframe(rt, ssrt, tb=.68, ssd=np.array([.2, .25, .3, .35, .4])):
-
-    ntrials = rt.shape[0]
-    nssd, nssper = ssrt.shape
-    nss = ssrt.size
-    ssd = ssd.squeeze()
-    ttype = ['go']*ntrials
-    ttype[:nss] = ['stop']*nss
-    trials = np.arange(ntrials)
-
-    rts = rt.ravel()
-    ssrts = ssrt.reshape(nss)
-    ssrts = np.concatenate((ssrts, np.array([np.nan]*nss)))
-    ssds = np.hstack([np.hstack(np.sort(np.tile(ssd, nssper))), np.ones(ntrials-nss)])
-    ssds = (np.round(ssds, 2) * 1000).astype(int)
-    df = pd.DataFrame({'ttype':ttype, 'rt': rts, 'ssrt':ssrts, 'trial':trials, 'ssd':ssds})
-
-    df['response'] = np.nan
-    df['acc'] = np.nan
-    stopdf, godf = [df[df.ttype==ttype] for ttype in ['stop', 'go']]
-    godf.loc[godf.rt < tb, ['response', 'acc']] = 1.
-    godf.loc[godf.rt >= tb, ['response', 'acc']] = 0.
-    stopdf.loc[stopdf.rt < stopdf.ssrt, 'response'] = 1
-    stopdf.loc[stopdf.rt >= stopdf.ssrt, 'response'] = 0
-    stopdf.loc[stopdf.response==1, 'acc'] = 0
-    stopdf.loc[stopdf.response==0, 'acc'] = 1
-    return pd.concat([stopdf, godf])
-
-
-
 class PBinJ(object):
     """ initialize multiple progress bars for tracking nested stages of fitting routine
     """
@@ -80,6 +26,8 @@ class PBinJ(object):
         self.style_bar(n=n, value=value, status=status, color=color, width=width, height=height)
 
     def style_bar(self, n=1, value=0, status='{}', color='b', width='60%', height='22px'):
+        # widgets are only needed when progress is displayed in a notebook
+        from ipywidgets import IntProgress
         colordict = {'g': 'success', 'b': '', 'r': 'danger', 'y': 'warning', 'c': 'info'}
         bar_style = colordict[color]
         self.bar = IntProgress(min=0, max=n, value=value, bar_style=bar_style)
@@ -93,6 +41,7 @@ class PBinJ(object):
 
     def update(self, value=None, status=None):
         if not self.displayed:
+            from IPython.display import display
             display(self.bar)
             self.displayed=True
         if status is not None:
@@ -118,102 +67,105 @@ class GlobalCallback(object):
             function value of the trial minimum, and
         accept (bool):
             whether or not that minimum was accepted
+    Telemetry is emitted through a tools.telemetry sink every `every` calls
+    (progress bar if progress=True, tee'd with `sink` if one is provided)
     """
-    def __init__(self,  n=1, value=0, status='{:.5fz} / {:.5fz}', color='r', fmin=1000., method='basin'):
+    def __init__(self,  n=1, value=0, status='{:.5fz} / {:.5fz}', color='r', fmin=1000., method='basin', progress=True, sink=None, every=1):
 
         if method=='basin':
             self.callback = self.basinhopping_callback
         else:
             self.callback = self.evolution_callback
             fmin = 1000.
-        self.pbar = PBinJ(n=n, value=value, status=status, color=color)
+        self.pbar = None
+        if progress:
+            self.pbar = PBinJ(n=n, value=value, status=status, color=color)
+            sink = telemetry.TeeSink(telemetry.ProgressSink(self.pbar), sink)
+        self.telemetry = telemetry.Throttle(sink=sink, every=every)
         self.reset(history=True, gbasin=True, fmin=fmin)
         self.xhistory = []
-        # status=(MyFloat(x) for x in [fmin, fmin])
-        # self.pbar.update(value=0., status=status)
 
     def reset(self, history=True, bar=False, gbasin=False, get_call=False, fmin=1000.):
         fmin = MyFloat(fmin)
         if history:
-            self.history = [fmin]
+            self.hmin = fmin
+            self.naccept = 0
         if gbasin:
             self.gbasin = fmin
-        if bar:
+            self.telemetry.reset()
+        if bar and self.pbar is not None:
             self.pbar.reset_bar()
         if get_call:
             return self.callback
 
     def basinhopping_callback(self, x, fmin, accept):
-        if fmin <= np.min(self.history) and fmin<=self.gbasin:
+        if fmin <= self.hmin and fmin<=self.gbasin:
             self.gbasin = fmin
-            self.xhistory.append((fmin, x))
-            self.reset(history=True, bar=True)
+            self.xhistory.append((fmin, np.copy(x)))
+            self.reset(history=True, bar=True, fmin=fmin)
         if accept:
-            self.history.append(fmin)
-            status=(MyFloat(x) for x in [self.gbasin, fmin])
-            self.pbar.update(value=len(self.history), status=status)
+            self.hmin = min(self.hmin, fmin)
+            self.naccept += 1
+            self.telemetry(fmin, x, fev=self.naccept)
 
     def evolution_callback(self, xk, convergence):
-        #  convergence >= np.max(self.history) and
-        if (1-convergence)<self.gbasin:
-            self.gbasin = 1-convergence
-            self.xhistory.append((1-convergence, xk))
-            # print(self.xhistory[-1])
-            # self.reset(history=True, bar=True, fmin=0)
-
-        self.history.append(1-convergence)
-        status=(MyFloat(x) for x in [self.gbasin, 1-convergence])
-        self.pbar.update(value=len(self.history), status=status)
+        fmin = 1-convergence
+        if fmin<self.gbasin:
+            self.gbasin = fmin
+            self.xhistory.append((fmin, np.copy(xk)))
+        self.naccept += 1
+        self.telemetry(fmin, xk, fev=self.naccept)
 
     def clear(self):
-        self.pbar.clear()
+        self.telemetry.close()
 
 
 class GradientCallback(object):
-    """ A callback function for reporting basinhopping status
+    """ A callback function for reporting gradient descent (lmfit iter_cb) status
     Arguments:
-        x (array):
-            parameter values
-        fmin (float):
-            function value of the trial minimum, and
-        accept (bool):
-            whether or not that minimum was accepted
+        params (Parameters):
+            current lmfit parameters
+        iter (int):
+            number of function evaluations
+        resid (array):
+            residuals at params
+    Called on every cost evaluation so only the running minimum is updated
+    per call; telemetry is emitted every `every` evaluations.
     """
-    def __init__(self,  n=1, value=0, status='{:.5fz} / {:.5fz}', color='g', fmin=1000.):
-        self.pbar = PBinJ(n=n, value=value, status=status, color=color)
+    def __init__(self,  n=1, value=0, status='{:.5fz} / {:.5fz}', color='g', fmin=1000., progress=True, sink=None, every=25):
+        self.pbar = None
+        if progress:
+            self.pbar = PBinJ(n=n, value=value, status=status, color=color)
+            sink = telemetry.TeeSink(telemetry.ProgressSink(self.pbar), sink)
+        self.telemetry = telemetry.Throttle(sink=sink, every=every)
         self.reset(history=True, lbasin=True, fmin=fmin)
         self.xhistory = []
-        self.nsame = 0
-        # status=(MyFloat(x) for x in [self.lbasin, fmin])
-        # self.pbar.update(value=0., status=status)
 
     def reset(self, history=True, bar=False, lbasin=False, get_call=False, fmin=1000.):
         fmin = MyFloat(fmin)
         if history:
-            self.history = [fmin]
             self.nsame = 0
         if lbasin:
             self.lbasin = fmin
-        if bar:
+            self.telemetry.reset()
+        if bar and self.pbar is not None:
             self.pbar.reset_bar()
         if get_call:
             return self.callback
 
     def callback(self, params, iter, resid):
         fmin = np.sum(resid**2)
-        if fmin < np.min(self.history) and fmin<self.lbasin:
-            self.history.append(fmin)
+        # parameter values are only copied out of params when emitted
+        x = lambda: np.array(list(params.valuesdict().values()))
+        if self.telemetry(fmin, x, fev=iter) and fmin<self.lbasin:
             self.lbasin = fmin
-            self.xhistory.append((fmin, params.valuesdict()))
+            self.xhistory.append((fmin, self.telemetry.xmin))
             self.nsame = 0
         else:
             self.nsame += 1
-            #self.reset(history=True, bar=True)
-        status=(MyFloat(x) for x in [self.lbasin, fmin])
-        self.pbar.update(value=iter, status=status)
 
     def clear(self):
-        self.pbar.clear()
+        self.telemetry.close()
 
 
 
@@ -407,6 +407,9 @@ def plot_model_gof(gof_dict, aicwinner, pvary=None, yerr=None):
 
 
 def simulate_multiple(params, m, nsims=5, simfunc='adaptive'):
+    """ trial-level results of nsims runs per parameter set (for block
+    curves use m.opt.simRL.simulate_model_nruns, which runs in parallel)
+    """
     AX=params['AX']
     BX=params['BX']
     PX=params['PX']
@@ -478,10 +481,13 @@ def trialwise_model_predictions(params, model, df=None, nsims=5, nblocks=30, axe
     opt.simRL.update(data=df, learn=True, nblocks=nblocks)
 
     o = model.opt.simRL.data
-    r = simulate_multiple(params, m=model, nsims=nsims, simfunc=simfunc)
+    pset = deepcopy(params)
+    if simfunc!='adaptive':
+        pset.update({'AX': 0., 'BX': 0., 'PX': 0.})
     x = np.arange(1, nblocks+1)
 
-    rtSim, rtSimErr, accSim, accSimErr = opt.simRL.blockify_data(r, get_var=True, measures=['rt', 'acc'])
+    # nsims replicates simulated in parallel, returned as block curves
+    rtSim, rtSimErr, accSim, accSimErr = opt.simRL.simulate_model_nruns(pset, nruns=nsims, get_var=True)
     rtEmp, rtEmpErr, accEmp, accEmpErr = opt.simRL.blockify_data(o, get_var=True, measures=['rt', 'acc'])
 
     if simfunc=='adaptive':